@@ -0,0 +1,95 @@
+"""
+Stand-in for Ollama's embedding API for benchmarks and local testing.
+
+Serves /api/embed (batch), /api/embeddings (single) and /api/tags with
+deterministic unit vectors derived from a hash of each text, after an
+optional simulated model latency per request (plus a per-text cost for
+batches), so chroma_server.py can be load-tested without a GPU or model.
+--tail-fraction/--tail-ms make a share of requests slow, to exercise
+hedged embedding requests.
+
+Run with: python benchmarks/fake_embedding_server.py --port 11434 --latency-ms 20
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_embedding(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_handler(dim, latency_ms, per_text_ms, jitter_ms, tail_fraction=0.0, tail_ms=0.0):
+    class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        requests_served = 0
+
+        def log_message(self, *args):
+            pass
+
+        def _simulate_latency(self, texts):
+            delay = latency_ms + per_text_ms * max(0, texts - 1) + (random.uniform(0, jitter_ms) if jitter_ms else 0)
+            if tail_fraction and random.random() < tail_fraction:
+                delay += tail_ms
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+
+        def _send(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                self._send({'models': [{'name': 'fake-embed', 'dimensions': dim}]})
+            else:
+                self._send({'error': 'not found'}, 404)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            FakeEmbeddingHandler.requests_served += 1
+            if self.path == '/api/embed':
+                texts = body.get('input', [])
+                texts = [texts] if isinstance(texts, str) else texts
+                self._simulate_latency(len(texts))
+                self._send({'model': body.get('model'), 'embeddings': [fake_embedding(text, dim) for text in texts]})
+            elif self.path == '/api/embeddings':
+                self._simulate_latency(1)
+                self._send({'embedding': fake_embedding(body.get('prompt', ''), dim)})
+            else:
+                self._send({'error': 'not found'}, 404)
+
+    return FakeEmbeddingHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Ollama embedding server with configurable latency')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fixed latency per request')
+    parser.add_argument('--per-text-ms', type=float, default=0.0, help='extra latency per additional text in a batch')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform random extra latency')
+    parser.add_argument('--tail-fraction', type=float, default=0.0, help='share of requests given --tail-ms extra latency')
+    parser.add_argument('--tail-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    handler = make_handler(args.dim, args.latency_ms, args.per_text_ms, args.jitter_ms, args.tail_fraction, args.tail_ms)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Fake embedding server on http://{args.host}:{args.port} (dim={args.dim}, latency={args.latency_ms}ms)", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
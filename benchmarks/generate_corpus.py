@@ -0,0 +1,71 @@
+"""
+Synthetic entity corpus for benchmarking chroma_server.py.
+
+Writes NDJSON in the /add/stream format ({"entityId", "entityText",
+"metadata"} per line) with pronounceable multi-word names, a PERSON/ORG/GPE
+type mix and Zipf-distributed mention counts. Output is deterministic for
+a given --seed.
+
+Run with: python benchmarks/generate_corpus.py --count 100000 --output corpus.ndjson
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+SYLLABLES = [
+    'ka', 'ra', 'mi', 'sha', 'an', 'dev', 'pur', 'in', 'to', 'la', 'vi', 'su', 'ne', 'dra', 'ma', 'ho',
+    'ti', 'ba', 'gan', 'ri', 'ya', 'ko', 'sin', 'na', 'pa', 'lo', 'ji', 'ven', 'tar', 'mu', 'de', 'chi'
+]
+TYPES = ['PERSON', 'ORG', 'GPE']
+TYPE_WEIGHTS = [0.5, 0.35, 0.15]
+ORG_SUFFIXES = ['Industries', 'Motors', 'Group', 'Bank', 'Labs', 'Council', 'Party', 'United']
+
+
+def make_word(rng):
+    return ''.join(rng.choice(SYLLABLES, size=rng.integers(2, 4))).capitalize()
+
+
+def make_name(rng, entity_type):
+    if entity_type == 'ORG':
+        return f"{make_word(rng)} {rng.choice(ORG_SUFFIXES)}"
+    if entity_type == 'GPE':
+        return make_word(rng) + rng.choice(['pur', 'abad', 'nagar', ''])
+    return f"{make_word(rng)} {make_word(rng)}"
+
+
+def generate(count, seed=0, id_prefix='Entity/bench-'):
+    """
+    Yield /add/stream records for `count` synthetic entities.
+    """
+    rng = np.random.default_rng(seed)
+    types = rng.choice(TYPES, size=count, p=TYPE_WEIGHTS)
+    mentions = np.minimum(rng.zipf(1.6, size=count), 1_000_000)
+    for i in range(count):
+        name = make_name(rng, types[i])
+        yield {
+            'entityId': f"{id_prefix}{i}",
+            'entityText': name,
+            'metadata': {'name': name, 'type': str(types[i]), 'mentions': int(mentions[i])}
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic entity corpus as NDJSON')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help="output file ('-' for stdout)")
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        for record in generate(args.count, args.seed):
+            out.write(json.dumps(record) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
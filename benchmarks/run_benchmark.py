@@ -0,0 +1,269 @@
+"""
+End-to-end benchmark for chroma_server.py.
+
+Starts the fake embedding server and a chroma_server instance in a scratch
+directory (or targets --server-url), ingests a synthetic corpus through
+/add/stream, then drives concurrent load against /search, /search/batch and
+/add (upsert mode) for a fixed duration each. Reports p50/p95/p99 latency,
+throughput, errors and server RSS per phase as JSON, so runs with different
+corpus sizes or server settings can be compared.
+
+Run with:
+    python benchmarks/run_benchmark.py --corpus-size 100000 --concurrency 16 \
+        --duration 30 --output results/100k.json
+    python benchmarks/run_benchmark.py --server async --env VECTOR_ENGINE=int8
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+from generate_corpus import generate, make_word
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SERVER_SCRIPTS = {'flask': 'chroma_server.py', 'async': 'chroma_server_async.py'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(url, timeout, expect=200):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == expect:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def rss_mb(pid):
+    """
+    Current and peak resident set size of a process in MB (Linux /proc), or None.
+    """
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return {
+            'rssMb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+            'peakRssMb': round(int(fields['VmHWM'].split()[0]) / 1024, 1)
+        }
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def summarize(latencies, errors, elapsed, items_per_request=1):
+    latencies_ms = np.asarray(latencies) * 1000.0
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'durationSeconds': round(elapsed, 3),
+        'requestsPerSecond': round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        'itemsPerSecond': round(len(latencies) * items_per_request / elapsed, 1) if elapsed > 0 else None
+    }
+    if len(latencies_ms):
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary['latencyMs'] = {
+            'p50': round(float(p50), 2),
+            'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2),
+            'mean': round(float(latencies_ms.mean()), 2),
+            'max': round(float(latencies_ms.max()), 2)
+        }
+    return summary
+
+
+def run_load(make_request, concurrency, duration):
+    """
+    Call make_request(session, worker, n) from `concurrency` threads for
+    `duration` seconds. A request counts as an error when it raises or the
+    response status is not 2xx.
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        session = requests.Session()
+        local_latencies, local_errors, n = [], 0, 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = make_request(session, worker_id, n).ok
+            except requests.RequestException:
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            local_errors += 0 if ok else 1
+            n += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def query_text(rng, names, exact_fraction):
+    """
+    An entity name (fast-path / exact match) or a free-text query that needs embedding.
+    """
+    if rng.random() < exact_fraction:
+        return rng.choice(names)
+    words = rng.choice(names).split()
+    return f"{words[0]} {make_word(np.random.default_rng(rng.getrandbits(32)))}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chroma_server search and ingest')
+    parser.add_argument('--corpus-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--phases', default='ingest,search,batch,add')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per load phase')
+    parser.add_argument('--n-results', type=int, default=10)
+    parser.add_argument('--exact-fraction', type=float, default=0.5, help='share of queries that are exact entity names')
+    parser.add_argument('--batch-size', type=int, default=16, help='queries per /search/batch request')
+    parser.add_argument('--add-batch', type=int, default=32, help='entities per /add request')
+    parser.add_argument('--server', choices=sorted(SERVER_SCRIPTS), default='flask')
+    parser.add_argument('--server-url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid of --server-url, for RSS reporting')
+    parser.add_argument('--embed-latency-ms', type=float, default=20.0)
+    parser.add_argument('--embed-per-text-ms', type=float, default=0.5)
+    parser.add_argument('--embed-jitter-ms', type=float, default=5.0)
+    parser.add_argument('--env', action='append', default=[], help='extra KEY=VALUE for the started server')
+    parser.add_argument('--workdir', help='scratch directory for the started server (default: a temp dir)')
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    phases = [phase.strip() for phase in args.phases.split(',') if phase.strip()]
+    processes = []
+    report = {
+        'startedAt': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': vars(args),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'phases': {},
+        'rss': {}
+    }
+
+    try:
+        server_pid = args.server_pid
+        base_url = args.server_url.rstrip('/') if args.server_url else None
+        if base_url is None:
+            workdir = args.workdir or tempfile.mkdtemp(prefix='chroma-bench-')
+            embed_port, server_port = free_port(), free_port()
+            processes.append(subprocess.Popen([
+                sys.executable, os.path.join(BENCHMARK_DIR, 'fake_embedding_server.py'),
+                '--port', str(embed_port), '--latency-ms', str(args.embed_latency_ms),
+                '--per-text-ms', str(args.embed_per_text_ms), '--jitter-ms', str(args.embed_jitter_ms)
+            ], stdout=subprocess.DEVNULL))
+            wait_until(f"http://127.0.0.1:{embed_port}/api/tags", 30)
+
+            env = dict(os.environ, OLLAMA_URL=f"http://127.0.0.1:{embed_port}/", CHROMA_SERVER_PORT=str(server_port),
+                       CHROMA_SERVER_HOST='127.0.0.1')
+            env.update(item.split('=', 1) for item in args.env)
+            log = open(os.path.join(workdir, 'server.log'), 'w')
+            server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, SERVER_SCRIPTS[args.server])],
+                                      cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            processes.append(server)
+            server_pid = server.pid
+            base_url = f"http://127.0.0.1:{server_port}"
+            report['workdir'] = workdir
+
+        wait_until(f"{base_url}/ready", args.startup_timeout)
+        report['startupSeconds'] = requests.get(f"{base_url}/ready").json().get('startupSeconds')
+        report['rss']['afterStartup'] = rss_mb(server_pid)
+
+        names = [record['entityText'] for record in generate(args.corpus_size, args.seed)]
+        rng = random.Random(args.seed)
+
+        if 'ingest' in phases:
+            started = time.perf_counter()
+            lines = (json.dumps(record).encode('utf-8') + b'\n' for record in generate(args.corpus_size, args.seed))
+            response = requests.post(f"{base_url}/add/stream", data=lines,
+                                     headers={'Content-Type': 'application/x-ndjson'}, stream=True)
+            summary = {}
+            for line in response.iter_lines():
+                if line:
+                    summary = json.loads(line)
+            elapsed = time.perf_counter() - started
+            report['phases']['ingest'] = {
+                'entities': summary.get('processed'),
+                'failed': summary.get('failed'),
+                'durationSeconds': round(elapsed, 3),
+                'entitiesPerSecond': round((summary.get('processed') or 0) / elapsed, 1)
+            }
+            report['rss']['afterIngest'] = rss_mb(server_pid)
+
+        if 'search' in phases:
+            def search(session, worker, n):
+                return session.post(f"{base_url}/search", json={
+                    'query': query_text(rng, names, args.exact_fraction), 'nResults': args.n_results
+                })
+            report['phases']['search'] = summarize(*run_load(search, args.concurrency, args.duration))
+            report['rss']['afterSearch'] = rss_mb(server_pid)
+
+        if 'batch' in phases:
+            def search_batch(session, worker, n):
+                return session.post(f"{base_url}/search/batch", json={'queries': [
+                    {'query': query_text(rng, names, args.exact_fraction), 'nResults': args.n_results}
+                    for _ in range(args.batch_size)
+                ]})
+            latencies, errors, elapsed = run_load(search_batch, args.concurrency, args.duration)
+            report['phases']['batch'] = summarize(latencies, errors, elapsed, items_per_request=args.batch_size)
+            report['rss']['afterBatch'] = rss_mb(server_pid)
+
+        if 'add' in phases:
+            def add(session, worker, n):
+                ids = [f"Entity/bench-add-{worker}-{n}-{i}" for i in range(args.add_batch)]
+                texts = [f"{rng.choice(names)} {worker}-{n}-{i}" for i in range(args.add_batch)]
+                return session.post(f"{base_url}/add", json={
+                    'mode': 'upsert', 'entityIds': ids, 'entityTexts': texts,
+                    'metadata': [{'name': text, 'type': 'ORG'} for text in texts]
+                })
+            latencies, errors, elapsed = run_load(add, args.concurrency, args.duration)
+            report['phases']['add'] = summarize(latencies, errors, elapsed, items_per_request=args.add_batch)
+            report['rss']['afterAdd'] = rss_mb(server_pid)
+
+        report['serverStats'] = requests.get(f"{base_url}/stats").json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Resumable parallel backfill of the Chroma collection from an Entity dump.
+
+Streams ArangoDB Entity documents (the JsonlEntitySource format) from a JSONL
+or Parquet dump, embeds them in --chunk-size chunks on a pool of --workers
+processes, each with its own embedding backend, and writes them to the
+persistent collection through chroma_server's write path --write-batch
+entities at a time. After every write
+the number of input records handled is saved to the checkpoint file, so a
+rerun after an interruption continues after the last written batch
+(writes are upserts, so repeating part of a batch is harmless). Content
+hashes are recorded in the sync state, so a later /sync or chroma_sync.py
+run does not re-embed the backfilled entities.
+
+Workers are spawned and import only chroma_embedding, so they never open
+Chroma. The backfill takes CHROMA_SERVER_LOCK_FILE exclusively and refuses
+to run while a server holds the collection. Parquet dumps need pyarrow.
+
+Run with: python chroma_backfill.py entities.jsonl --workers 8 [--restart]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from chroma_embedding import EMBEDDING_BACKEND_NAME, OLLAMA_MAX_BATCH_SIZE, create_embedding_backend, fit_embedding_matrix
+from chroma_entity_sync import entity_content_hash, entity_record
+
+logger = logging.getLogger(__name__)
+
+WORKER_BACKEND = None
+
+
+def exit_with_parent(parent_pid):
+    # A killed backfill must not leave its workers running
+    while os.getppid() == parent_pid:
+        time.sleep(1.0)
+    os._exit(1)
+
+
+def init_worker(parent_pid):
+    global WORKER_BACKEND
+    WORKER_BACKEND = create_embedding_backend(EMBEDDING_BACKEND_NAME)
+    threading.Thread(target=exit_with_parent, args=(parent_pid,), daemon=True).start()
+
+
+def embed_chunk(texts):
+    return fit_embedding_matrix(WORKER_BACKEND.embed_batch(texts))
+
+
+def read_parquet(path, skip, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('Reading Parquet dumps requires pyarrow (pip install pyarrow)')
+    parquet = pq.ParquetFile(path)
+    # Row groups that were fully written are not read at all
+    row_groups = []
+    for i in range(parquet.num_row_groups):
+        rows = parquet.metadata.row_group(i).num_rows
+        if not row_groups and skip >= rows:
+            skip -= rows
+        else:
+            row_groups.append(i)
+    if not row_groups:
+        return
+    for batch in parquet.iter_batches(batch_size=batch_size, row_groups=row_groups):
+        documents = batch.to_pylist()
+        if skip >= len(documents):
+            skip -= len(documents)
+            continue
+        yield from documents[skip:]
+        skip = 0
+
+
+def read_jsonl(path, skip):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield json.loads(line)
+
+
+def read_documents(path, skip=0, batch_size=1024):
+    """
+    Entity documents from a .parquet file or a JSONL file, after the first `skip` records.
+    """
+    if path.endswith('.parquet'):
+        return read_parquet(path, skip, batch_size)
+    return read_jsonl(path, skip)
+
+
+def record_chunks(documents, size):
+    """
+    Yield (records, consumed): up to `size` (id, text, metadata) records and
+    the number of documents they were read from, which includes documents
+    skipped as invalid.
+    """
+    records, consumed = [], 0
+    for doc in documents:
+        consumed += 1
+        try:
+            records.append(entity_record(doc))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Skipping invalid entity document: {str(e)}")
+        if len(records) >= size:
+            yield records, consumed
+            records, consumed = [], 0
+    if consumed:
+        yield records, consumed
+
+
+def input_signature(path, collection_name):
+    stat = os.stat(path)
+    return {'input': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime, 'collection': collection_name}
+
+
+def load_checkpoint(path, signature, restart):
+    if restart or not os.path.exists(path):
+        return dict(signature, records=0, written=0, invalid=0)
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if any(checkpoint.get(key) != value for key, value in signature.items()):
+        raise SystemExit(f"Checkpoint {path} was written for a different input or collection; pass --restart to start over")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(dict(checkpoint, updatedAt=time.time()), f)
+    os.replace(temp_path, path)
+
+
+class BackfillWriter:
+    """
+    Buffers embedded records and writes them write_batch at a time with
+    `write` (chroma_server.write_entities), advancing the checkpoint and the
+    sync state's content hashes after each write.
+    """
+
+    def __init__(self, write, checkpoint, checkpoint_path, write_batch, state=None):
+        self.write = write
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.write_batch = write_batch
+        self.state = state
+        self.records, self.embeddings, self.consumed, self.invalid = [], [], 0, 0
+        self.started = time.perf_counter()
+        self.resumed_from = checkpoint['records']
+        self.written = 0
+
+    def add(self, records, consumed, embeddings):
+        self.records.extend(records)
+        if records:
+            self.embeddings.append(embeddings)
+        self.consumed += consumed
+        self.invalid += consumed - len(records)
+        if len(self.records) >= self.write_batch:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            ids = [record[0] for record in self.records]
+            documents = [record[1] for record in self.records]
+            metadatas = [record[2] for record in self.records]
+            batch_started = time.perf_counter()
+            # Chroma validates lists much faster than ndarrays
+            self.write(ids, np.vstack(self.embeddings).tolist(), documents, metadatas)
+            if self.state is not None:
+                self.state.put_hashes({
+                    entity_id: entity_content_hash(text, metadata)
+                    for entity_id, text, metadata in self.records
+                })
+            write_seconds = time.perf_counter() - batch_started
+            self.written += len(ids)
+            self.checkpoint['written'] += len(ids)
+        else:
+            write_seconds = 0.0
+        self.checkpoint['records'] += self.consumed
+        self.checkpoint['invalid'] += self.invalid
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+        if self.records:
+            logger.info(f"📦 {self.checkpoint['records']} records handled, {self.checkpoint['written']} written "
+                             f"({self.rate():.0f} entities/s, last write {write_seconds:.2f}s)")
+        self.records, self.embeddings, self.consumed, self.invalid = [], [], 0, 0
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embed an Entity dump into the Chroma collection, resumably and in parallel')
+    parser.add_argument('input', help='JSONL or .parquet file of ArangoDB Entity documents')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='embedding processes')
+    parser.add_argument('--chunk-size', type=int, default=OLLAMA_MAX_BATCH_SIZE, help='texts per embedding call')
+    parser.add_argument('--write-batch', type=int, default=5000, help='entities per collection upsert')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <input>.checkpoint.json)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint and start from the first record')
+    parser.add_argument('--no-sync-state', action='store_true', help='do not record content hashes in SYNC_STATE_PATH')
+    args = parser.parse_args()
+
+    # Imported here: spawned workers re-import this module and must not open Chroma
+    import chroma_server as core
+
+    server_lock = core.acquire_server_lock(exclusive=True)
+    if server_lock is None:
+        raise SystemExit(f"A server holds {core.CHROMA_SERVER_LOCK_FILE}; stop it before running the backfill")
+    checkpoint_path = args.checkpoint or f"{args.input}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path, input_signature(args.input, core.collection.name), args.restart)
+    if checkpoint['records']:
+        logger.info(f"🔁 Resuming {args.input} after {checkpoint['records']} records")
+    # Chroma rejects larger upserts
+    write_batch = min(args.write_batch, getattr(core.client, 'max_batch_size', args.write_batch))
+    state = None if args.no_sync_state else core.EntitySyncState(
+        core.SYNC_STATE_PATH, model=f"{core.EMBEDDING_BACKEND.model}:{core.EMBEDDING_TARGET_DIM}"
+    )
+    writer = BackfillWriter(core.write_entities, checkpoint, checkpoint_path, write_batch, state)
+
+    # Spawned workers start clean (no Chroma client, no server threads); each builds its own backend
+    context = multiprocessing.get_context('spawn')
+    # Enough chunks in flight to keep the workers busy while a write batch is upserted
+    max_pending = 2 * args.workers + write_batch // max(1, args.chunk_size)
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(os.getpid(),)) as pool:
+            for records, consumed in record_chunks(read_documents(args.input, checkpoint['records']), args.chunk_size):
+                future = pool.submit(embed_chunk, [record[1] for record in records]) if records else None
+                pending.append((records, consumed, future))
+                while len(pending) >= max_pending:
+                    records, consumed, future = pending.popleft()
+                    writer.add(records, consumed, future.result() if future else None)
+            while pending:
+                records, consumed, future = pending.popleft()
+                writer.add(records, consumed, future.result() if future else None)
+        writer.flush()
+    finally:
+        if state is not None:
+            state.close()
+        server_lock.close()
+
+    elapsed = time.perf_counter() - writer.started
+    print(json.dumps({
+        'input': checkpoint['input'],
+        'collection': checkpoint['collection'],
+        'resumedFrom': writer.resumed_from,
+        'records': checkpoint['records'],
+        'written': checkpoint['written'],
+        'writtenThisRun': writer.written,
+        'invalid': checkpoint['invalid'],
+        'workers': args.workers,
+        'elapsedSeconds': round(elapsed, 3),
+        'entitiesPerSecond': round(writer.rate(), 1),
+        'count': core.collection.count()
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Offline near-duplicate entity clustering for chroma_server.py.
+
+Pages every entity vector out of the serving collection into a memory-mapped
+file of unit vectors, then compares all pairs one --block-size x --block-size
+block at a time (a single matrix multiplication per block), so neither the
+similarity matrix nor the vectors have to fit in memory. Pairs with cosine
+similarity >= --threshold and the same metadata type (unless --any-type) are
+joined with union-find, i.e. single-linkage clusters. Each cluster's
+canonical entity is the member with the most mentions.
+
+Writes the canonical-ID map (CANONICAL_MAP_FILE) that chroma_server.py uses
+to collapse search results to one entry per canonical entity; running
+servers pick it up within CANONICAL_MAP_CHECK_SECONDS. --compact also writes
+a new collection holding only the canonical entities, with mentions summed
+over each cluster, and --activate points the collection alias at it (served
+after the next server restart).
+
+Run with: python chroma_dedup.py --threshold 0.95 --block-size 4096 [--compact]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import chroma_server as core
+
+
+def numeric(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def load_unit_vectors(path, page_size, mentions_field):
+    """
+    Page the serving collection into a float32 memmap of unit vectors at
+    path. Returns (ids, names, types, mentions, vectors).
+    """
+    total = core.collection.count()
+    vectors = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(total, core.EMBEDDING_TARGET_DIM))
+    ids, names, types, mentions = [], [], [], []
+    while len(ids) < total:
+        page = core.collection.get(limit=min(page_size, total - len(ids)), offset=len(ids),
+                                   include=['embeddings', 'metadatas'])
+        if not page['ids']:
+            break
+        matrix = core.fit_embedding_matrix(page['embeddings'])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors[len(ids):len(ids) + len(matrix)] = matrix / norms
+        for entity_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = metadata or {}
+            ids.append(entity_id)
+            names.append(core.entity_name_from_metadata(entity_id, metadata))
+            types.append(str(metadata.get('type', '')))
+            mentions.append(numeric(metadata.get(mentions_field)))
+    vectors.flush()
+    return ids, names, types, np.asarray(mentions, dtype=np.float64), vectors[:len(ids)]
+
+
+def similar_pairs(vectors, threshold, block_size, type_codes=None):
+    """
+    Yield (rows, cols) arrays of the pairs i < j with cosine similarity >=
+    threshold, one block of rows against one block of columns at a time.
+    """
+    total = len(vectors)
+    for start in range(0, total, block_size):
+        left = np.asarray(vectors[start:start + block_size])
+        for other in range(start, total, block_size):
+            right = left if other == start else np.asarray(vectors[other:other + block_size])
+            similar = left @ right.T >= threshold
+            if other == start:
+                similar = np.triu(similar, k=1)
+            rows, cols = np.nonzero(similar)
+            rows += start
+            cols += other
+            if type_codes is not None:
+                same_type = type_codes[rows] == type_codes[cols]
+                rows, cols = rows[same_type], cols[same_type]
+            if len(rows):
+                yield rows, cols
+        core.logger.info(f"🔗 Compared {min(start + block_size, total)}/{total} entities")
+
+
+def cluster_roots(total, pair_blocks):
+    """
+    Union-find over the pairs. Returns (root row of each row, number of pairs).
+    """
+    parent = list(range(total))
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    pairs = 0
+    for rows, cols in pair_blocks:
+        pairs += len(rows)
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.asarray([find(i) for i in range(total)], dtype=np.int64), pairs
+
+
+def canonical_rows(roots, mentions):
+    """
+    Row of each row's canonical entity: the cluster member with the most
+    mentions, the earliest row on ties.
+    """
+    rows = np.arange(len(roots))
+    order = np.lexsort((rows, -mentions, roots))
+    sorted_roots = roots[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_roots[1:] != sorted_roots[:-1]
+    group_start = np.maximum.accumulate(np.where(first, rows, 0))
+    canonical = np.empty(len(roots), dtype=np.int64)
+    canonical[order] = order[group_start]
+    return canonical
+
+
+def mention_total(value):
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def build_canonical_map(ids, names, canonical, mentions, threshold):
+    rows = np.arange(len(ids))
+    totals = np.bincount(canonical, weights=mentions, minlength=len(ids))
+    members = defaultdict(list)
+    aliases = {}
+    for row in np.flatnonzero(canonical != rows).tolist():
+        aliases[ids[row]] = ids[canonical[row]]
+        members[int(canonical[row])].append(ids[row])
+    return {
+        'version': time.strftime('%Y%m%dT%H%M%S'),
+        'collection': core.collection.name,
+        'threshold': threshold,
+        'entities': len(ids),
+        'canonical': {
+            ids[row]: {'name': names[row], 'aliases': alias_ids, 'mentions': mention_total(totals[row])}
+            for row, alias_ids in members.items()
+        },
+        'aliases': aliases
+    }
+
+
+def write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def write_compacted_collection(canonical_map, ids, mentions_field, batch_size):
+    """
+    Copy the canonical entities into a new versioned collection, with each
+    cluster's summed mentions and its alias count in their metadata.
+    """
+    name = f"{core.COLLECTION_NAME}_dedup{time.strftime('%Y%m%d%H%M%S')}"
+    target = core.open_serving_collection(core.client.create_collection(
+        name=name,
+        embedding_function=core.EMBEDDING_FUNCTION,
+        metadata=core.hnsw_collection_metadata()
+    ))
+    clusters = canonical_map['canonical']
+    keep = [entity_id for entity_id in ids if entity_id not in canonical_map['aliases']]
+    for start in range(0, len(keep), batch_size):
+        page = core.collection.get(ids=keep[start:start + batch_size], include=core.REBUILD_INCLUDE)
+        metadatas = []
+        for entity_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = dict(metadata or {})
+            if entity_id in clusters:
+                metadata[mentions_field] = clusters[entity_id]['mentions']
+                metadata['aliasCount'] = len(clusters[entity_id]['aliases'])
+            metadatas.append(metadata)
+        core.upsert_collection_page(target, dict(page, metadatas=metadatas))
+    return name, target.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate entities and write a canonical-ID map')
+    parser.add_argument('--threshold', type=float, default=0.95, help='cosine similarity at which two entities are duplicates')
+    parser.add_argument('--block-size', type=int, default=4096, help='rows per similarity block')
+    parser.add_argument('--any-type', action='store_true', help='also cluster entities whose metadata type differs')
+    parser.add_argument('--mentions-field', default='mentions', help='metadata field choosing the canonical entity')
+    parser.add_argument('--output', default=core.CANONICAL_MAP_FILE, help='canonical-ID map path (default: CANONICAL_MAP_FILE)')
+    parser.add_argument('--workdir', help='directory for the memory-mapped vectors (default: the system temp dir)')
+    parser.add_argument('--page-size', type=int, default=core.ENTITY_INDEX_PAGE_SIZE)
+    parser.add_argument('--compact', action='store_true', help='also write a collection of only the canonical entities')
+    parser.add_argument('--activate', action='store_true', help='point the collection alias at the compacted collection')
+    parser.add_argument('--batch-size', type=int, default=core.REBUILD_BATCH_SIZE, help='entities copied per batch by --compact')
+    args = parser.parse_args()
+    if not 0.0 < args.threshold <= 1.0:
+        raise SystemExit('--threshold must be in (0, 1]')
+    if args.activate and not args.compact:
+        raise SystemExit('--activate requires --compact')
+
+    report = {'threshold': args.threshold, 'collection': core.collection.name}
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        started = time.perf_counter()
+        ids, names, types, mentions, vectors = load_unit_vectors(
+            os.path.join(workdir, 'vectors.npy'), args.page_size, args.mentions_field
+        )
+        report['loadSeconds'] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        type_codes = None if args.any_type else np.unique(np.asarray(types, dtype=object), return_inverse=True)[1]
+        roots, pairs = cluster_roots(len(ids), similar_pairs(vectors, args.threshold, args.block_size, type_codes))
+        report['clusterSeconds'] = round(time.perf_counter() - started, 3)
+        del vectors
+
+    canonical = canonical_rows(roots, mentions)
+    canonical_map = build_canonical_map(ids, names, canonical, mentions, args.threshold)
+    write_json_atomic(args.output, canonical_map)
+    sizes = [len(cluster['aliases']) + 1 for cluster in canonical_map['canonical'].values()]
+    report.update({
+        'entities': len(ids),
+        'similarPairs': pairs,
+        'clusters': len(sizes),
+        'aliases': len(canonical_map['aliases']),
+        'canonicalEntities': len(ids) - len(canonical_map['aliases']),
+        'largestCluster': max(sizes, default=0),
+        'map': os.path.abspath(args.output),
+        'version': canonical_map['version']
+    })
+
+    if args.compact:
+        started = time.perf_counter()
+        name, count = write_compacted_collection(canonical_map, ids, args.mentions_field, args.batch_size)
+        report['compacted'] = {'collection': name, 'count': count, 'seconds': round(time.perf_counter() - started, 3)}
+        if args.activate:
+            core.write_collection_alias({
+                'collection': name,
+                'previous': core.collection.name,
+                'switchedAt': time.time(),
+                'retireAt': time.time() + core.REBUILD_RETIRE_SECONDS
+            })
+            report['compacted']['activated'] = True
+            core.logger.info(f"✅ Collection alias now points at {name}; restart the server to serve it")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,765 @@
+"""
+Embedding backends for chroma_server.py (Ollama over HTTP, in-process
+feature hashing and in-process ONNX MiniLM), the two-tier embedding cache
+and the float32 vector helpers shared by the server and the offline tools.
+
+Importing this module does not open Chroma, so worker processes can embed
+without loading the server.
+"""
+import base64
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
+from itertools import count
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from chroma_metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Ollama server and embedding model (OLLAMA_URLS lists several servers)
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434/')
+OLLAMA_MODEL = os.getenv('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
+# Dimension every stored and query embedding is padded/truncated to
+EMBEDDING_TARGET_DIM = 728
+# Vectors are float32 in memory and little-endian float32 on disk and on the wire
+VECTOR_DTYPE = np.dtype('<f4')
+
+# Embedding cache configuration (in-memory LRU tier + SQLite tier next to the Chroma data)
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache.sqlite3')
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv('EMBEDDING_CACHE_MEMORY_SIZE', 10000))
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv('EMBEDDING_CACHE_DISK_SIZE', 1000000))
+
+# Embedding backend: ollama (HTTP), hashing (in-process feature hashing) or onnx (in-process MiniLM)
+EMBEDDING_BACKEND_NAME = os.getenv('EMBEDDING_BACKEND', 'ollama').lower()
+
+# Ollama embedding client configuration
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', 2.0))
+OLLAMA_READ_TIMEOUT = float(os.getenv('OLLAMA_READ_TIMEOUT', 30.0))
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', 16))
+# How long Ollama keeps the model loaded after each request (empty uses the Ollama default)
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# How long the micro-batcher waits for more concurrent requests (0 disables batching)
+OLLAMA_BATCH_WAIT_MS = float(os.getenv('OLLAMA_BATCH_WAIT_MS', 5))
+OLLAMA_MAX_BATCH_SIZE = int(os.getenv('OLLAMA_MAX_BATCH_SIZE', 64))
+# After an endpoint turns out not to have /api/embed, how long to embed one text per request before trying it again
+OLLAMA_BATCH_RETRY_SECONDS = float(os.getenv('OLLAMA_BATCH_RETRY_SECONDS', 300))
+# Comma-separated Ollama endpoints used round-robin (default: OLLAMA_URL); a hedged request goes to the next one
+OLLAMA_URLS = [url.strip() for url in os.getenv('OLLAMA_URLS', '').split(',') if url.strip()] or [OLLAMA_URL]
+# Re-send a query embedding request not answered within this percentile of recent latencies (0 disables hedging)
+OLLAMA_HEDGE_PERCENTILE = float(os.getenv('OLLAMA_HEDGE_PERCENTILE', 95))
+OLLAMA_HEDGE_MIN_DELAY_MS = float(os.getenv('OLLAMA_HEDGE_MIN_DELAY_MS', 10))
+# Latencies needed before hedging starts, and how many recent latencies the percentile is taken over
+OLLAMA_HEDGE_MIN_SAMPLES = int(os.getenv('OLLAMA_HEDGE_MIN_SAMPLES', 20))
+OLLAMA_HEDGE_WINDOW = int(os.getenv('OLLAMA_HEDGE_WINDOW', 500))
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU map with hit/miss counters.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxSize': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0
+        }
+
+
+def normalize_embedding_text(text):
+    """
+    Normalize text for embedding cache keys (unicode NFKC, collapsed whitespace).
+    """
+    return ' '.join(unicodedata.normalize('NFKC', str(text)).split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, normalized text).
+
+    Lookups hit the in-memory LRU first and fall back to a SQLite file.
+    Disk entries written for a different model are dropped when the cache
+    is opened, so a model change never serves stale vectors.
+    """
+
+    def __init__(self, model, path, memory_size, disk_size):
+        self.model = model
+        self.path = path
+        self.disk_size = disk_size
+        self.memory = LRUCache(memory_size)
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if disk_size > 0:
+            self._open_disk_tier()
+
+    def _open_disk_tier(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, accessed REAL NOT NULL, '
+            'PRIMARY KEY (model, text))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row is None or row[0] != self.model:
+            removed = self._db.execute('DELETE FROM embeddings WHERE model != ?', (self.model,)).rowcount
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (self.model,))
+            if removed:
+                logger.info(f"🧹 Embedding model changed to {self.model}, dropped {removed} cached embeddings")
+        self._db.commit()
+        self._disk_count = self._db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        logger.info(f"✅ Embedding cache opened at {self.path} ({self._disk_count} cached embeddings)")
+
+    def get_many(self, texts):
+        """
+        Return {text: embedding} for every text found in either tier.
+        """
+        found = {}
+        pending = []
+        for text in texts:
+            embedding = self.memory.get((self.model, normalize_embedding_text(text)))
+            if embedding is not None:
+                found[text] = embedding
+            else:
+                pending.append(text)
+
+        if pending and self._db is not None:
+            keys = {}
+            for text in pending:
+                keys.setdefault(normalize_embedding_text(text), []).append(text)
+            now = time.time()
+            with self._lock:
+                placeholders = ','.join('?' * len(keys))
+                rows = self._db.execute(
+                    f'SELECT text, vector FROM embeddings WHERE model = ? AND text IN ({placeholders})',
+                    (self.model, *keys)
+                ).fetchall()
+                if rows:
+                    self._db.executemany(
+                        'UPDATE embeddings SET accessed = ? WHERE model = ? AND text = ?',
+                        [(now, self.model, key) for key, _ in rows]
+                    )
+                    self._db.commit()
+            for key, blob in rows:
+                embedding = np.frombuffer(blob, dtype=VECTOR_DTYPE).astype(np.float32)
+                self.memory.put((self.model, key), embedding)
+                for text in keys[key]:
+                    found[text] = embedding
+            self.disk_hits += len(rows)
+
+        self.misses += len([text for text in texts if text not in found])
+        return found
+
+    def put_many(self, embeddings):
+        """
+        Store {text: embedding} in both tiers.
+        """
+        now = time.time()
+        rows = {}
+        for text, embedding in embeddings.items():
+            key = normalize_embedding_text(text)
+            self.memory.put((self.model, key), embedding)
+            rows[key] = (self.model, key, np.asarray(embedding, dtype=VECTOR_DTYPE).tobytes(), now)
+
+        if rows and self._db is not None:
+            with self._lock:
+                # Only keys not on disk yet grow the table; replaced rows must not count towards eviction
+                placeholders = ','.join('?' * len(rows))
+                existing = self._db.execute(
+                    f'SELECT COUNT(*) FROM embeddings WHERE model = ? AND text IN ({placeholders})',
+                    (self.model, *rows)
+                ).fetchone()[0]
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO embeddings (model, text, vector, accessed) VALUES (?, ?, ?, ?)',
+                    list(rows.values())
+                )
+                self._disk_count += len(rows) - existing
+                if self._disk_count > self.disk_size:
+                    self._evict_disk()
+                self._db.commit()
+
+    def _evict_disk(self):
+        # Evict the least recently used 10% below the limit so eviction runs rarely
+        keep = int(self.disk_size * 0.9)
+        self._db.execute(
+            'DELETE FROM embeddings WHERE rowid IN ('
+            'SELECT rowid FROM embeddings ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (keep,)
+        )
+        self._disk_count = self._db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def clear(self):
+        self.memory.clear()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute('DELETE FROM embeddings')
+                self._db.commit()
+                self._disk_count = 0
+
+    def stats(self):
+        memory_stats = self.memory.stats()
+        lookups = memory_stats['hits'] + self.disk_hits + self.misses
+        return {
+            'model': self.model,
+            'memory': memory_stats,
+            'disk': {
+                'enabled': self._db is not None,
+                'path': self.path,
+                'size': self._disk_count if self._db is not None else 0,
+                'maxSize': self.disk_size,
+                'hits': self.disk_hits
+            },
+            'misses': self.misses,
+            'hitRate': (memory_stats['hits'] + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+
+def fit_embedding_matrix(embeddings):
+    """
+    Pack embeddings into a contiguous (n, EMBEDDING_TARGET_DIM) float32
+    matrix, truncating or zero-padding rows to the collection dimension.
+    """
+    if isinstance(embeddings, np.ndarray) and embeddings.ndim == 2:
+        source = embeddings.astype(np.float32, copy=False)
+    elif len(embeddings) == 0:
+        return np.zeros((0, EMBEDDING_TARGET_DIM), dtype=np.float32)
+    elif len({len(embedding) for embedding in embeddings}) == 1:
+        source = np.asarray(embeddings, dtype=np.float32)
+    else:
+        # Ragged input: copy row by row into the padded matrix
+        matrix = np.zeros((len(embeddings), EMBEDDING_TARGET_DIM), dtype=np.float32)
+        for row, embedding in zip(matrix, embeddings):
+            width = min(len(embedding), EMBEDDING_TARGET_DIM)
+            row[:width] = embedding[:width]
+        return matrix
+
+    source_dim = source.shape[1]
+    if source_dim == EMBEDDING_TARGET_DIM:
+        return np.ascontiguousarray(source)
+
+    logger.debug(f"🔧 Fitting embeddings from {source_dim} to {EMBEDDING_TARGET_DIM} dimensions")
+    matrix = np.zeros((source.shape[0], EMBEDDING_TARGET_DIM), dtype=np.float32)
+    width = min(source_dim, EMBEDDING_TARGET_DIM)
+    matrix[:, :width] = source[:, :width]
+    return matrix
+
+
+def encode_vectors_b64(matrix):
+    """
+    Encode vectors as base64 of their little-endian float32 bytes (row-major).
+    """
+    return base64.b64encode(np.ascontiguousarray(matrix, dtype=VECTOR_DTYPE).tobytes()).decode('ascii')
+
+
+def decode_vectors(payload, dim=None):
+    """
+    Decode raw little-endian float32 bytes (or their base64 string) into an
+    (n, dim) float32 matrix fitted to EMBEDDING_TARGET_DIM.
+    """
+    buffer = base64.b64decode(payload, validate=True) if isinstance(payload, str) else payload
+    dim = int(dim or EMBEDDING_TARGET_DIM)
+    if dim <= 0 or len(buffer) == 0 or len(buffer) % (dim * VECTOR_DTYPE.itemsize):
+        raise ValueError(f"Vector payload of {len(buffer)} bytes is not a whole number of {dim}-dimension float32 vectors")
+    flat = np.frombuffer(buffer, dtype=VECTOR_DTYPE)
+    return fit_embedding_matrix(flat.reshape(-1, dim))
+
+
+class EmbeddingBackend:
+    """
+    Base class for embedding backends.
+
+    embed() returns raw embeddings for query texts (list of vectors or a 2-D
+    array); embed_batch() is used for bulk ingestion and defaults to embed().
+    `model` identifies the vector space and is part of embedding cache keys;
+    `cacheable` is False for backends that are cheaper than a cache lookup.
+    """
+    name = 'base'
+    model = ''
+    cacheable = True
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def embed_batch(self, texts):
+        return self.embed(texts)
+
+    def stats(self):
+        return {'backend': self.name, 'model': self.model}
+
+
+def ollama_request_body(model, **fields):
+    """
+    JSON body for an Ollama embedding request, asking Ollama to keep the
+    model loaded for OLLAMA_KEEP_ALIVE.
+    """
+    body = {"model": model, **fields}
+    if OLLAMA_KEEP_ALIVE:
+        body["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return body
+
+
+class HedgePolicy:
+    """
+    When to hedge an embedding request: once `min_samples` latencies have
+    been recorded, a request still unanswered after the `percentile`-th
+    recent latency (at least min_delay_ms) is sent again. Also counts how
+    often that happens and how often the hedge answers first.
+    """
+
+    def __init__(self, percentile, min_delay_ms, min_samples, window):
+        self.percentile = percentile
+        self.min_delay = min_delay_ms / 1000.0
+        self.min_samples = max(1, min_samples)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        """
+        Seconds to wait before hedging, or None when hedging is off or there is not enough history yet.
+        """
+        if self.percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            samples = list(self._latencies)
+        return max(self.min_delay, float(np.percentile(samples, self.percentile)))
+
+    def count(self, hedged=False, hedge_won=False):
+        with self._lock:
+            self.requests += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+        if hedged:
+            METRICS.inc('chroma_server_embedding_hedges_total', outcome='hedge' if hedge_won else 'primary')
+
+    def stats(self):
+        delay = self.delay()
+        return {
+            'percentile': self.percentile,
+            'delayMs': round(delay * 1000.0, 2) if delay is not None else None,
+            'samples': len(self._latencies),
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedgeWins': self.hedge_wins,
+            'hedgeRate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            'hedgeWinRate': round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0
+        }
+
+
+def create_hedge_policy():
+    return HedgePolicy(OLLAMA_HEDGE_PERCENTILE, OLLAMA_HEDGE_MIN_DELAY_MS, OLLAMA_HEDGE_MIN_SAMPLES, OLLAMA_HEDGE_WINDOW)
+
+
+class OllamaEmbeddingClient(EmbeddingBackend):
+    """
+    Ollama embedding client with a keep-alive connection pool, strict
+    connect/read timeouts and a micro-batcher.
+
+    Concurrent embed() calls (one per Flask thread) are queued; a worker
+    thread waits up to batch_wait_ms for more requests, sends everything
+    queued as one /api/embed call and hands each caller its own vectors.
+    Requests rotate over base_urls. Query requests are hedged: if one has
+    not answered by the hedge policy's delay, it is sent again to the next
+    endpoint and the first answer wins. Document batches are never hedged.
+
+    An endpoint without /api/embed (older Ollama) is sent one text per
+    /api/embeddings request for batch_retry_seconds, then /api/embed is
+    tried again. The async server shares this client's rotation, hedge
+    policy, batch state, response parsing and counters.
+    """
+
+    name = 'ollama'
+
+    def __init__(self, base_urls, model, connect_timeout, read_timeout,
+                 pool_size, batch_wait_ms, max_batch_size, hedge=None, batch_retry_seconds=300.0):
+        self.base_urls = [url.rstrip('/') for url in base_urls]
+        self.base_url = self.base_urls[0]
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.batch_retry_seconds = batch_retry_seconds
+        self._batch_unsupported_until = {}
+        self.hedge = hedge or HedgePolicy(0, 0, 1, 1)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix='ollama-hedge')
+        self._rotation = count()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self.batches_flushed = 0
+        self.callers_batched = 0
+        self.endpoint_requests = Counter()
+        self.endpoint_errors = Counter()
+
+    def embed(self, texts):
+        """
+        Return raw model embeddings for texts, coalescing with other
+        concurrent callers when micro-batching is enabled.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.batch_wait <= 0:
+            return self.embed_batch(texts, hedge=True)
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def embed_batch(self, texts, hedge=False):
+        """
+        Embed texts directly (no queueing), splitting into max_batch_size requests.
+        """
+        embeddings = []
+        for start in range(0, len(texts), self.max_batch_size):
+            chunk = texts[start:start + self.max_batch_size]
+            if hedge:
+                embeddings.extend(self._post_hedged(chunk))
+            else:
+                embeddings.extend(self._post_to(chunk, self.endpoint_pair()[0]))
+        return embeddings
+
+    def _post_to(self, texts, base_url):
+        self.endpoint_requests[base_url] += 1
+        try:
+            return self._post_embed(texts, base_url)
+        except Exception:
+            self.endpoint_errors[base_url] += 1
+            raise
+
+    def _post_timed(self, texts, base_url):
+        started = time.perf_counter()
+        embeddings = self._post_to(texts, base_url)
+        self.hedge.record(time.perf_counter() - started)
+        return embeddings
+
+    def endpoint_pair(self):
+        """
+        Return the next endpoint in the rotation and the one a hedged
+        request goes to.
+        """
+        first = next(self._rotation)
+        return self.base_urls[first % len(self.base_urls)], self.base_urls[(first + 1) % len(self.base_urls)]
+
+    def supports_batch(self, base_url):
+        return time.monotonic() >= self._batch_unsupported_until.get(base_url, 0.0)
+
+    def batch_endpoint_missing(self, base_url, status, body):
+        """
+        Whether an /api/embed answer means the endpoint itself does not
+        exist, in which case base_url is sent single-text requests for
+        batch_retry_seconds. Ollama answers a missing model with a 404 and
+        a JSON error too; only a 404 without one (the router's plain
+        "404 page not found") counts as a missing endpoint.
+        """
+        if status != 404:
+            return False
+        try:
+            if 'error' in json.loads(body):
+                return False
+        except (TypeError, ValueError):
+            pass
+        logger.info(f"📝 Ollama /api/embed not available on {base_url}, "
+                    f"embedding texts one by one for {self.batch_retry_seconds:g}s")
+        self._batch_unsupported_until[base_url] = time.monotonic() + self.batch_retry_seconds
+        return True
+
+    def batch_embeddings(self, result, texts):
+        embeddings = result.get('embeddings')
+        if not embeddings or len(embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings in response: {result}")
+        self.texts_embedded += len(texts)
+        return embeddings
+
+    def single_embedding(self, result):
+        if 'embedding' not in result:
+            raise ValueError(f"No embedding found in response: {result}")
+        self.texts_embedded += 1
+        return result['embedding']
+
+    def _post_hedged(self, texts):
+        """
+        Send texts to the next endpoint; if there is no answer within the
+        hedge delay (or it fails first), send them to the endpoint after it
+        as well and return the first successful answer. The slower request
+        is left to finish so its latency still counts towards the delay.
+        """
+        primary_url, backup_url = self.endpoint_pair()
+        delay = self.hedge.delay()
+        if delay is None:
+            self.hedge.count()
+            return self._post_timed(texts, primary_url)
+
+        primary = self._hedge_executor.submit(self._post_timed, texts, primary_url)
+        if wait([primary], timeout=delay).done and (primary.exception() is None or len(self.base_urls) == 1):
+            self.hedge.count()
+            return primary.result()
+
+        backup = self._hedge_executor.submit(self._post_timed, texts, backup_url)
+        errors = []
+        for future in as_completed([primary, backup]):
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            self.hedge.count(hedged=True, hedge_won=future is backup)
+            return embeddings
+        self.hedge.count(hedged=True)
+        raise errors[0]
+
+    def _post_embed(self, texts, base_url):
+        if self.supports_batch(base_url):
+            res = self.session.post(
+                f"{base_url}/api/embed", json=ollama_request_body(self.model, input=texts), timeout=self.timeout
+            )
+            self.requests_sent += 1
+            if not self.batch_endpoint_missing(base_url, res.status_code, res.text):
+                res.raise_for_status()
+                return self.batch_embeddings(res.json(), texts)
+
+        embeddings = []
+        for text in texts:
+            res = self.session.post(
+                f"{base_url}/api/embeddings", json=ollama_request_body(self.model, prompt=text), timeout=self.timeout
+            )
+            self.requests_sent += 1
+            res.raise_for_status()
+            embeddings.append(self.single_embedding(res.json()))
+        return embeddings
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='ollama-batcher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            pending = len(jobs[0][0])
+            deadline = time.monotonic() + self.batch_wait
+            while pending < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                pending += len(job[0])
+            self._flush(jobs)
+
+    def _flush(self, jobs):
+        unique_texts = list(dict.fromkeys(text for texts, _ in jobs for text in texts))
+        try:
+            vectors = dict(zip(unique_texts, self.embed_batch(unique_texts, hedge=True)))
+        except Exception as e:
+            for _, future in jobs:
+                future.set_exception(e)
+            return
+
+        self.batches_flushed += 1
+        self.callers_batched += len(jobs)
+        for texts, future in jobs:
+            future.set_result([vectors[text] for text in texts])
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'url': self.base_url,
+            'endpoints': {
+                url: {'requests': self.endpoint_requests[url], 'errors': self.endpoint_errors[url]}
+                for url in self.base_urls
+            },
+            'hedging': self.hedge.stats(),
+            'model': self.model,
+            'timeout': list(self.timeout),
+            'batchWaitMs': self.batch_wait * 1000.0,
+            'maxBatchSize': self.max_batch_size,
+            'batchUnsupported': sorted(url for url in self.base_urls if not self.supports_batch(url)),
+            'requestsSent': self.requests_sent,
+            'textsEmbedded': self.texts_embedded,
+            'batchesFlushed': self.batches_flushed,
+            'callersBatched': self.callers_batched,
+            'queued': self._queue.qsize()
+        }
+
+
+@lru_cache(maxsize=100000)
+def hashed_features(text, dim):
+    """
+    Signed feature-hash buckets for the words and character 3-5-grams of text.
+    Returns (indices, signs) arrays; crc32 keeps them stable across processes.
+    """
+    normalized = normalize_embedding_text(text).lower()
+    padded = f" {normalized} "
+    features = [f"w:{word}" for word in normalized.split()]
+    for n in (3, 4, 5):
+        features.extend(f"c:{padded[i:i + n]}" for i in range(max(len(padded) - n + 1, 0)))
+
+    hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint32, count=len(features))
+    indices = (hashes % dim).astype(np.int64)
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    return indices, signs
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    In-process feature-hashing embedder.
+
+    Word and character n-gram features are hashed into EMBEDDING_TARGET_DIM
+    signed buckets with one scatter-add over the whole batch, then rows are
+    L2-normalized. Needs no model or network, so search keeps working when
+    Ollama is down. It captures surface similarity (spelling, shared words)
+    rather than semantics, which suits short entity names.
+    """
+    name = 'hashing'
+    cacheable = False
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.model = f'feature-hashing-v1-{dim}'
+        self.texts_embedded = 0
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return matrix
+
+        features = [hashed_features(text, self.dim) for text in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(indices) for indices, _ in features])
+        np.add.at(matrix, (rows, np.concatenate([indices for indices, _ in features])),
+                  np.concatenate([signs for _, signs in features]))
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        self.texts_embedded += len(texts)
+        return matrix
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'model': self.model,
+            'textsEmbedded': self.texts_embedded,
+            'featureCache': hashed_features.cache_info()._asdict()
+        }
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """
+    In-process all-MiniLM-L6-v2 (384 dimensions) using the ONNX model bundled
+    with chromadb, run on CPU. The model is loaded (and downloaded to
+    ~/.cache/chroma on first use) once at startup.
+    """
+    name = 'onnx'
+    model = 'all-MiniLM-L6-v2'
+
+    def __init__(self):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        self._embedding_fn = ONNXMiniLM_L6_V2(preferred_providers=['CPUExecutionProvider'])
+        self._embedding_fn(['warm up'])
+        self.texts_embedded = 0
+
+    def embed(self, texts):
+        embeddings = np.asarray(self._embedding_fn(list(texts)), dtype=np.float32)
+        self.texts_embedded += len(texts)
+        return embeddings
+
+    def stats(self):
+        return {'backend': self.name, 'model': self.model, 'textsEmbedded': self.texts_embedded}
+
+
+def create_embedding_backend(name):
+    """
+    Instantiate the embedding backend selected by EMBEDDING_BACKEND.
+    """
+    if name == 'ollama':
+        return OllamaEmbeddingClient(
+            base_urls=OLLAMA_URLS,
+            model=OLLAMA_MODEL,
+            connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+            read_timeout=OLLAMA_READ_TIMEOUT,
+            pool_size=OLLAMA_POOL_SIZE,
+            batch_wait_ms=OLLAMA_BATCH_WAIT_MS,
+            max_batch_size=OLLAMA_MAX_BATCH_SIZE,
+            hedge=create_hedge_policy(),
+            batch_retry_seconds=OLLAMA_BATCH_RETRY_SECONDS
+        )
+    if name == 'hashing':
+        return HashingEmbeddingBackend(EMBEDDING_TARGET_DIM)
+    if name == 'onnx':
+        return OnnxEmbeddingBackend()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}' (expected ollama, hashing or onnx)")
@@ -0,0 +1,232 @@
+"""
+Sources and state of the incremental Entity -> Chroma sync: ArangoDB and
+JSONL Entity sources, the Entity-to-record mapping, content hashes and the
+SQLite state of what was last written. The sync itself (sync_entities in
+chroma_server.py) writes through the server's write path.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import requests
+
+from chroma_embedding import OLLAMA_CONNECT_TIMEOUT
+
+# Incremental ArangoDB Entity -> Chroma sync (POST /sync, chroma_sync.py)
+ARANGO_URL = os.getenv('ARANGO_URL', 'http://localhost:8529')
+ARANGO_DB = os.getenv('ARANGO_DB', '_system')
+ARANGO_USERNAME = os.getenv('ARANGO_USERNAME', 'root')
+ARANGO_PASSWORD = os.getenv('ARANGO_PASSWORD', '')
+ARANGO_ENTITY_COLLECTION = os.getenv('ARANGO_ENTITY_COLLECTION', 'Entity')
+# 'arango' or the path of a JSONL file of Entity documents (for tests and offline runs)
+SYNC_SOURCE = os.getenv('SYNC_SOURCE', 'arango')
+SYNC_STATE_PATH = os.getenv('SYNC_STATE_PATH', './entity_sync_state.sqlite3')
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 500))
+# Entity attribute used as the high-water mark (empty: scan everything and compare content hashes)
+SYNC_UPDATED_FIELD = os.getenv('SYNC_UPDATED_FIELD', '')
+
+
+# Metadata key holding the hash of an entity's text, used to skip unchanged re-sends
+CONTENT_HASH_KEY = 'content_hash'
+
+
+def content_hash(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:32]
+
+
+def with_content_hashes(documents, metadatas):
+    return [dict(metadata or {}, **{CONTENT_HASH_KEY: content_hash(document)})
+            for document, metadata in zip(documents, metadatas)]
+
+
+def entity_record(doc):
+    """
+    Map an ArangoDB Entity document to (id, text, metadata) for the collection.
+    """
+    entity_id = doc.get('_id') or f"{ARANGO_ENTITY_COLLECTION}/{doc['_key']}"
+    name = doc.get('name') or doc['_key']
+    metadata = {'name': name, 'key': doc['_key'], 'mentions': int(doc.get('ne_count') or 0)}
+    schema = doc.get('bert_schema') or doc.get('stanford_schema')
+    if isinstance(schema, list):
+        schema = schema[0] if schema else None
+    if schema:
+        metadata['type'] = schema
+    return entity_id, name, metadata
+
+
+def entity_content_hash(text, metadata):
+    return hashlib.sha256(json.dumps([text, metadata], sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+class ArangoEntitySource:
+    """
+    Reads Entity documents through the ArangoDB HTTP cursor API in batches.
+    """
+
+    def __init__(self, url=ARANGO_URL, db=ARANGO_DB, username=ARANGO_USERNAME, password=ARANGO_PASSWORD,
+                 collection_name=ARANGO_ENTITY_COLLECTION, batch_size=SYNC_BATCH_SIZE):
+        self.base_url = f"{url.rstrip('/')}/_db/{db}/_api/cursor"
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+
+    def _cursor(self, query, bind_vars):
+        res = self.session.post(self.base_url, json={
+            'query': query,
+            'bindVars': dict(bind_vars, **{'@collection': self.collection_name}),
+            'batchSize': self.batch_size,
+            'ttl': 600
+        }, timeout=(OLLAMA_CONNECT_TIMEOUT, 300))
+        res.raise_for_status()
+        page = res.json()
+        while True:
+            yield page['result']
+            if not page.get('hasMore'):
+                return
+            res = self.session.put(f"{self.base_url}/{page['id']}", timeout=(OLLAMA_CONNECT_TIMEOUT, 300))
+            res.raise_for_status()
+            page = res.json()
+
+    def batches(self, updated_field=None, since=None):
+        """
+        Yield lists of documents, only those with updated_field >= since when
+        both are given (in updated_field order). Documents at the watermark
+        itself are read again, since others may share its value; their
+        content hashes make the repeats no-ops.
+        """
+        if updated_field and since is not None:
+            return self._cursor(
+                'FOR e IN @@collection FILTER e[@field] >= @since SORT e[@field] RETURN e',
+                {'field': updated_field, 'since': since}
+            )
+        if updated_field:
+            return self._cursor('FOR e IN @@collection SORT e[@field] RETURN e', {'field': updated_field})
+        return self._cursor('FOR e IN @@collection RETURN e', {})
+
+    def ids(self):
+        present = set()
+        for batch in self._cursor('FOR e IN @@collection RETURN e._id', {}):
+            present.update(batch)
+        return present
+
+
+def update_order_key(value):
+    """
+    Sort key for updated_field values following ArangoDB's type order (null,
+    bool, number, string, then anything else), so a document with a missing
+    or differently typed value never makes the comparison raise.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, json.dumps(value, sort_keys=True))
+
+
+class JsonlEntitySource:
+    """
+    Entity documents from a JSONL file (one ArangoDB document per line), for
+    tests and offline runs. Same interface as ArangoEntitySource.
+    """
+
+    def __init__(self, path, batch_size=SYNC_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+
+    def _documents(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def batches(self, updated_field=None, since=None):
+        documents = self._documents()
+        if updated_field:
+            documents = sorted(
+                (doc for doc in documents
+                 if since is None or update_order_key(doc.get(updated_field)) >= update_order_key(since)),
+                key=lambda doc: update_order_key(doc.get(updated_field))
+            )
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def ids(self):
+        return {entity_record(doc)[0] for doc in self._documents()}
+
+
+def create_entity_source(source=SYNC_SOURCE):
+    if source == 'arango':
+        return ArangoEntitySource()
+    return JsonlEntitySource(source)
+
+
+class EntitySyncState:
+    """
+    SQLite-backed sync state: content hash of every synced entity, the
+    high-water mark and the last run summary. Hashes are dropped when the
+    embedding model changes, so the next sync re-embeds everything.
+    """
+
+    def __init__(self, path=SYNC_STATE_PATH, model=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS entities (id TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if model is not None and self.get_meta('model') != model:
+            self._db.execute("DELETE FROM entities")
+            self._db.execute("DELETE FROM meta WHERE key = 'watermark'")
+            self.set_meta('model', model)
+        self._db.commit()
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self._db.commit()
+
+    def hashes(self, ids):
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT id, hash FROM entities WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_hashes(self, hashes):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO entities (id, hash) VALUES (?, ?)", hashes.items())
+            self._db.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._db.executemany("DELETE FROM entities WHERE id = ?", ((entity_id,) for entity_id in ids))
+            self._db.commit()
+
+    def ids(self):
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT id FROM entities")}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
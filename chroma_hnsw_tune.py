@@ -0,0 +1,130 @@
+"""
+HNSW parameter tuning for chroma_server.py.
+
+Samples held-out query vectors from the serving collection (or a synthetic
+clustered corpus with --synthetic N), computes their exact nearest
+neighbours by NumPy brute force, then builds an HNSW index for every
+(M, construction_ef) pair in the grid and reports recall@k, build time
+and single-query latency for every search_ef. Indexes are built with
+hnswlib (chroma-hnswlib, the library Chroma's HNSW segment uses), so
+latencies exclude Chroma's own per-query overhead.
+
+The fastest setting meeting --target-recall is printed as HNSW_* settings
+for a recreated collection; to test a larger search_ef on the live
+collection first, pass it as `ef` on /search.
+
+Run with: python chroma_hnsw_tune.py --k 10 --queries 200 --m 8,16,32 --search-ef 10,20,40,80
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import hnswlib
+
+import chroma_server as core
+from chroma_quantization_eval import load_collection_vectors, synthetic_vectors
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def exact_neighbours(corpus, queries, k, space):
+    neighbours = []
+    for query in queries:
+        distances = core.vector_distances(query, corpus, space)
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        neighbours.append(set(top[np.argsort(distances[top], kind='stable')].tolist()))
+    return neighbours
+
+
+def measure(index, queries, truth, k):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        labels, _ = index.knn_query(query, k=k, num_threads=1)
+        latencies.append(time.perf_counter() - started)
+        hits += len(expected & set(labels[0].tolist()))
+    latencies_ms = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        'recall': round(hits / (k * len(queries)), 4),
+        'latencyMs': {'p50': round(float(p50), 4), 'p95': round(float(p95), 4), 'p99': round(float(p99), 4),
+                      'mean': round(float(latencies_ms.mean()), 4)},
+        'queriesPerSecond': round(len(queries) / max(1e-9, float(np.sum(latencies))), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure HNSW recall@k against latency over a parameter grid')
+    parser.add_argument('--k', type=int, default=10, help='neighbours per query')
+    parser.add_argument('--queries', type=int, default=200, help='vectors held out and used as queries')
+    parser.add_argument('--m', type=int_list, default=[8, 16, 32], help='comma-separated M values')
+    parser.add_argument('--construction-ef', type=int_list, default=[100, 200], help='comma-separated construction_ef values')
+    parser.add_argument('--search-ef', type=int_list, default=[10, 20, 40, 80, 160], help='comma-separated search_ef values')
+    parser.add_argument('--space', default=None, help='l2, ip or cosine (default: the collection\'s, or HNSW_SPACE)')
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--build-threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--synthetic', type=int, default=0, help='use N synthetic vectors instead of the collection')
+    parser.add_argument('--page-size', type=int, default=core.ENTITY_INDEX_PAGE_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ids, vectors = synthetic_vectors(args.synthetic, seed=args.seed)
+        space = args.space or core.HNSW_SPACE
+    else:
+        ids, vectors = load_collection_vectors(args.page_size)
+        space = args.space or core.collection_space()
+    if len(ids) <= args.queries:
+        raise SystemExit(f"Need more than {args.queries} vectors, found {len(ids)}")
+
+    rng = np.random.default_rng(args.seed)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[rng.choice(len(vectors), args.queries, replace=False)] = True
+    corpus, queries = vectors[~held_out], vectors[held_out]
+
+    started = time.perf_counter()
+    truth = exact_neighbours(corpus, queries, args.k, space)
+    exact_ms = 1000 * (time.perf_counter() - started) / len(queries)
+
+    results = []
+    for m in args.m:
+        for construction_ef in args.construction_ef:
+            index = hnswlib.Index(space=space, dim=corpus.shape[1])
+            index.init_index(max_elements=len(corpus), M=m, ef_construction=construction_ef, random_seed=args.seed)
+            started = time.perf_counter()
+            index.add_items(corpus, np.arange(len(corpus)), num_threads=args.build_threads)
+            build_seconds = time.perf_counter() - started
+            for search_ef in args.search_ef:
+                index.set_ef(max(search_ef, args.k))
+                results.append(dict(
+                    {'M': m, 'constructionEf': construction_ef, 'searchEf': search_ef,
+                     'buildSeconds': round(build_seconds, 3)},
+                    **measure(index, queries, truth, args.k)
+                ))
+
+    eligible = [result for result in results if result['recall'] >= args.target_recall]
+    best = min(eligible, key=lambda result: result['latencyMs']['p50']) if eligible else None
+    print(json.dumps({
+        'vectors': len(corpus),
+        'queries': len(queries),
+        'k': args.k,
+        'space': space,
+        'exactMsPerQuery': round(exact_ms, 3),
+        'targetRecall': args.target_recall,
+        'recommended': {
+            'HNSW_M': best['M'],
+            'HNSW_CONSTRUCTION_EF': best['constructionEf'],
+            'HNSW_SEARCH_EF': best['searchEf'],
+            'recall': best['recall'],
+            'p50Ms': best['latencyMs']['p50']
+        } if best else None,
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+"""
+In-memory entity indexes kept next to the Chroma collection: the BM25
+lexical index, the exact/prefix entity-name index, the int8 vector
+prefilter, and the overlay a reader process applies the writer's changes to.
+"""
+import bisect
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from chroma_embedding import EMBEDDING_TARGET_DIM, LRUCache, fit_embedding_matrix, normalize_embedding_text
+
+# Shortest query the entity-name index answers by prefix
+NAME_PREFIX_MIN_LENGTH = int(os.getenv('NAME_PREFIX_MIN_LENGTH', 3))
+# int8 engine: candidates re-ranked per query = nResults x this factor
+QUANTIZED_RERANK_FACTOR = int(os.getenv('QUANTIZED_RERANK_FACTOR', 4))
+# int8 engine: rows dequantized per block during a scan (bounds temporary memory)
+QUANTIZED_SCAN_BLOCK = int(os.getenv('QUANTIZED_SCAN_BLOCK', 8192))
+
+
+def entity_name_from_metadata(entity_id, metadata):
+    return str((metadata or {}).get('name') or (metadata or {}).get('entity_name') or entity_id)
+
+
+def matches_where(metadata, where):
+    """
+    Evaluate a Chroma metadata where filter against one metadata dict.
+    Supports plain equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and and $or.
+    """
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            # Like Chroma, entities without the key never match
+            if key not in metadata:
+                return False
+            value = metadata[key]
+            operators = condition if isinstance(condition, dict) else {'$eq': condition}
+            for operator, operand in operators.items():
+                try:
+                    if operator == '$eq' and not value == operand:
+                        return False
+                    if operator == '$ne' and not value != operand:
+                        return False
+                    if operator == '$gt' and not value > operand:
+                        return False
+                    if operator == '$gte' and not value >= operand:
+                        return False
+                    if operator == '$lt' and not value < operand:
+                        return False
+                    if operator == '$lte' and not value <= operand:
+                        return False
+                    if operator == '$in' and value not in operand:
+                        return False
+                    if operator == '$nin' and value in operand:
+                        return False
+                except TypeError:
+                    return False
+    return True
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize_embedding_text(text).lower())
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over entity names and documents, kept in
+    step with the Chroma collection so exact surnames and acronyms that
+    vector search misses can still be found.
+    """
+    name = 'lexical'
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_length = {}
+        self._metadata = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        with self._lock:
+            for entity_id, document, metadata in zip(ids, documents, metadatas):
+                self._remove(entity_id)
+                name = entity_name_from_metadata(entity_id, metadata)
+                text = name if not document or document == name else f"{name} {document}"
+                terms = Counter(tokenize(text))
+                for term, frequency in terms.items():
+                    self._postings[term][entity_id] = frequency
+                self._doc_terms[entity_id] = terms
+                self._doc_length[entity_id] = sum(terms.values())
+                self._metadata[entity_id] = metadata or {}
+                self._total_length += self._doc_length[entity_id]
+
+    def remove(self, ids):
+        with self._lock:
+            for entity_id in ids:
+                self._remove(entity_id)
+
+    def _remove(self, entity_id):
+        terms = self._doc_terms.pop(entity_id, None)
+        if terms is None:
+            return
+        self._metadata.pop(entity_id, None)
+        self._total_length -= self._doc_length.pop(entity_id, 0)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(entity_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_length.clear()
+            self._metadata.clear()
+            self._total_length = 0
+
+    def search(self, query, k, where=None):
+        """
+        Return up to k (entity_id, bm25_score) pairs matching where, best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if not terms or doc_count == 0:
+                return []
+            average_length = self._total_length / doc_count
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for entity_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_length[entity_id] / average_length)
+                    scores[entity_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            hits = []
+            for entity_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                if where and not matches_where(self._metadata.get(entity_id), where):
+                    continue
+                hits.append((entity_id, score))
+                if len(hits) >= k:
+                    break
+            return hits
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'entities': len(self._doc_terms),
+            'terms': len(self._postings)
+        }
+
+
+def normalize_entity_name(text):
+    """
+    Lowercased word tokens joined by single spaces ("P.M.  Modi" -> "p m modi").
+    """
+    return ' '.join(tokenize(text))
+
+
+class EntityNameIndex:
+    """
+    Normalized entity name -> entity ids, with prefix lookups.
+
+    Prefix matching bisects a sorted list of the distinct names, which gives
+    trie-like O(log n + k) lookups without a node per character. Large write
+    batches mark the list dirty and it is re-sorted on the next prefix lookup.
+    """
+    name = 'names'
+
+    def __init__(self):
+        self._ids_by_name = {}
+        self._entities = {}
+        self._sorted_names = []
+        self._dirty = False
+        self._lock = threading.RLock()
+        self.ready = False
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        with self._lock:
+            new_names = []
+            for entity_id, metadata in zip(ids, metadatas):
+                self._remove(entity_id)
+                raw_name = (metadata or {}).get('name') or (metadata or {}).get('entity_name')
+                name = normalize_entity_name(raw_name) if raw_name else ''
+                if not name:
+                    continue
+                if name not in self._ids_by_name:
+                    self._ids_by_name[name] = set()
+                    new_names.append(name)
+                self._ids_by_name[name].add(entity_id)
+                self._entities[entity_id] = (name, metadata or {})
+
+            if len(new_names) > 64:
+                self._dirty = True
+            elif not self._dirty:
+                for name in new_names:
+                    # A re-added name may still be in the list after _remove
+                    position = bisect.bisect_left(self._sorted_names, name)
+                    if position == len(self._sorted_names) or self._sorted_names[position] != name:
+                        self._sorted_names.insert(position, name)
+
+    def remove(self, ids):
+        with self._lock:
+            for entity_id in ids:
+                self._remove(entity_id)
+
+    def _remove(self, entity_id):
+        entry = self._entities.pop(entity_id, None)
+        if entry is None:
+            return
+        name = entry[0]
+        ids = self._ids_by_name.get(name)
+        if ids is not None:
+            ids.discard(entity_id)
+            if not ids:
+                del self._ids_by_name[name]
+                # Stale names in the sorted list are skipped at lookup time
+                self._dirty = self._dirty or len(self._sorted_names) > 2 * len(self._ids_by_name)
+
+    def clear(self):
+        with self._lock:
+            self._ids_by_name.clear()
+            self._entities.clear()
+            self._sorted_names = []
+            self._dirty = False
+
+    def lookup(self, query, k, where=None, min_score=0.0):
+        """
+        Return up to k (entity_id, score, metadata) for entities whose name
+        equals the query (score 1.0) or starts with it (score = share of the
+        name covered by the query), best first.
+        """
+        name = normalize_entity_name(query)
+        if not name:
+            return []
+
+        with self._lock:
+            hits = []
+            seen = set()
+            for entity_id in sorted(self._ids_by_name.get(name, ())):
+                metadata = self._entities[entity_id][1]
+                if matches_where(metadata, where):
+                    hits.append((entity_id, 1.0, metadata))
+                    seen.add(entity_id)
+
+            if len(hits) < k and len(name) >= NAME_PREFIX_MIN_LENGTH:
+                if self._dirty:
+                    self._sorted_names = sorted(self._ids_by_name)
+                    self._dirty = False
+                prefix_hits = []
+                start = bisect.bisect_left(self._sorted_names, name)
+                for candidate in self._sorted_names[start:]:
+                    if not candidate.startswith(name):
+                        break
+                    score = len(name) / len(candidate)
+                    if score < min_score:
+                        continue
+                    for entity_id in self._ids_by_name.get(candidate, ()):
+                        metadata = self._entities[entity_id][1]
+                        if entity_id not in seen and matches_where(metadata, where):
+                            prefix_hits.append((entity_id, score, metadata))
+                prefix_hits.sort(key=lambda hit: (-hit[1], hit[0]))
+                hits.extend(prefix_hits[:k - len(hits)])
+
+        if hits and hits[0][1] == 1.0:
+            self.exact_hits += 1
+        elif hits:
+            self.prefix_hits += 1
+        else:
+            self.misses += 1
+        return hits[:k]
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'entities': len(self._entities),
+            'names': len(self._ids_by_name),
+            'exactHits': self.exact_hits,
+            'prefixHits': self.prefix_hits,
+            'misses': self.misses
+        }
+
+
+def quantize_int8(matrix):
+    """
+    Symmetric per-vector int8 quantization: matrix ~= codes * scales[:, None].
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedVectorIndex:
+    """
+    int8 copy of every stored vector used as a brute-force prefilter: a
+    blocked scan over the codes picks nResults x QUANTIZED_RERANK_FACTOR
+    candidates per query, which are then re-ranked with their exact float
+    vectors fetched with `fetch(ids, include)`, a collection.get() stand-in.
+
+    The codes take dim + 8 bytes per vector, a quarter of a float32 scan
+    matrix. They are held in addition to Chroma's own index, which still
+    keeps the float vectors in memory to serve the re-rank, so the engine
+    trades that memory for an exact-scan search rather than saving any.
+
+    query() returns the collection.query() result shape, so it can stand in
+    for the HNSW search. Where filters are applied as row masks computed
+    from the stored metadata and cached until the next write.
+    """
+    name = 'int8'
+    needs_embeddings = True
+
+    def __init__(self, fetch=None, dim=EMBEDDING_TARGET_DIM, rerank_factor=QUANTIZED_RERANK_FACTOR,
+                 block_size=QUANTIZED_SCAN_BLOCK):
+        self.fetch = fetch
+        self.dim = dim
+        self.rerank_factor = rerank_factor
+        self.block_size = block_size
+        self._codes = np.zeros((0, dim), dtype=np.int8)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ids = []
+        self._metadatas = []
+        self._row_of = {}
+        self._size = 0
+        self._masks = LRUCache(32)
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._codes):
+            return
+        capacity = max(needed, 2 * len(self._codes), 1024)
+        for attr in ('_codes', '_scales', '_norms'):
+            old = getattr(self, attr)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, attr, grown)
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        matrix = fit_embedding_matrix(embeddings)
+        codes, scales = quantize_int8(matrix)
+        norms = np.linalg.norm(matrix, axis=1)
+        with self._lock:
+            self._reserve(len(ids))
+            for position, entity_id in enumerate(ids):
+                row = self._row_of.get(entity_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._row_of[entity_id] = row
+                    self._ids.append(entity_id)
+                    self._metadatas.append(None)
+                self._codes[row] = codes[position]
+                self._scales[row] = scales[position]
+                self._norms[row] = norms[position]
+                self._metadatas[row] = metadatas[position] or {}
+            self._masks.clear()
+
+    def remove(self, ids):
+        with self._lock:
+            for entity_id in ids:
+                row = self._row_of.pop(entity_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    # Move the last row into the hole so rows stay contiguous
+                    for array in (self._codes, self._scales, self._norms):
+                        array[row] = array[last]
+                    self._ids[row] = self._ids[last]
+                    self._metadatas[row] = self._metadatas[last]
+                    self._row_of[self._ids[row]] = row
+                self._ids.pop()
+                self._metadatas.pop()
+                self._size = last
+            self._masks.clear()
+
+    def clear(self):
+        with self._lock:
+            self._codes = np.zeros((0, self.dim), dtype=np.int8)
+            self._scales = np.zeros(0, dtype=np.float32)
+            self._norms = np.zeros(0, dtype=np.float32)
+            self._ids = []
+            self._metadatas = []
+            self._row_of = {}
+            self._size = 0
+            self._masks.clear()
+
+    def _mask(self, where):
+        key = json.dumps(where, sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.fromiter((matches_where(metadata, where) for metadata in self._metadatas), dtype=bool, count=self._size)
+            self._masks.put(key, mask)
+        return mask
+
+    def candidates(self, query_embeddings, k, where=None, space='l2'):
+        """
+        Entity ids of the k best approximate matches for each query, best first.
+        """
+        return [[entity_id for entity_id, _ in found] for found in self._scan(query_embeddings, k, where, space)]
+
+    def _scan(self, query_embeddings, k, where, space):
+        """
+        (entity id, metadata) of the k best approximate matches for each
+        query, best first. Rows are resolved before the lock is released,
+        since a concurrent remove() moves rows.
+        """
+        queries = fit_embedding_matrix(query_embeddings)
+        query_norms = np.linalg.norm(queries, axis=1)
+        k = max(1, k)
+        with self._lock:
+            size = self._size
+            mask = self._mask(where) if where else None
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            best_dists = np.zeros((len(queries), 0), dtype=np.float32)
+            for start in range(0, size, self.block_size):
+                stop = min(start + self.block_size, size)
+                dots = (queries @ self._codes[start:stop].T.astype(np.float32)) * self._scales[start:stop]
+                if space == 'cosine':
+                    denominators = np.outer(query_norms, self._norms[start:stop])
+                    denominators[denominators == 0] = 1.0
+                    dists = 1.0 - dots / denominators
+                elif space == 'ip':
+                    dists = 1.0 - dots
+                else:
+                    dists = self._norms[start:stop] ** 2 - 2 * dots + (query_norms ** 2)[:, None]
+                if mask is not None:
+                    dists[:, ~mask[start:stop]] = np.inf
+                rows = np.broadcast_to(np.arange(start, stop), dists.shape)
+                best_dists = np.concatenate([best_dists, dists], axis=1)
+                best_rows = np.concatenate([best_rows, rows], axis=1)
+                if best_dists.shape[1] > k:
+                    keep = np.argpartition(best_dists, k - 1, axis=1)[:, :k]
+                    best_dists = np.take_along_axis(best_dists, keep, axis=1)
+                    best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            order = np.argsort(best_dists, axis=1)
+            best_dists = np.take_along_axis(best_dists, order, axis=1)
+            best_rows = np.take_along_axis(best_rows, order, axis=1)
+            return [
+                [(self._ids[row], self._metadatas[row]) for row in rows[np.isfinite(dists)]]
+                for rows, dists in zip(best_rows, best_dists)
+            ]
+
+    def query(self, query_embeddings, n_results=10, where=None, include_embeddings=False, space='l2'):
+        """
+        collection.query() equivalent: int8 prefilter, then exact re-rank of
+        the candidates with float vectors read from the collection. Metadata
+        comes from the index itself, so only the vectors are fetched.
+        """
+        queries = fit_embedding_matrix(query_embeddings)
+        candidates = self._scan(queries, n_results * self.rerank_factor, where, space)
+
+        results = {'ids': [], 'distances': [], 'metadatas': []}
+        if include_embeddings:
+            results['embeddings'] = []
+        unique_ids = list(dict.fromkeys(entity_id for found in candidates for entity_id, _ in found))
+        fetched = self.fetch(unique_ids, ['embeddings']) if unique_ids else {'ids': []}
+        position_of = {entity_id: position for position, entity_id in enumerate(fetched['ids'])}
+        vectors = np.asarray(fetched['embeddings'], dtype=np.float32) if fetched['ids'] else None
+
+        for query_vector, found in zip(queries, candidates):
+            found = [(entity_id, metadata) for entity_id, metadata in found if entity_id in position_of]
+            positions = [position_of[entity_id] for entity_id, _ in found]
+            distances = vector_distances(query_vector, vectors[positions], space) if positions else np.zeros(0)
+            order = np.argsort(distances, kind='stable')[:n_results]
+            results['ids'].append([found[i][0] for i in order])
+            results['distances'].append([float(distances[i]) for i in order])
+            results['metadatas'].append([found[i][1] for i in order])
+            if include_embeddings:
+                results['embeddings'].append(vectors[[positions[i] for i in order]] if len(order) else [])
+        return results
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'vectors': self._size,
+            'bytes': int(self._size * (self.dim + 8)),
+            'rerankFactor': self.rerank_factor
+        }
+
+
+class CollectionDeltaOverlay:
+    """
+    Entities a reader process applied from the writer's change log since it
+    last opened the collection. Its Chroma client never sees the writer's
+    HNSW updates, so query() drops the changed and removed ids from the
+    stale index's results and merges in exact distances to the changed
+    entities' vectors, widening the stale query when too many were dropped.
+    get() serves the changed entities itself for the same reason.
+    """
+
+    def __init__(self):
+        self._entities = {}
+        self._removed = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entities) + len(self._removed)
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        with self._lock:
+            for entity_id, document, metadata, vector in zip(ids, documents, metadatas, embeddings):
+                self._entities[entity_id] = (np.asarray(vector, dtype=np.float32), document, metadata or {})
+                self._removed.discard(entity_id)
+
+    def remove(self, ids):
+        with self._lock:
+            for entity_id in ids:
+                self._entities.pop(entity_id, None)
+                self._removed.add(entity_id)
+
+    def get(self, source, ids, include):
+        """
+        collection.get(ids=...) over `source` as it would be with the
+        overlay's changes applied: changed entities come from the overlay
+        and removed ones are left out.
+        """
+        fields = {'embeddings': 0, 'documents': 1, 'metadatas': 2}
+        with self._lock:
+            changed = {entity_id: self._entities[entity_id] for entity_id in ids if entity_id in self._entities}
+            unchanged = [entity_id for entity_id in ids if entity_id not in changed and entity_id not in self._removed]
+        results = {'ids': []}
+        results.update({field: [] for field in include})
+        if unchanged:
+            found = source.get(ids=unchanged, include=include)
+            for field in results:
+                results[field].extend(found[field])
+        for entity_id, entity in changed.items():
+            results['ids'].append(entity_id)
+            for field in include:
+                results[field].append(entity[fields[field]])
+        return results
+
+    def query(self, source, query_embeddings, n_results, where=None, include_embeddings=False, space='l2'):
+        """
+        collection.query() over `source` (whose distance function is `space`)
+        as it would be with the overlay's changes applied.
+        """
+        queries = fit_embedding_matrix(query_embeddings)
+        with self._lock:
+            hidden = set(self._entities) | self._removed
+            changed = [(entity_id, entity) for entity_id, entity in self._entities.items()
+                       if not where or matches_where(entity[2], where)]
+        fields = ['ids', 'distances', 'metadatas', 'documents'] + (['embeddings'] if include_embeddings else [])
+        include = fields[1:]
+        changed_vectors = np.vstack([entity[0] for _, entity in changed]) if changed else None
+
+        results = {field: [] for field in fields}
+        for query_vector in queries:
+            fetch = n_results + min(len(hidden), n_results)
+            while True:
+                found = source.query(query_embeddings=[query_vector.tolist()], n_results=fetch, where=where, include=include)
+                kept = [candidate for candidate in zip(*(found[field][0] for field in fields)) if candidate[0] not in hidden]
+                exhausted = len(found['ids'][0]) < fetch
+                if len(kept) >= n_results or exhausted or fetch >= n_results + len(hidden):
+                    break
+                fetch = min(fetch * 2, n_results + len(hidden))
+            if changed:
+                distances = vector_distances(query_vector, changed_vectors, space)
+                for (entity_id, (vector, document, metadata)), distance in zip(changed, distances):
+                    candidate = (entity_id, float(distance), dict(metadata), document)
+                    kept.append(candidate + ((vector,) if include_embeddings else ()))
+            kept.sort(key=lambda candidate: candidate[1])
+            for position, field in enumerate(fields):
+                results[field].append([candidate[position] for candidate in kept[:n_results]])
+        return results
+
+
+def vector_distances(query_vector, matrix, space):
+    """
+    Distances from query_vector to each row of matrix, matching Chroma's definitions.
+    """
+    if space == 'cosine':
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+        norms[norms == 0] = 1.0
+        return 1.0 - (matrix @ query_vector) / norms
+    if space == 'ip':
+        return 1.0 - matrix @ query_vector
+    diff = matrix - query_vector
+    return np.einsum('ij,ij->i', diff, diff)
@@ -0,0 +1,126 @@
+"""
+Prometheus metrics for chroma_server.py: a sharded registry of counters,
+gauges and latency histograms rendered in the text exposition format.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+# /metrics configuration: independent update shards and latency histogram buckets (seconds)
+METRICS_SHARDS = int(os.getenv('METRICS_SHARDS', 16))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class MetricsRegistry:
+    """
+    Counters, latency histograms and gauges rendered in the Prometheus text
+    format.
+
+    Each thread is pinned to one of a fixed number of shards, each with its
+    own lock, so concurrent requests rarely contend on an update. Shards are
+    only summed when /metrics is scraped; gauges are callbacks evaluated then.
+    """
+
+    def __init__(self, shards=METRICS_SHARDS, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._families = {}
+        self._shards = [(threading.Lock(), {}, {}) for _ in range(max(1, shards))]
+        self._next_shard = count()
+        self._local = threading.local()
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text):
+        self._families[name] = ('histogram', help_text, None)
+
+    def gauge(self, name, help_text, callback):
+        self._families[name] = ('gauge', help_text, callback)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # next() on itertools.count is atomic, so no lock is needed to pick a shard
+            shard = self._local.shard = self._shards[next(self._next_shard) % len(self._shards)]
+        return shard
+
+    def inc(self, name, amount=1, **labels):
+        lock, counters, _ = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        with lock:
+            counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        lock, _, histograms = self._shard()
+        key = (name, tuple(sorted(labels.items())))
+        with lock:
+            entry = histograms.get(key)
+            if entry is None:
+                entry = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            entry[1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        counters = defaultdict(int)
+        histograms = {}
+        for lock, shard_counters, shard_histograms in self._shards:
+            with lock:
+                for key, value in shard_counters.items():
+                    counters[key] += value
+                for key, (bucket_counts, total) in shard_histograms.items():
+                    merged = histograms.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+                    merged[0] = [a + b for a, b in zip(merged[0], bucket_counts)]
+                    merged[1] += total
+
+        lines = []
+        for name, (kind, help_text, callback) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                try:
+                    lines.append(f'{name} {callback()}')
+                except Exception as e:
+                    logger.warning(f"⚠️ Metric {name} unavailable: {str(e)}")
+            elif kind == 'counter':
+                for (family, labels), value in sorted(counters.items()):
+                    if family == name:
+                        lines.append(f'{name}{format_metric_labels(labels)} {value}')
+            else:
+                for (family, labels), (bucket_counts, total) in sorted(histograms.items()):
+                    if family != name:
+                        continue
+                    cumulative = 0
+                    for le, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{format_metric_labels(labels + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_metric_labels(labels)} {total}')
+                    lines.append(f'{name}_count{format_metric_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
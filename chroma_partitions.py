@@ -0,0 +1,262 @@
+"""
+Collection partitioning for chroma_server.py (COLLECTION_PARTITIONING=type
+or hash): one Chroma collection per partition behind the Collection API.
+"""
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Partition key: the metadata field in 'type' mode, the shard count in 'hash' mode
+PARTITION_FIELD = os.getenv('PARTITION_FIELD', 'type')
+PARTITION_COUNT = int(os.getenv('PARTITION_COUNT', 8))
+# Threads querying partitions in parallel when a search is not pinned to one partition
+PARTITION_WORKERS = int(os.getenv('PARTITION_WORKERS', 8))
+
+
+class PartitionedCollection:
+    """
+    Spreads entities over sub-collections named <name>__<partition>, either
+    one per value of the PARTITION_FIELD metadata key ('type' mode) or
+    PARTITION_COUNT shards by a hash of the entity id ('hash' mode).
+
+    Implements the subset of the Chroma Collection API the server uses, so it
+    can stand in for `collection`. Queries whose where filter pins the
+    partition field go straight to the matching partitions; other queries fan
+    out to every partition in parallel and the per-partition top-k lists are
+    merged by distance.
+    """
+
+    def __init__(self, client, name, mode, field=PARTITION_FIELD, count=PARTITION_COUNT, metadata=None,
+                 embedding_function=None):
+        if mode not in ('type', 'hash'):
+            raise ValueError(f"Unknown COLLECTION_PARTITIONING '{mode}' (expected none, type or hash)")
+        self.client = client
+        self.name = name
+        self.mode = mode
+        self.field = field
+        self.partition_count = count
+        self.metadata = metadata
+        self.embedding_function = embedding_function
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=PARTITION_WORKERS, thread_name_prefix='partition')
+
+        prefix = f"{name}__"
+        for existing in client.list_collections():
+            if existing.name.startswith(prefix):
+                self._partitions[existing.name[len(prefix):]] = existing
+        if mode == 'hash':
+            for shard in range(count):
+                self._partition(f"h{shard:03d}")
+
+    def _partition(self, key):
+        partition = self._partitions.get(key)
+        if partition is None:
+            with self._lock:
+                partition = self._partitions.get(key)
+                if partition is None:
+                    kwargs = {'embedding_function': self.embedding_function} if self.embedding_function is not None else {}
+                    partition = self.client.get_or_create_collection(
+                        name=f"{self.name}__{key}", metadata=self.metadata, **kwargs
+                    )
+                    self._partitions[key] = partition
+                    logger.info(f"✅ Opened partition {partition.name}")
+        return partition
+
+    def _type_key(self, value):
+        key = re.sub(r'[^a-z0-9]+', '-', str(value).lower()).strip('-')[:40] if value is not None else ''
+        return key or 'untyped'
+
+    def _key_for(self, entity_id, metadata):
+        if self.mode == 'hash':
+            return f"h{zlib.crc32(entity_id.encode('utf-8')) % self.partition_count:03d}"
+        return self._type_key((metadata or {}).get(self.field))
+
+    def _pinned_values(self, where):
+        """
+        Values of the partition field allowed by a where filter, or None when
+        the filter does not constrain it.
+        """
+        if not where:
+            return None
+        if '$and' in where:
+            pinned = None
+            for clause in where['$and']:
+                values = self._pinned_values(clause)
+                if values is not None:
+                    pinned = values if pinned is None else pinned & values
+            return pinned
+        if '$or' in where:
+            pinned = set()
+            for clause in where['$or']:
+                values = self._pinned_values(clause)
+                if values is None:
+                    return None
+                pinned |= values
+            return pinned
+        condition = where.get(self.field)
+        if condition is None:
+            return None
+        if isinstance(condition, dict):
+            if '$eq' in condition:
+                return {condition['$eq']}
+            if '$in' in condition:
+                return set(condition['$in'])
+            return None
+        return {condition}
+
+    def partitions_for(self, where=None):
+        """
+        Partitions a query with this where filter has to visit.
+        """
+        if self.mode == 'type':
+            values = self._pinned_values(where)
+            if values is not None:
+                keys = {self._type_key(value) for value in values}
+                return [self._partitions[key] for key in sorted(keys) if key in self._partitions]
+        return [self._partitions[key] for key in sorted(self._partitions)]
+
+    def _fan_out(self, partitions, func):
+        if len(partitions) == 1:
+            return [func(partitions[0])]
+        return list(self._executor.map(func, partitions))
+
+    def _group(self, ids, metadatas):
+        groups = defaultdict(list)
+        for position, entity_id in enumerate(ids):
+            groups[self._key_for(entity_id, metadatas[position] if metadatas else None)].append(position)
+        return groups
+
+    def _write(self, method, ids, embeddings=None, documents=None, metadatas=None):
+        groups = self._group(ids, metadatas)
+        if embeddings is not None and not isinstance(embeddings, np.ndarray):
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+        for key, positions in groups.items():
+            group_ids = [ids[i] for i in positions]
+            if method == 'upsert' and self.mode == 'type':
+                # An entity whose type changed must leave its old partition
+                for other_key, other in list(self._partitions.items()):
+                    if other_key != key:
+                        moved = other.get(ids=group_ids, include=[])['ids']
+                        if moved:
+                            other.delete(ids=moved)
+            getattr(self._partition(key), method)(
+                ids=group_ids,
+                embeddings=embeddings[positions] if embeddings is not None else None,
+                documents=[documents[i] for i in positions] if documents is not None else None,
+                metadatas=[metadatas[i] for i in positions] if metadatas is not None else None
+            )
+
+    def add(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write('add', ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write('upsert', ids, embeddings, documents, metadatas)
+
+    def delete(self, ids=None, where=None):
+        self._fan_out(self.partitions_for(where), lambda partition: partition.delete(ids=ids, where=where))
+
+    def count(self):
+        return sum(partition.count() for partition in list(self._partitions.values()))
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('metadatas', 'documents', 'distances')):
+        """
+        Query the relevant partitions and merge each query's per-partition
+        top n_results by distance.
+        """
+        include = list(include)
+        if 'distances' not in include:
+            include.append('distances')
+        fields = ['ids'] + [field for field in ('distances', 'metadatas', 'documents', 'embeddings') if field in include]
+        partitions = self.partitions_for(where)
+        n_queries = len(query_embeddings)
+        merged = {field: [] for field in fields}
+        if not partitions:
+            for field in fields:
+                merged[field] = [[] for _ in range(n_queries)]
+            return merged
+
+        results = self._fan_out(partitions, lambda partition: partition.query(
+            query_embeddings=query_embeddings, n_results=n_results, where=where, include=include
+        ))
+        for row in range(n_queries):
+            candidates = []
+            for result in results:
+                columns = [result[field][row] for field in fields]
+                candidates.extend(zip(*columns))
+            candidates.sort(key=lambda candidate: candidate[1])
+            top = candidates[:n_results]
+            for position, field in enumerate(fields):
+                merged[field].append([candidate[position] for candidate in top])
+        return merged
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=('metadatas', 'documents')):
+        """
+        Entities by id or filter. Without ids, partitions are read in name
+        order so limit/offset page through the union.
+        """
+        include = list(include)
+        fields = ['ids'] + [field for field in ('embeddings', 'metadatas', 'documents') if field in include]
+        merged = {field: [] for field in fields}
+
+        def extend(page):
+            for field in fields:
+                merged[field].extend(page[field] or [])
+
+        if ids is not None:
+            partitions = self.partitions_for(where)
+            if self.mode == 'hash':
+                keys = {self._key_for(entity_id, None) for entity_id in ids}
+                partitions = [self._partitions[key] for key in sorted(keys)]
+            for page in self._fan_out(partitions, lambda partition: partition.get(ids=ids, where=where, include=include)):
+                extend(page)
+            return merged
+
+        skip = offset or 0
+        remaining = limit
+        for partition in self.partitions_for(where):
+            if remaining is not None and remaining <= 0:
+                break
+            if where is None:
+                size = partition.count()
+                if skip >= size:
+                    skip -= size
+                    continue
+                page = partition.get(limit=remaining, offset=skip or None, include=include)
+                skip = 0
+            else:
+                # Filtered sizes are unknown up front, so slice the filtered rows
+                page = partition.get(where=where, include=include)
+                taken = len(page['ids'])
+                page = {field: (page[field] or [])[skip:] for field in fields}
+                skip = max(0, skip - taken)
+                if remaining is not None:
+                    page = {field: values[:remaining] for field, values in page.items()}
+            extend(page)
+            if remaining is not None:
+                remaining -= len(page['ids'])
+        return merged
+
+    def drop(self):
+        """
+        Delete every partition collection.
+        """
+        with self._lock:
+            for partition in self._partitions.values():
+                self.client.delete_collection(name=partition.name)
+            self._partitions.clear()
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'field': self.field if self.mode == 'type' else None,
+            'partitions': {key: partition.count() for key, partition in sorted(self._partitions.items())}
+        }
@@ -0,0 +1,113 @@
+"""
+Recall evaluation for the int8 vector engine of chroma_server.py.
+
+Compares the int8 prefilter, with and without exact re-rank, against exact
+float32 brute force over the same vectors and reports recall@k, scan
+latency and memory as JSON. Vectors come from the serving collection, or
+from a synthetic clustered corpus with --synthetic N. The last --queries
+vectors are held out and used as queries.
+
+Run with: python chroma_quantization_eval.py --k 10 --queries 200
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import chroma_server as core
+
+
+def load_collection_vectors(page_size):
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        page = core.collection.get(limit=page_size, offset=offset, include=['embeddings'])
+        if not page['ids']:
+            break
+        ids.extend(page['ids'])
+        vectors.append(core.fit_embedding_matrix(page['embeddings']))
+        offset += len(page['ids'])
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, core.EMBEDDING_TARGET_DIM), dtype=np.float32)
+    return ids, matrix
+
+
+def synthetic_vectors(count, clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, core.EMBEDDING_TARGET_DIM)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    noise = 0.35 * rng.standard_normal((count, core.EMBEDDING_TARGET_DIM)).astype(np.float32)
+    return [f"synthetic/{i}" for i in range(count)], centers[labels] + noise
+
+
+def exact_top_k(corpus, queries, k, space):
+    return [np.argsort(core.vector_distances(query, corpus, space), kind='stable')[:k] for query in queries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure recall of the int8 prefilter + exact re-rank engine')
+    parser.add_argument('--k', type=int, default=10, help='neighbours per query')
+    parser.add_argument('--queries', type=int, default=200, help='held-out vectors used as queries')
+    parser.add_argument('--rerank-factors', default='1,2,4,8', help='comma-separated candidate over-fetch factors')
+    parser.add_argument('--synthetic', type=int, default=0, help='use N synthetic vectors instead of the collection')
+    parser.add_argument('--page-size', type=int, default=core.ENTITY_INDEX_PAGE_SIZE)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ids, vectors = synthetic_vectors(args.synthetic)
+        space = 'l2'
+    else:
+        ids, vectors = load_collection_vectors(args.page_size)
+        space = core.collection_space()
+    if len(ids) <= args.queries:
+        raise SystemExit(f"Need more than {args.queries} vectors, found {len(ids)}")
+
+    corpus, queries = vectors[:-args.queries], vectors[-args.queries:]
+    index = core.QuantizedVectorIndex()
+    index.add(ids[:-args.queries], None, [{}] * len(corpus), corpus)
+    row_of = {entity_id: row for row, entity_id in enumerate(ids[:-args.queries])}
+    truth = exact_top_k(corpus, queries, args.k, space)
+
+    results = []
+    for factor in (int(value) for value in args.rerank_factors.split(',')):
+        started = time.perf_counter()
+        candidates = index.candidates(queries, args.k * factor, space=space)
+        scan_seconds = time.perf_counter() - started
+
+        prefilter_hits = rerank_hits = 0
+        for query, expected, candidate_ids in zip(queries, truth, candidates):
+            rows = np.asarray([row_of[entity_id] for entity_id in candidate_ids], dtype=np.int64)
+            expected = set(expected.tolist())
+            prefilter_hits += len(expected & set(rows[:args.k].tolist()))
+            # Exact re-rank of the candidates, as the server does with vectors read from Chroma
+            reranked = rows[np.argsort(core.vector_distances(query, corpus[rows], space), kind='stable')[:args.k]]
+            rerank_hits += len(expected & set(reranked.tolist()))
+
+        total = args.k * len(queries)
+        results.append({
+            'rerankFactor': factor,
+            'candidates': args.k * factor,
+            'prefilterRecall': round(prefilter_hits / total, 4),
+            'rerankedRecall': round(rerank_hits / total, 4),
+            'scanMsPerQuery': round(1000 * scan_seconds / len(queries), 3)
+        })
+
+    started = time.perf_counter()
+    exact_top_k(corpus, queries, args.k, space)
+    print(json.dumps({
+        'vectors': len(corpus),
+        'queries': len(queries),
+        'k': args.k,
+        'space': space,
+        'memory': {
+            'float32Bytes': int(corpus.nbytes),
+            'int8Bytes': index.stats()['bytes'],
+            'ratio': round(corpus.nbytes / max(1, index.stats()['bytes']), 2)
+        },
+        'exactMsPerQuery': round(1000 * (time.perf_counter() - started) / len(queries), 3),
+        'results': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
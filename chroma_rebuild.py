@@ -0,0 +1,117 @@
+"""
+Helpers of the blue/green collection rebuild (POST /collection/rebuild):
+copying into the target collection and validating it before the alias
+switch. The switch itself lives in chroma_server.py.
+"""
+import os
+
+import numpy as np
+
+from chroma_entity_sync import create_entity_source, entity_record, with_content_hashes
+from chroma_indexes import vector_distances
+
+# Blue/green rebuilds (POST /collection/rebuild): entities copied per batch, validation thresholds
+# and how long the previous collection is kept after the alias switch
+REBUILD_BATCH_SIZE = int(os.getenv('REBUILD_BATCH_SIZE', 1000))
+REBUILD_VALIDATION_QUERIES = int(os.getenv('REBUILD_VALIDATION_QUERIES', 50))
+REBUILD_MIN_RECALL = float(os.getenv('REBUILD_MIN_RECALL', 0.9))
+REBUILD_MIN_COUNT_RATIO = float(os.getenv('REBUILD_MIN_COUNT_RATIO', 0.9))
+REBUILD_RETIRE_SECONDS = float(os.getenv('REBUILD_RETIRE_SECONDS', 600))
+
+REBUILD_STATE = {'running': False, 'phase': None, 'source': None, 'target': None, 'copied': 0,
+                 'startedAt': None, 'lastRun': None}
+REBUILD_INCLUDE = ['embeddings', 'documents', 'metadatas']
+
+
+def upsert_collection_page(target, page):
+    metadatas = with_content_hashes(page['documents'], page['metadatas'])
+    target.upsert(ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=metadatas)
+    return metadatas
+
+
+def populate_from_collection(source, target):
+    """
+    Copy every entity, with its stored embedding, from source to target.
+    """
+    offset = 0
+    while True:
+        page = source.get(limit=REBUILD_BATCH_SIZE, offset=offset, include=REBUILD_INCLUDE)
+        if not page['ids']:
+            return offset
+        upsert_collection_page(target, page)
+        offset += len(page['ids'])
+        REBUILD_STATE['copied'] = offset
+
+
+def populate_from_source(source_name, target, embed):
+    """
+    Embed (with `embed`) and write every entity of a sync source (ArangoDB or a JSONL dump) to target.
+    """
+    loaded = set()
+    for documents in create_entity_source(source_name).batches():
+        records = [entity_record(doc) for doc in documents]
+        texts = [record[1] for record in records]
+        target.upsert(
+            ids=[record[0] for record in records],
+            embeddings=embed(texts),
+            documents=texts,
+            metadatas=with_content_hashes(texts, [record[2] for record in records])
+        )
+        loaded.update(record[0] for record in records)
+        REBUILD_STATE['copied'] = len(loaded)
+    return len(loaded)
+
+
+def collection_ids(source):
+    ids, offset = set(), 0
+    while True:
+        page = source.get(limit=REBUILD_BATCH_SIZE * 10, offset=offset, include=[])
+        if not page['ids']:
+            return ids
+        ids.update(page['ids'])
+        offset += len(page['ids'])
+
+
+def validate_rebuild(target, expected, serving=None, compare=False):
+    """
+    Check a rebuilt collection before it is switched in: its count against
+    the entities written (when given) and the serving collection, and that a sample of
+    its own vectors find themselves in a top-10 query. With compare, the
+    sample is also run against the serving collection and the mean overlap
+    of the two result lists is reported. A probe that is pushed out of the
+    top 10 only by vectors at least as close as itself (e.g. entities with
+    an identical name) still counts as found.
+    """
+    count = target.count()
+    serving_count = serving.count() if serving is not None else 0
+    report = {'count': count, 'expected': expected, 'servingCount': serving_count, 'problems': []}
+    if expected is not None and count < expected:
+        report['problems'].append(f"count {count} is below the {expected} entities written")
+    if count < REBUILD_MIN_COUNT_RATIO * serving_count:
+        report['problems'].append(f"count {count} is below {REBUILD_MIN_COUNT_RATIO:.0%} of the serving {serving_count}")
+
+    samples = min(REBUILD_VALIDATION_QUERIES, count)
+    if samples:
+        hits, overlaps = 0, []
+        k = min(10, count)
+        space = (target.metadata or {}).get('hnsw:space', 'l2')
+        for offset in np.random.default_rng().choice(count, samples, replace=False):
+            probe = target.get(limit=1, offset=int(offset), include=['embeddings'])
+            if not probe['ids']:
+                continue
+            found = target.query(query_embeddings=[probe['embeddings'][0]], n_results=k, include=['distances'])
+            vector = np.asarray(probe['embeddings'][0], dtype=np.float32)
+            tie_distance = float(vector_distances(vector, vector[None, :], space)[0])
+            tie_distance += 1e-5 * max(1.0, abs(tie_distance))
+            hits += probe['ids'][0] in found['ids'][0] or (
+                len(found['distances'][0]) == k and found['distances'][0][-1] <= tie_distance
+            )
+            if compare and serving_count:
+                current = serving.query(query_embeddings=[probe['embeddings'][0]], n_results=k, include=['distances'])
+                overlaps.append(len(set(found['ids'][0]) & set(current['ids'][0])) / k)
+        report['selfRecall'] = round(hits / samples, 4)
+        report['agreement'] = round(float(np.mean(overlaps)), 4) if overlaps else None
+        if report['selfRecall'] < REBUILD_MIN_RECALL:
+            report['problems'].append(f"self-recall {report['selfRecall']} is below {REBUILD_MIN_RECALL}")
+    report['ok'] = not report['problems']
+    return report
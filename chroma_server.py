@@ -1,8 +1,41 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from chromadb import Client, Settings
 import chromadb
 import os
+import json
 import logging
+import time
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from contextlib import contextmanager
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from chroma_metrics import METRICS, MetricsRegistry
+from chroma_embedding import (
+    EMBEDDING_BACKEND_NAME, EMBEDDING_CACHE_DISK_SIZE, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MEMORY_SIZE,
+    EMBEDDING_CACHE_PATH, EMBEDDING_TARGET_DIM, OLLAMA_MAX_BATCH_SIZE, OLLAMA_MODEL, OLLAMA_POOL_SIZE, OLLAMA_URL,
+    VECTOR_DTYPE, EmbeddingCache, HedgePolicy, LRUCache, OllamaEmbeddingClient, create_embedding_backend,
+    decode_vectors, encode_vectors_b64, fit_embedding_matrix, normalize_embedding_text, ollama_request_body
+)
+from chroma_indexes import (
+    CollectionDeltaOverlay, EntityNameIndex, LexicalIndex, QuantizedVectorIndex, entity_name_from_metadata,
+    vector_distances
+)
+from chroma_partitions import PartitionedCollection
+from chroma_entity_sync import (
+    CONTENT_HASH_KEY, SYNC_BATCH_SIZE, SYNC_SOURCE, SYNC_STATE_PATH, SYNC_UPDATED_FIELD, EntitySyncState,
+    JsonlEntitySource, create_entity_source, entity_content_hash, entity_record, update_order_key,
+    with_content_hashes
+)
+from chroma_rebuild import (
+    REBUILD_BATCH_SIZE, REBUILD_INCLUDE, REBUILD_RETIRE_SECONDS, REBUILD_STATE, collection_ids,
+    populate_from_collection, populate_from_source, upsert_collection_page, validate_rebuild
+)
+
+SERVER_STARTED_AT = time.time()
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -12,8 +45,37 @@ logger = logging.getLogger(__name__)
 CHROMA_DATA_PATH = './cdbComments'
 COLLECTION_NAME = 'entity_embeddings'  # Changed to avoid dimension mismatch with existing collection
 EMBEDDING_FUNCTION = 'ollama'
-OLLAMA_URL = 'http://localhost:11434/'
-OLLAMA_MODEL = 'nomic-embed-text'
+
+# HNSW index settings for collections this server creates (fixed once a collection exists)
+HNSW_SPACE = os.getenv('HNSW_SPACE', 'l2').lower()
+HNSW_M = int(os.getenv('HNSW_M', 16))
+HNSW_CONSTRUCTION_EF = int(os.getenv('HNSW_CONSTRUCTION_EF', 100))
+HNSW_SEARCH_EF = int(os.getenv('HNSW_SEARCH_EF', 10))
+
+
+def hnsw_collection_metadata():
+    """
+    Collection metadata carrying the configured HNSW settings; Chroma reads
+    them when the collection is created.
+    """
+    return {
+        'hnsw:space': HNSW_SPACE,
+        'hnsw:M': HNSW_M,
+        'hnsw:construction_ef': HNSW_CONSTRUCTION_EF,
+        'hnsw:search_ef': HNSW_SEARCH_EF
+    }
+
+
+def warn_on_hnsw_mismatch(existing):
+    """
+    Log configured HNSW settings that an existing collection does not use.
+    """
+    defaults = {'hnsw:space': 'l2', 'hnsw:M': 16, 'hnsw:construction_ef': 100, 'hnsw:search_ef': 10}
+    metadata = existing.metadata or {}
+    for key, wanted in hnsw_collection_metadata().items():
+        actual = metadata.get(key, defaults[key])
+        if actual != wanted:
+            logger.warning(f"⚠️ Collection {existing.name} uses {key}={actual}, not the configured {wanted}; recreate it to apply")
 
 
 def get_embedding_function():
@@ -80,8 +142,38 @@ if EMBEDDING_FUNCTION is not None:
 else:
     logger.info("🔧 Using ChromaDB default embedding function")
 
+# JSON file naming the collection currently served under COLLECTION_NAME (written by blue/green rebuilds)
+COLLECTION_ALIAS_FILE = os.getenv('COLLECTION_ALIAS_FILE', os.path.join(CHROMA_DATA_PATH, 'collection_alias.json'))
+
+
+def read_collection_alias():
+    """
+    The alias record ({'collection', 'previous', 'switchedAt', 'retireAt'}), or {} when none was written.
+    """
+    try:
+        with open(COLLECTION_ALIAS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_collection_alias(alias):
+    """
+    Replace the alias file atomically, so every process sees either the old or the new target.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(COLLECTION_ALIAS_FILE)), exist_ok=True)
+    temp_path = f"{COLLECTION_ALIAS_FILE}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(alias, f)
+    os.replace(temp_path, COLLECTION_ALIAS_FILE)
+
+
+def serving_collection_name():
+    return read_collection_alias().get('collection') or COLLECTION_NAME
+
+
 # Initialize ChromaDB client
-client = chromadb.PersistentClient(path="./cdbComments")
+client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
 
 # Initialize collection variable
 collection = None
@@ -89,8 +181,9 @@ collection = None
 # Get or create collection with consistent embedding function configuration
 try:
     # Try to get existing collection
-    collection = client.get_collection(name=COLLECTION_NAME)
-    logger.info(f"✅ Connected to existing collection: {COLLECTION_NAME}")
+    collection = client.get_collection(name=serving_collection_name())
+    logger.info(f"✅ Connected to existing collection: {collection.name}")
+    warn_on_hnsw_mismatch(collection)
     
     # Important Note: For existing collections, ChromaDB will use the embedding function
     # that was defined when the collection was originally created.
@@ -104,7 +197,8 @@ except Exception as e:
     try:
         collection = client.create_collection(
             name=COLLECTION_NAME,
-            embedding_function=EMBEDDING_FUNCTION
+            embedding_function=EMBEDDING_FUNCTION,
+            metadata=hnsw_collection_metadata()
         )
         logger.info(f"✅ Created new collection: {COLLECTION_NAME}")
         if EMBEDDING_FUNCTION is not None:
@@ -116,7 +210,7 @@ except Exception as e:
         # Fallback: try without embedding function
         logger.info("🔄 Attempting to create collection with default embedding function...")
         try:
-            collection = client.create_collection(name=COLLECTION_NAME)
+            collection = client.create_collection(name=COLLECTION_NAME, metadata=hnsw_collection_metadata())
             logger.info(f"✅ Created collection with default embedding: {COLLECTION_NAME}")
         except Exception as fallback_error:
             logger.error(f"❌ Failed to create collection even with default settings: {fallback_error}")
@@ -132,7 +226,9 @@ def health_check():
         return jsonify({
             'status': 'healthy',
             'chromadb': True,
-            'collection': True
+            'collection': True,
+            'ready': WARMUP_STATE['ready'],
+            'startupSeconds': WARMUP_STATE['startupSeconds']
         }), 200
     except Exception as e:
         return jsonify({
@@ -140,214 +236,2211 @@ def health_check():
             'error': str(e)
         }), 500
 
-import requests
-import json
-def get_embedding_ollama(text):
-    # Use a model that produces 384 dimensions to match existing collection
-    res = requests.post("http://localhost:11434/api/embeddings", json={
-        "model": "nomic-embed-text",  # This should produce 384 dimensions
-        "prompt": text
-    })
-    result = res.json()
-    if 'embedding' not in result:
-        raise ValueError(f"No embedding found in response: {result}")
-    
-    embedding = result['embedding']
-    
-    # Adjust embedding dimensions to match collection requirements (728)
-    target_dim = 728
-    if len(embedding) > target_dim:
-        # Truncate if too long
-        embedding = embedding[:target_dim]
-        logger.info(f"🔧 Truncated embedding from {len(result['embedding'])} to {target_dim} dimensions")
-    elif len(embedding) < target_dim:
-        # Pad with zeros if too short
-        padding = [0.0] * (target_dim - len(embedding))
-        embedding = embedding + padding
-        logger.info(f"🔧 Padded embedding from {len(result['embedding'])} to {target_dim} dimensions")
-    
-    return embedding
 
-@app.route('/search', methods=['POST'])
-def search():
-    try:
-        data = request.get_json()
-        query = data.get('query')
-        n_results = data.get('nResults', 10)
-        min_similarity = data.get('minSimilarity', 0.5)
-        where_filter = data.get('whereFilter')
-        
-        if not query:
-            return jsonify({'error': 'Query is required'}), 400
-        
-        query_emb = get_embedding_ollama(query)
-        print(f"Query embedding dimension: {len(query_emb)}")
-
-        # Perform the search using pre-computed embedding
-        results = collection.query(
-            query_embeddings=[query_emb],  # Use pre-computed embedding instead of query_texts
-            n_results=n_results,
-            where=where_filter
-        )
+# Upper bound on the number of queries accepted by /search/batch
+MAX_BATCH_QUERIES = int(os.getenv('CHROMA_MAX_BATCH_QUERIES', 100))
 
-        # Process results
-        valid_results = {
-            'entityIds': [],
-            'entityNames': [],
-            'similarities': [],
-            'metadata': []
-        }
 
-        if results.get('ids') and results['ids'][0]:
-            for i, id_val in enumerate(results['ids'][0]):
-                similarity = 1 - (results['distances'][0][i] if results.get('distances') else 0)
-                
-                if similarity >= min_similarity:
-                    valid_results['entityIds'].append(id_val)
-                    valid_results['similarities'].append(similarity)
-                    
-                    metadata = results['metadatas'][0][i] if results.get('metadatas') else {}
-                    valid_results['metadata'].append(metadata)
-                    
-                    entity_name = str(metadata.get('name') or metadata.get('entity_name') or id_val)
-                    valid_results['entityNames'].append(entity_name)
+# Search result cache configuration (0 disables it)
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 10000))
+# Identical searches arriving while one is in flight wait for and share its result
+SEARCH_COALESCING_ENABLED = os.getenv('SEARCH_COALESCING_ENABLED', 'true').lower() == 'true'
 
-        logger.info(f"🔍 Found {len(valid_results['entityIds'])} similar entities for query: {query}")
-        return jsonify(valid_results), 200
+# Lexical (BM25) index and hybrid search configuration
+LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true').lower() == 'true'
+# Entities read per collection.get() page when building in-memory indexes at startup
+ENTITY_INDEX_PAGE_SIZE = int(os.getenv('ENTITY_INDEX_PAGE_SIZE', 5000))
+# Reciprocal rank fusion constant and per-retriever candidate over-fetch factor
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', 60))
+HYBRID_CANDIDATE_FACTOR = int(os.getenv('HYBRID_CANDIDATE_FACTOR', 3))
+# Re-rank stage (`rerank: true` on /search): candidates fetched per result, MMR trade-off between
+# relevance (1.0) and diversity (0.0), and the metadata field whose log-scaled value is added to relevance
+RERANK_CANDIDATE_FACTOR = int(os.getenv('RERANK_CANDIDATE_FACTOR', 4))
+RERANK_MMR_LAMBDA = float(os.getenv('RERANK_MMR_LAMBDA', 0.5))
+RERANK_BOOST_FIELD = os.getenv('RERANK_BOOST_FIELD', 'mentions')
+RERANK_BOOST_WEIGHT = float(os.getenv('RERANK_BOOST_WEIGHT', 0.05))
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', 4))
 
-    except Exception as e:
-        logger.error(f"❌ Search failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+# Exact/prefix entity-name fast path (answers literal name queries without embedding)
+NAME_FAST_PATH_ENABLED = os.getenv('NAME_FAST_PATH_ENABLED', 'true').lower() == 'true'
 
-@app.route('/add', methods=['POST'])
-def add_entities():
-    try:
-        data = request.get_json()
-        entity_ids = data.get('entityIds', [])
-        entity_texts = data.get('entityTexts', [])
-        metadata = data.get('metadata', [])
+# Streaming NDJSON ingest (/add/stream) configuration
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 256))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 4))
+# Chunks read ahead of the writer before the request stream stops being read
+INGEST_MAX_PENDING_CHUNKS = int(os.getenv('INGEST_MAX_PENDING_CHUNKS', 8))
 
-        if not entity_ids or not entity_texts:
-            return jsonify({'error': 'Entity IDs and texts are required'}), 400
+# Run a sync every N seconds inside the server (0 disables the schedule)
+SYNC_INTERVAL_SECONDS = int(os.getenv('SYNC_INTERVAL_SECONDS', 0))
 
-        if len(entity_ids) != len(entity_texts) or len(entity_ids) != len(metadata):
-            return jsonify({'error': 'All arrays must have the same length'}), 400
+# Upper bound for the per-request `ef` search parameter
+MAX_SEARCH_EF = int(os.getenv('MAX_SEARCH_EF', 1000))
 
-        # Add entities to collection
-        collection.add(
-            ids=entity_ids,
-            documents=entity_texts,
-            metadatas=metadata
-        )
+# Vector search engine: hnsw (Chroma) or int8 (in-memory int8 prefilter + exact re-rank from Chroma)
+VECTOR_ENGINE = os.getenv('VECTOR_ENGINE', 'hnsw').lower()
 
-        logger.info(f"✅ Added {len(entity_ids)} entities to ChromaDB collection")
-        return jsonify({'success': True, 'count': len(entity_ids)}), 200
+# Collection partitioning: none, type (one sub-collection per PARTITION_FIELD value) or hash (PARTITION_COUNT shards by id)
+COLLECTION_PARTITIONING = os.getenv('COLLECTION_PARTITIONING', 'none').lower()
 
-    except Exception as e:
-        logger.error(f"❌ Add entities failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
 
-@app.route('/stats', methods=['GET'])
-def get_stats():
-    try:
-        count = collection.count()
-        return jsonify({
-            'count': count,
-            'name': COLLECTION_NAME
-        }), 200
-    except Exception as e:
-        logger.error(f"❌ Get stats failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+# Canonical-ID map written by chroma_dedup.py: search results are collapsed to one entry per canonical
+# entity (unless a search sets collapseDuplicates: false), fetching this many times more candidates
+CANONICAL_MAP_FILE = os.getenv('CANONICAL_MAP_FILE', os.path.join(CHROMA_DATA_PATH, 'canonical_ids.json'))
+CANONICAL_COLLAPSE_ENABLED = os.getenv('CANONICAL_COLLAPSE_ENABLED', 'true').lower() == 'true'
+CANONICAL_CANDIDATE_FACTOR = int(os.getenv('CANONICAL_CANDIDATE_FACTOR', 2))
+# Seconds between checks of the map file for a newer version
+CANONICAL_MAP_CHECK_SECONDS = float(os.getenv('CANONICAL_MAP_CHECK_SECONDS', 5))
 
-@app.route('/embedding-info', methods=['GET'])
-def get_embedding_info():
+# Held shared by every serving process and exclusively by offline tools that write the collection
+CHROMA_SERVER_LOCK_FILE = os.getenv('CHROMA_SERVER_LOCK_FILE', os.path.join(CHROMA_DATA_PATH, 'server.lock'))
+
+# Multi-process serving (chroma_server_multi.py): this process's role (writer, reader or empty for a
+# standalone server) and the file the writer bumps after every write so readers reopen the collection
+CHROMA_SERVER_ROLE = os.getenv('CHROMA_SERVER_ROLE', '').lower()
+CHROMA_GENERATION_FILE = os.getenv('CHROMA_GENERATION_FILE', os.path.join(CHROMA_DATA_PATH, 'generation'))
+# Seconds a reader keeps the previous client open after reopening, for searches still using it
+REOPEN_GRACE_SECONDS = float(os.getenv('REOPEN_GRACE_SECONDS', 30))
+# Where the writer records each generation's written and deleted entities so readers apply them to their
+# indexes instead of reopening, how many generations it keeps, and how many changed entities a reader
+# serves from its overlay before it reopens the collection anyway
+CHROMA_CHANGES_DIR = os.getenv('CHROMA_CHANGES_DIR', os.path.join(CHROMA_DATA_PATH, 'changes'))
+CHANGE_LOG_KEEP = int(os.getenv('CHANGE_LOG_KEEP', 1000))
+REOPEN_DELTA_MAX_ENTITIES = int(os.getenv('REOPEN_DELTA_MAX_ENTITIES', 5000))
+
+# Startup warm-up run before the server reports ready
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_QUERIES = [text for text in os.getenv('WARMUP_QUERIES', 'India|election results|cricket match').split('|') if text]
+WARMUP_SYNTHETIC_QUERIES = int(os.getenv('WARMUP_SYNTHETIC_QUERIES', 3))
+
+METRICS.histogram('chroma_server_request_seconds', 'End-to-end request latency by route.')
+METRICS.counter('chroma_server_request_errors_total', 'Responses with an error status by route.')
+METRICS.histogram('chroma_server_embedding_seconds', 'Embedding backend call latency.')
+METRICS.histogram('chroma_server_collection_query_seconds', 'Latency of collection.query calls.')
+METRICS.counter('chroma_server_search_results_filtered_total', 'Search candidates dropped by minSimilarity.')
+METRICS.counter('chroma_server_embedding_hedges_total', 'Hedged embedding requests by which request answered first.')
+METRICS.counter('chroma_server_search_results_collapsed_total', 'Search results merged into a better-ranked result for the same canonical entity.')
+METRICS.counter('chroma_server_search_collapse_widened_total', 'Searches re-run with a wider candidate window because collapsing left fewer than nResults.')
+METRICS.counter('chroma_server_search_coalesced_total', 'Searches answered by an identical search already in flight.')
+METRICS.counter('chroma_server_entities_written_total', 'Entities written to the collection (rate() gives vectors/s).')
+METRICS.counter('chroma_server_entities_deleted_total', 'Entities deleted from the collection.')
+METRICS.gauge('chroma_server_collection_entities', 'Entities in the serving collection.', lambda: collection.count())
+METRICS.gauge('chroma_server_ready', 'Whether the startup warm-up has finished.', lambda: int(WARMUP_STATE['ready']))
+METRICS.gauge(
+    'chroma_server_startup_seconds', 'Seconds from process start until ready (0 while warming up).',
+    lambda: WARMUP_STATE['startupSeconds'] or 0
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.observe('chroma_server_request_seconds', time.perf_counter() - g.request_started, route=route)
+    if response.status_code >= 400:
+        METRICS.inc('chroma_server_request_errors_total', route=route, status=str(response.status_code))
+    return response
+
+
+def parse_query_vector(data, dim=None):
     """
-    Get information about the current embedding function configuration.
-    This endpoint helps debug embedding function issues.
+    Return the precomputed query vector carried by a search request
+    (queryEmbedding as a JSON list or queryEmbeddingB64), or None.
     """
-    try:
-        return jsonify({
-            'EMBEDDING_FUNCTION': EMBEDDING_FUNCTION,
-            'embedding_function_configured': EMBEDDING_FUNCTION is not None,
-            'collection_name': COLLECTION_NAME,
-            'ollama_url': OLLAMA_URL if EMBEDDING_FUNCTION == 'ollama' else None,
-            'ollama_model': OLLAMA_MODEL if EMBEDDING_FUNCTION == 'ollama' else None,
-            'data_path': CHROMA_DATA_PATH,
-            'note': 'Existing collections use their original embedding function. To change embedding function, create a new collection or delete existing one.'
-        }), 200
-    except Exception as e:
-        logger.error(f"❌ Get embedding info failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    if data.get('queryEmbedding') is not None:
+        matrix = fit_embedding_matrix([data['queryEmbedding']])
+    elif data.get('queryEmbeddingB64'):
+        matrix = decode_vectors(data['queryEmbeddingB64'], dim or data.get('queryEmbeddingDim'))
+    else:
+        return None
+    if matrix.shape[0] != 1:
+        raise ValueError(f"Expected exactly one query vector, got {matrix.shape[0]}")
+    return matrix[0]
 
-@app.route('/collection/details', methods=['GET'])
-def get_collection_details():
+
+def search_params_from_args(args):
     """
-    Get details of the current collection, including embedding function and document count.
+    Read /search parameters from the query string (used with binary request bodies).
     """
-    try:
-        collection_info = {
-            'name': collection.name,
-            'document_count': collection.count(),
-            'embedding_function': str(collection.embedding_function) if collection.embedding_function else 'None (using default)',
-            'note': 'Existing collections use their original embedding function. To change embedding function, create a new collection or delete existing one.'
-        }
-        return jsonify(collection_info), 200
-    except Exception as e:
-        logger.error(f"❌ Get collection details failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    params = {'query': args.get('query')}
+    if 'nResults' in args:
+        params['nResults'] = int(args['nResults'])
+    if 'minSimilarity' in args:
+        params['minSimilarity'] = float(args['minSimilarity'])
+    if 'ef' in args:
+        params['ef'] = int(args['ef'])
+    if 'rerank' in args:
+        params['rerank'] = args['rerank'].lower() == 'true'
+    if 'mmrLambda' in args:
+        params['mmrLambda'] = float(args['mmrLambda'])
+    if 'boostField' in args:
+        params['boostField'] = args['boostField']
+    if 'boostWeight' in args:
+        params['boostWeight'] = float(args['boostWeight'])
+    if 'collapseDuplicates' in args:
+        params['collapseDuplicates'] = args['collapseDuplicates'].lower() == 'true'
+    if args.get('whereFilter'):
+        params['whereFilter'] = json.loads(args['whereFilter'])
+    return params
 
-@app.route('/collection/recreate', methods=['POST'])
-def recreate_collection():
+
+EMBEDDING_BACKEND = create_embedding_backend(EMBEDDING_BACKEND_NAME)
+logger.info(f"✅ Embedding backend: {EMBEDDING_BACKEND.name} ({EMBEDDING_BACKEND.model})")
+
+EMBEDDING_CACHE = EmbeddingCache(
+    model=f"{EMBEDDING_BACKEND.model}:{EMBEDDING_TARGET_DIM}",
+    path=EMBEDDING_CACHE_PATH,
+    memory_size=EMBEDDING_CACHE_MEMORY_SIZE,
+    disk_size=EMBEDDING_CACHE_DISK_SIZE
+) if EMBEDDING_CACHE_ENABLED and EMBEDDING_BACKEND.cacheable else None
+
+
+def fetch_embeddings(texts):
     """
-    Recreate the collection with the correct embedding function and dimensions.
-    This endpoint deletes the existing collection and creates a new one.
+    Embed texts with EMBEDDING_BACKEND as an (n, EMBEDDING_TARGET_DIM) float32 matrix.
     """
-    try:
-        global collection
-        
-        # Delete the existing collection if it exists
+    with METRICS.timer('chroma_server_embedding_seconds', backend=EMBEDDING_BACKEND.name, kind='query'):
+        return fit_embedding_matrix(EMBEDDING_BACKEND.embed(texts))
+
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+def get_embeddings(texts):
+    """
+    Embed texts as an (n, EMBEDDING_TARGET_DIM) float32 matrix, serving
+    repeated texts from EMBEDDING_CACHE and sending only the misses to
+    the embedding backend in one batch.
+    """
+    if not texts:
+        return fit_embedding_matrix([])
+    if EMBEDDING_CACHE is None:
+        return fetch_embeddings(texts)
+
+    cached = EMBEDDING_CACHE.get_many(texts)
+    missing = list(dict.fromkeys(text for text in texts if text not in cached))
+    if missing:
+        fetched = dict(zip(missing, (row.copy() for row in fetch_embeddings(missing))))
+        EMBEDDING_CACHE.put_many(fetched)
+        cached.update(fetched)
+
+    return np.vstack([cached[text] for text in texts])
+
+
+def embed_documents(texts):
+    """
+    Embed documents for ingestion. Bypasses the query embedding cache and the
+    micro-batcher so ingest workers run their backend calls in parallel.
+    """
+    with METRICS.timer('chroma_server_embedding_seconds', backend=EMBEDDING_BACKEND.name, kind='document'):
+        return fit_embedding_matrix(EMBEDDING_BACKEND.embed_batch(texts))
+
+
+def open_serving_collection(base, source_client=None):
+    """
+    The collection the server reads and writes: the base collection itself,
+    or a PartitionedCollection over it when COLLECTION_PARTITIONING is set.
+    """
+    if base is None or COLLECTION_PARTITIONING == 'none':
+        return base
+    partitioned = PartitionedCollection(source_client or client, base.name, COLLECTION_PARTITIONING,
+                                         metadata=base.metadata, embedding_function=EMBEDDING_FUNCTION)
+    logger.info(f"✅ Serving {base.name} from {len(partitioned._partitions)} {COLLECTION_PARTITIONING} partitions")
+    return partitioned
+
+
+collection = open_serving_collection(collection)
+
+
+def collection_space():
+    """
+    Distance function of the serving collection (Chroma defaults to squared L2).
+    """
+    return (collection.metadata or {}).get('hnsw:space', 'l2')
+
+
+COLLECTION_DELTAS = CollectionDeltaOverlay()
+
+
+def get_entities(ids, include):
+    """
+    collection.get(ids=ids) with a reader's applied changes merged in.
+    """
+    if len(COLLECTION_DELTAS):
+        return COLLECTION_DELTAS.get(collection, ids, include)
+    return collection.get(ids=ids, include=include)
+
+
+def create_entity_indexes():
+    """
+    Fresh (lexical, name, int8) indexes as configured; disabled ones are None.
+    """
+    return (
+        LexicalIndex() if LEXICAL_INDEX_ENABLED else None,
+        EntityNameIndex() if NAME_FAST_PATH_ENABLED else None,
+        QuantizedVectorIndex(get_entities) if VECTOR_ENGINE == 'int8' else None
+    )
+
+
+LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX = create_entity_indexes()
+
+# In-memory indexes derived from the collection: each has add/remove/clear and a ready flag.
+# Indexes with needs_embeddings also receive the entities' vectors.
+ENTITY_INDEXES = [index for index in (LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX) if index is not None]
+
+
+def query_vectors(query_embeddings, n_results, where=None, include_embeddings=False):
+    """
+    Nearest neighbours in the collection.query() result shape, from the int8
+    engine when VECTOR_ENGINE=int8 and it is built, otherwise from Chroma
+    (with a reader's applied changes merged in).
+    """
+    with METRICS.timer('chroma_server_collection_query_seconds'):
+        if QUANTIZED_INDEX is not None and QUANTIZED_INDEX.ready:
+            return QUANTIZED_INDEX.query(query_embeddings, n_results, where, include_embeddings, collection_space())
+        if len(COLLECTION_DELTAS):
+            return COLLECTION_DELTAS.query(
+                collection, query_embeddings, n_results, where, include_embeddings, collection_space()
+            )
+        include = ['metadatas', 'documents', 'distances'] + (['embeddings'] if include_embeddings else [])
+        return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, include=include)
+
+
+def index_entities(ids, documents, metadatas, embeddings=None, indexes=None, source=None):
+    """
+    Apply written entities to every in-memory entity index. Embeddings are
+    read back from the collection when an index needs them and the caller
+    let Chroma embed the documents.
+    """
+    indexes = ENTITY_INDEXES if indexes is None else indexes
+    source = collection if source is None else source
+    documents = documents if documents is not None else [None] * len(ids)
+    metadatas = metadatas if metadatas is not None else [None] * len(ids)
+    if embeddings is None and any(getattr(index, 'needs_embeddings', False) for index in indexes):
+        fetched = source.get(ids=ids, include=['embeddings'])
+        by_id = dict(zip(fetched['ids'], fetched['embeddings']))
+        embeddings = [by_id[entity_id] for entity_id in ids]
+    for index in indexes:
+        index.add(ids, documents, metadatas, embeddings)
+
+
+def reset_entity_indexes():
+    for index in ENTITY_INDEXES:
+        index.clear()
+
+
+def load_entity_indexes(source=None, indexes=None):
+    """
+    Build the in-memory entity indexes by paging through the collection.
+    """
+    source = collection if source is None else source
+    indexes = ENTITY_INDEXES if indexes is None else indexes
+    if not indexes or source is None:
+        return
+    started = time.time()
+    include = ['documents', 'metadatas']
+    if any(getattr(index, 'needs_embeddings', False) for index in indexes):
+        include.append('embeddings')
+    offset = 0
+    while True:
+        page = source.get(limit=ENTITY_INDEX_PAGE_SIZE, offset=offset, include=include)
+        if not page['ids']:
+            break
+        index_entities(page['ids'], page['documents'], page['metadatas'], page.get('embeddings'), indexes, source)
+        offset += len(page['ids'])
+    for index in indexes:
+        index.ready = True
+    logger.info(f"✅ Built in-memory entity indexes for {offset} entities in {time.time() - started:.1f}s")
+
+
+REOPEN_STATS = {'reopens': 0, 'lastReopenSeconds': None, 'generation': None, 'deltasApplied': 0, 'deltaEntities': 0}
+REOPEN_LOCK = threading.Lock()
+
+
+def apply_collection_changes(changes, generation=None):
+    """
+    Apply the writer's change records (from read_collection_changes()) to
+    this reader's entity indexes and to the delta overlay that Chroma
+    searches and gets go through, instead of reopening and rescanning the
+    collection.
+    """
+    with REOPEN_LOCK:
+        entities = 0
+        for change in changes:
+            if 'removed' in change:
+                ids = change['removed']
+                for index in ENTITY_INDEXES:
+                    index.remove(ids)
+                COLLECTION_DELTAS.remove(ids)
+            else:
+                ids = change['ids']
+                if not ids:
+                    continue
+                embeddings = decode_vectors(change['embeddings'])
+                index_entities(ids, change['documents'], change['metadatas'], embeddings)
+                COLLECTION_DELTAS.upsert(ids, change['documents'], change['metadatas'], embeddings)
+            entities += len(ids)
+        bump_collection_generation()
+        REOPEN_STATS['deltasApplied'] += len(changes)
+        REOPEN_STATS['deltaEntities'] += entities
+        REOPEN_STATS['generation'] = generation
+        return entities
+
+
+def delta_overlay_full():
+    return len(COLLECTION_DELTAS) > REOPEN_DELTA_MAX_ENTITIES
+
+
+def reopen_collection(generation=None):
+    """
+    Pick up writes made by another process (the multi-process writer). A
+    Chroma client only sees its own HNSW updates, so open a fresh client on
+    the same path, rebuild the entity indexes against it and warm it, then
+    swap everything in at once. Searches still running on the old client
+    finish against it; it is stopped after REOPEN_GRACE_SECONDS.
+    """
+    global client, collection, LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX, ENTITY_INDEXES, COLLECTION_DELTAS
+    from chromadb.api.client import SharedSystemClient
+
+    with REOPEN_LOCK:
+        started = time.time()
+        old_collection = collection
+        old_system = client._system
+        # Chroma hands out one cached system per path; drop it so the new client loads from disk
+        SharedSystemClient.clear_system_cache()
+        new_client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
         try:
-            existing_collection = client.get_collection(name=COLLECTION_NAME)
-            client.delete_collection(name=COLLECTION_NAME)
-            logger.info(f"✅ Deleted existing collection: {COLLECTION_NAME}")
+            new_collection = open_serving_collection(new_client.get_collection(name=serving_collection_name()), new_client)
         except Exception:
-            logger.info(f"📝 Collection {COLLECTION_NAME} doesn't exist, creating new one")
-        
-        # Create a new collection with the correct embedding function
-        collection = client.create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=EMBEDDING_FUNCTION
-        )
-        logger.info(f"✅ Created new collection: {COLLECTION_NAME} with embedding function: {EMBEDDING_FUNCTION}")
-        
-        return jsonify({'success': True, 'message': 'Collection recreated successfully'}), 200
-    except Exception as e:
-        logger.error(f"❌ Recreate collection failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+            new_collection = None
+        lexical, name, quantized = create_entity_indexes()
+        new_indexes = [index for index in (lexical, name, quantized) if index is not None]
+        load_entity_indexes(new_collection, new_indexes)
+        count = new_collection.count() if new_collection is not None else 0
+        if count and VECTOR_ENGINE == 'hnsw':
+            new_collection.query(query_embeddings=[[0.0] * EMBEDDING_TARGET_DIM], n_results=1)
 
-@app.route('/test-embedding', methods=['POST'])
-def test_embedding():
+        client, collection = new_client, new_collection
+        LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX, ENTITY_INDEXES = lexical, name, quantized, new_indexes
+        COLLECTION_DELTAS = CollectionDeltaOverlay()
+        bump_collection_generation()
+
+        def release_old_client():
+            if isinstance(old_collection, PartitionedCollection):
+                old_collection._executor.shutdown(wait=False)
+            old_system.stop()
+
+        timer = threading.Timer(REOPEN_GRACE_SECONDS, release_old_client)
+        timer.daemon = True
+        timer.start()
+        REOPEN_STATS['reopens'] += 1
+        REOPEN_STATS['lastReopenSeconds'] = round(time.time() - started, 3)
+        REOPEN_STATS['generation'] = generation
+        logger.info(f"🔄 Reopened {serving_collection_name()} ({count} entities) in {time.time() - started:.2f}s")
+        return count
+
+
+WARMUP_STATE = {'ready': False, 'readyAt': None, 'startupSeconds': None, 'steps': {}}
+
+
+def warm_vector_index():
     """
-    Test the embedding function with a sample text to check dimensions.
+    Run synthetic queries so the vector index is loaded before the first search.
     """
+    count = collection.count()
+    if count == 0 or WARMUP_SYNTHETIC_QUERIES <= 0:
+        return
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((WARMUP_SYNTHETIC_QUERIES, EMBEDDING_TARGET_DIM)).astype(np.float32)
+    query_vectors(queries, min(10, count))
+
+
+def run_warmup_step(name, func):
+    started = time.time()
     try:
-        data = request.get_json()
-        test_text = data.get('text', 'This is a test sentence')
-        
-        # Get embedding using our function
-        embedding = get_embedding_ollama(test_text)
-        
-        return jsonify({
-            'text': test_text,
-            'embedding_dimension': len(embedding),
-            'embedding_sample': embedding[:5],  # First 5 values
-            'model_used': 'znbang/bge:large-en-v1.5-q4_k_m'
-        }), 200
+        func()
+        WARMUP_STATE['steps'][name] = {'ok': True, 'seconds': round(time.time() - started, 3)}
     except Exception as e:
-        logger.error(f"❌ Test embedding failed: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.warning(f"⚠️ Warm-up step {name} failed: {str(e)}")
+        WARMUP_STATE['steps'][name] = {'ok': False, 'seconds': round(time.time() - started, 3), 'error': str(e)}
+
+
+def warm_up():
+    """
+    Load what the first search would otherwise load lazily (entity indexes,
+    the embedding model, the HNSW index), then mark the server ready. Failed
+    steps are recorded in WARMUP_STATE but do not keep the server unready.
+    """
+    run_warmup_step('entityIndexes', load_entity_indexes)
+    if WARMUP_ENABLED:
+        if WARMUP_QUERIES:
+            run_warmup_step('embeddingModel', lambda: fetch_embeddings(WARMUP_QUERIES))
+        run_warmup_step('vectorIndex', warm_vector_index)
+
+    WARMUP_STATE['readyAt'] = time.time()
+    WARMUP_STATE['startupSeconds'] = round(WARMUP_STATE['readyAt'] - SERVER_STARTED_AT, 3)
+    WARMUP_STATE['ready'] = True
+    logger.info(f"✅ Server ready {WARMUP_STATE['startupSeconds']}s after start")
+
+
+def start_warm_up():
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+class WriteGate:
+    """
+    Lets any number of collection writes run together, and lets one caller
+    at a time shut them out for a short exclusive section (the blue/green
+    alias switch), waiting for writes already in progress to finish.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writers = 0
+        self._closed = False
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            while self._closed:
+                self._condition.wait()
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            while self._closed:
+                self._condition.wait()
+            self._closed = True
+            while self._writers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._closed = False
+                self._condition.notify_all()
+
+
+COLLECTION_WRITE_GATE = WriteGate()
+
+# Ids written to the serving collection while a rebuild copies it (None when no rebuild is running)
+REBUILD_DIRTY_IDS = None
+REBUILD_DIRTY_LOCK = threading.Lock()
+
+
+def mark_rebuild_dirty(ids):
+    with REBUILD_DIRTY_LOCK:
+        if REBUILD_DIRTY_IDS is not None:
+            REBUILD_DIRTY_IDS.update(ids)
+
+
+def delete_entities(ids):
+    """
+    Delete entities from the collection and the in-memory indexes.
+    """
+    with change_order():
+        with COLLECTION_WRITE_GATE.write():
+            collection.delete(ids=ids)
+            mark_rebuild_dirty(ids)
+            for index in ENTITY_INDEXES:
+                index.remove(ids)
+        bump_collection_generation(entity_changes(ids, removed=True))
+    METRICS.inc('chroma_server_entities_deleted_total', len(ids))
+
+
+def write_entities(ids, embeddings, documents, metadatas, operation='upsert'):
+    """
+    Upsert (or, with operation='add', add) entities with precomputed
+    embeddings into the collection, recording each text's content hash in
+    its metadata.
+    """
+    metadatas = with_content_hashes(documents, metadatas if metadatas is not None else [None] * len(ids))
+    with change_order():
+        with COLLECTION_WRITE_GATE.write():
+            getattr(collection, operation)(
+                ids=ids,
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas
+            )
+            mark_rebuild_dirty(ids)
+            index_entities(ids, documents, metadatas, embeddings)
+        bump_collection_generation(entity_changes(ids, documents, metadatas, embeddings))
+    METRICS.inc('chroma_server_entities_written_total', len(ids), operation=operation)
+
+
+INGEST_EXECUTOR = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+
+
+def iter_ndjson_chunks(stream, chunk_size, skip=0):
+    """
+    Read NDJSON entity lines from a stream and yield them in bounded chunks.
+
+    Each line must be an object with entityId, entityText and metadata.
+    Yields (first_line, last_line, entities, invalid) where invalid lists
+    {'line', 'error'} for lines that could not be used. The first `skip`
+    lines are ignored so an interrupted upload can be resumed.
+    """
+    entities = []
+    invalid = []
+    first_line = None
+    line_number = 0
+
+    for raw_line in stream:
+        line_number += 1
+        if line_number <= skip:
+            continue
+        if first_line is None:
+            first_line = line_number
+
+        line = raw_line.strip()
+        if line:
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict) or not item.get('entityId') or not item.get('entityText'):
+                    raise ValueError('entityId and entityText are required')
+                if not isinstance(item.get('metadata'), dict) or not item['metadata']:
+                    raise ValueError('metadata must be a non-empty object')
+                entities.append(item)
+            except ValueError as e:
+                invalid.append({'line': line_number, 'error': str(e)})
+
+        if len(entities) >= chunk_size:
+            yield first_line, line_number, entities, invalid
+            entities, invalid, first_line = [], [], None
+
+    if entities or invalid:
+        yield first_line, line_number, entities, invalid
+
+
+def ingest_ndjson(stream, chunk_size, skip=0):
+    """
+    Embed and upsert NDJSON entities chunk by chunk, yielding one progress
+    event per chunk and a final summary.
+
+    Embedding runs on INGEST_EXECUTOR; at most INGEST_MAX_PENDING_CHUNKS chunks
+    are in flight, after which reading from the stream pauses until the oldest
+    chunk has been written. Chunks are written in order, so `resumeFrom` in a
+    progress event is always safe to pass back as `skip`.
+    """
+    started = time.time()
+    pending = deque()
+    totals = {'processed': 0, 'failed': 0, 'invalid': 0, 'chunks': 0, 'failedChunks': 0}
+    resume_from = skip
+
+    def finish(chunk):
+        nonlocal resume_from
+        first_line, last_line, entities, invalid, future = chunk
+        event = {
+            'event': 'chunk',
+            'chunk': totals['chunks'],
+            'lines': [first_line, last_line],
+            'count': len(entities),
+            'invalid': invalid
+        }
+        totals['chunks'] += 1
+        totals['invalid'] += len(invalid)
+        try:
+            if entities:
+                write_entities(
+                    ids=[item['entityId'] for item in entities],
+                    embeddings=future.result(),
+                    documents=[item['entityText'] for item in entities],
+                    metadatas=[item['metadata'] for item in entities]
+                )
+            totals['processed'] += len(entities)
+            event['status'] = 'ok'
+        except Exception as e:
+            logger.error(f"❌ Ingest chunk {event['chunk']} (lines {first_line}-{last_line}) failed: {str(e)}")
+            totals['failed'] += len(entities)
+            totals['failedChunks'] += 1
+            event['status'] = 'error'
+            event['error'] = str(e)
+        resume_from = last_line
+        event['processed'] = totals['processed']
+        event['resumeFrom'] = resume_from
+        return event
+
+    for first_line, last_line, entities, invalid in iter_ndjson_chunks(stream, chunk_size, skip):
+        future = INGEST_EXECUTOR.submit(embed_documents, [item['entityText'] for item in entities]) if entities else None
+        pending.append((first_line, last_line, entities, invalid, future))
+        while len(pending) >= INGEST_MAX_PENDING_CHUNKS:
+            yield finish(pending.popleft())
+
+    while pending:
+        yield finish(pending.popleft())
+
+    elapsed = time.time() - started
+    totals.update({
+        'event': 'done',
+        'resumeFrom': resume_from,
+        'elapsedSeconds': round(elapsed, 3),
+        'entitiesPerSecond': round(totals['processed'] / elapsed, 1) if elapsed > 0 else None
+    })
+    logger.info(f"✅ Streamed ingest upserted {totals['processed']} entities in {elapsed:.1f}s "
+                f"({totals['failedChunks']} failed chunks, {totals['invalid']} invalid lines)")
+    yield totals
+
+
+ENTITY_SYNC_LOCK = threading.Lock()
+
+
+def sync_entities(source, state, updated_field=SYNC_UPDATED_FIELD, full=False):
+    """
+    Bring the collection in line with the entity source: embed and upsert
+    new or changed entities (by content hash) and delete entities that are
+    gone from the source. With updated_field, only documents at or past
+    the stored high-water mark are read, and removals are found from a keys-only
+    scan. Batches are embedded on INGEST_EXECUTOR while earlier ones are
+    written. The watermark only advances past written batches, so a failed
+    run resumes where it stopped.
+    """
+    started = time.time()
+    since = None if full or not updated_field else state.get_meta('watermark')
+    incremental = since is not None
+    totals = {'mode': 'incremental' if incremental else 'full', 'scanned': 0, 'unchanged': 0,
+              'upserted': 0, 'deleted': 0, 'batches': 0}
+    seen = set()
+    pending = deque()
+
+    def finish(batch):
+        records, hashes, watermark, future = batch
+        if records:
+            write_entities(
+                ids=[record[0] for record in records],
+                embeddings=future.result(),
+                documents=[record[1] for record in records],
+                metadatas=[record[2] for record in records]
+            )
+            state.put_hashes(hashes)
+            totals['upserted'] += len(records)
+        if watermark is not None:
+            state.set_meta('watermark', watermark)
+        totals['batches'] += 1
+
+    for documents in source.batches(updated_field or None, since):
+        records = [entity_record(doc) for doc in documents]
+        seen.update(record[0] for record in records)
+        known = state.hashes([record[0] for record in records])
+        changed, hashes = [], {}
+        for record in records:
+            content_hash = entity_content_hash(record[1], record[2])
+            if known.get(record[0]) != content_hash:
+                changed.append(record)
+                hashes[record[0]] = content_hash
+        totals['scanned'] += len(records)
+        totals['unchanged'] += len(records) - len(changed)
+
+        watermark = None
+        if updated_field:
+            marks = [doc[updated_field] for doc in documents if doc.get(updated_field) is not None]
+            watermark = max(marks, key=update_order_key) if marks else None
+        future = INGEST_EXECUTOR.submit(embed_documents, [record[1] for record in changed]) if changed else None
+        pending.append((changed, hashes, watermark, future))
+        while len(pending) >= INGEST_MAX_PENDING_CHUNKS:
+            finish(pending.popleft())
+
+    while pending:
+        finish(pending.popleft())
+
+    present = source.ids() if incremental else seen
+    if present:
+        removed = sorted(state.ids() - present)
+        for start in range(0, len(removed), SYNC_BATCH_SIZE):
+            chunk = removed[start:start + SYNC_BATCH_SIZE]
+            delete_entities(chunk)
+            state.delete(chunk)
+        totals['deleted'] = len(removed)
+    else:
+        logger.warning("⚠️ Entity source returned no entities, skipping deletions")
+
+    totals['watermark'] = state.get_meta('watermark')
+    totals['elapsedSeconds'] = round(time.time() - started, 3)
+    totals['finishedAt'] = time.time()
+    state.set_meta('lastRun', totals)
+    logger.info(f"✅ Entity sync ({totals['mode']}): {totals['upserted']} upserted, {totals['deleted']} deleted, "
+                f"{totals['unchanged']} unchanged in {totals['elapsedSeconds']}s")
+    return totals
+
+
+def run_entity_sync(full=False, source=SYNC_SOURCE):
+    """
+    Run one sync with the configured source and state file; None if a sync
+    is already running.
+    """
+    if not ENTITY_SYNC_LOCK.acquire(blocking=False):
+        return None
+    try:
+        state = EntitySyncState(SYNC_STATE_PATH, model=f"{EMBEDDING_BACKEND.model}:{EMBEDDING_TARGET_DIM}")
+        try:
+            return sync_entities(create_entity_source(source), state, full=full)
+        finally:
+            state.close()
+    finally:
+        ENTITY_SYNC_LOCK.release()
+
+
+def start_entity_sync_schedule():
+    def run():
+        while True:
+            time.sleep(SYNC_INTERVAL_SECONDS)
+            try:
+                run_entity_sync()
+            except Exception as e:
+                logger.error(f"❌ Scheduled entity sync failed: {str(e)}")
+
+    threading.Thread(target=run, name='entity-sync', daemon=True).start()
+
+
+REBUILD_LOCK = threading.Lock()
+
+
+def drop_collection_by_name(name):
+    """
+    Delete a collection and the partition collections (<name>__*) created for it.
+    """
+    for existing in client.list_collections():
+        if existing.name == name or existing.name.startswith(f"{name}__"):
+            client.delete_collection(name=existing.name)
+
+
+def take_rebuild_dirty_ids():
+    global REBUILD_DIRTY_IDS
+    with REBUILD_DIRTY_LOCK:
+        dirty, REBUILD_DIRTY_IDS = REBUILD_DIRTY_IDS, set()
+    return sorted(dirty)
+
+
+def apply_entities(source, target, ids, indexes=None):
+    """
+    Make target (and indexes) match source for the given ids: copy the ones
+    source has, delete the ones it no longer has.
+    """
+    for start in range(0, len(ids), REBUILD_BATCH_SIZE):
+        chunk = ids[start:start + REBUILD_BATCH_SIZE]
+        page = source.get(ids=chunk, include=REBUILD_INCLUDE)
+        missing = sorted(set(chunk) - set(page['ids']))
+        if page['ids']:
+            metadatas = upsert_collection_page(target, page)
+            if indexes is not None:
+                index_entities(page['ids'], page['documents'], metadatas, page['embeddings'], indexes, target)
+        if missing:
+            target.delete(ids=missing)
+            for index in indexes or []:
+                index.remove(missing)
+
+
+def schedule_collection_retirement(name, delay, retired=None):
+    """
+    Drop a collection the alias no longer points at after `delay` seconds,
+    leaving searches still running against it time to finish.
+    """
+    def retire():
+        try:
+            if serving_collection_name() == name:
+                return
+            if isinstance(retired, PartitionedCollection):
+                retired._executor.shutdown(wait=False)
+            drop_collection_by_name(name)
+            logger.info(f"🗑️ Retired collection {name}")
+        except Exception as e:
+            logger.error(f"❌ Retiring collection {name} failed: {str(e)}")
+
+    timer = threading.Timer(max(0.0, delay), retire)
+    timer.daemon = True
+    timer.start()
+
+
+def rebuild_collection(source='collection'):
+    """
+    Blue/green rebuild. A new versioned collection (with the current HNSW
+    and partitioning settings) is filled from the serving collection or
+    from a sync source, while writes keep going to the serving collection;
+    ids written meanwhile are replayed onto the new one. After validation
+    its entity indexes are built and its HNSW index warmed, then writes are
+    paused for a final catch-up while the alias file and the serving
+    collection are switched. The old collection is dropped after
+    REBUILD_RETIRE_SECONDS.
+    """
+    global collection, LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX, ENTITY_INDEXES, REBUILD_DIRTY_IDS
+    started = time.time()
+    serving = collection
+    serving_name = serving.name if serving is not None else None
+    target_name = f"{COLLECTION_NAME}_v{time.strftime('%Y%m%d%H%M%S')}"
+    REBUILD_STATE['target'] = target_name
+    target = open_serving_collection(client.create_collection(
+        name=target_name,
+        embedding_function=EMBEDDING_FUNCTION,
+        metadata=hnsw_collection_metadata()
+    ))
+    with REBUILD_DIRTY_LOCK:
+        REBUILD_DIRTY_IDS = set()
+    try:
+        REBUILD_STATE['phase'] = 'populating'
+        if source == 'collection':
+            # Reconciled with the serving collection below, so its count is checked instead
+            expected = None
+            if serving is not None:
+                populate_from_collection(serving, target)
+        else:
+            expected = populate_from_source(source, target, embed_documents)
+
+        REBUILD_STATE['phase'] = 'catchingUp'
+        if serving is not None:
+            if source == 'collection':
+                # Offset paging can skip entities when the serving collection shrinks mid-copy
+                serving_ids, target_ids = collection_ids(serving), collection_ids(target)
+                apply_entities(serving, target, sorted(serving_ids ^ target_ids))
+            apply_entities(serving, target, take_rebuild_dirty_ids())
+
+        REBUILD_STATE['phase'] = 'validating'
+        report = validate_rebuild(target, expected, serving, compare=source == 'collection')
+        if not report['ok']:
+            raise RuntimeError(f"Rebuilt collection failed validation: {'; '.join(report['problems'])}")
+
+        REBUILD_STATE['phase'] = 'warming'
+        lexical, name, quantized = create_entity_indexes()
+        new_indexes = [index for index in (lexical, name, quantized) if index is not None]
+        load_entity_indexes(target, new_indexes)
+        if VECTOR_ENGINE == 'hnsw' and report['count']:
+            target.query(query_embeddings=[[0.0] * EMBEDDING_TARGET_DIM], n_results=1)
+
+        REBUILD_STATE['phase'] = 'switching'
+        with COLLECTION_WRITE_GATE.exclusive():
+            if serving is not None:
+                apply_entities(serving, target, take_rebuild_dirty_ids(), new_indexes)
+            with REBUILD_DIRTY_LOCK:
+                REBUILD_DIRTY_IDS = None
+            write_collection_alias({
+                'collection': target_name,
+                'previous': serving_name,
+                'switchedAt': time.time(),
+                'retireAt': time.time() + REBUILD_RETIRE_SECONDS
+            })
+            collection = target
+            LEXICAL_INDEX, NAME_INDEX, QUANTIZED_INDEX, ENTITY_INDEXES = lexical, name, quantized, new_indexes
+        bump_collection_generation()
+    except Exception:
+        with REBUILD_DIRTY_LOCK:
+            REBUILD_DIRTY_IDS = None
+        drop_collection_by_name(target_name)
+        raise
+
+    if serving_name is not None:
+        schedule_collection_retirement(serving_name, REBUILD_RETIRE_SECONDS, serving)
+    summary = dict(report, ok=True, source=source, collection=target_name, previous=serving_name,
+                   elapsedSeconds=round(time.time() - started, 3), finishedAt=time.time())
+    logger.info(f"✅ Rebuilt {COLLECTION_NAME} as {target_name} ({report['count']} entities) in {summary['elapsedSeconds']}s")
+    return summary
+
+
+def start_collection_rebuild(source='collection'):
+    """
+    Run rebuild_collection on a background thread; False if one is already running.
+    """
+    if not REBUILD_LOCK.acquire(blocking=False):
+        return False
+    REBUILD_STATE.update(running=True, phase='creating', source=source, target=None, copied=0, startedAt=time.time())
+
+    def run():
+        try:
+            REBUILD_STATE['lastRun'] = rebuild_collection(source)
+        except Exception as e:
+            logger.error(f"❌ Collection rebuild failed: {str(e)}")
+            REBUILD_STATE['lastRun'] = {'ok': False, 'source': source, 'error': str(e), 'finishedAt': time.time()}
+        finally:
+            REBUILD_STATE.update(running=False, phase=None)
+            REBUILD_LOCK.release()
+
+    threading.Thread(target=run, name='collection-rebuild', daemon=True).start()
+    return True
+
+
+# Bumped on every write to the collection; cached search results are keyed by it
+COLLECTION_GENERATION = 0
+COLLECTION_GENERATION_LOCK = threading.Lock()
+
+SEARCH_RESULT_CACHE = LRUCache(SEARCH_CACHE_SIZE)
+
+
+class SingleFlight:
+    """
+    In-flight computations by key. The first caller for a key computes it;
+    callers arriving before it finishes wait on its Future and share the
+    result (or the exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def claim(self, keys):
+        """
+        Returns (owned, joined): the positions of `keys` this caller must
+        compute and resolve, and a Future per position to wait on instead.
+        A key repeated within `keys` joins its first position.
+        """
+        owned, joined = [], {}
+        with self._lock:
+            for position, key in enumerate(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    self._calls[key] = Future()
+                    owned.append(position)
+                else:
+                    joined[position] = future
+            self.leaders += len(owned)
+            self.coalesced += len(joined)
+        return owned, joined
+
+    def resolve(self, key, result=None, error=None):
+        with self._lock:
+            future = self._calls.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'inFlight': in_flight, 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+
+SEARCH_FLIGHTS = SingleFlight()
+
+
+def bump_collection_generation(changes=None):
+    """
+    Mark the collection as changed so no search result cached before now is
+    served again. `changes` (from entity_changes()) is what the writer
+    records for readers; without it they reopen the collection.
+    """
+    global COLLECTION_GENERATION
+    with COLLECTION_GENERATION_LOCK:
+        COLLECTION_GENERATION += 1
+        SEARCH_RESULT_CACHE.clear()
+        if CHROMA_SERVER_ROLE == 'writer':
+            publish_generation(COLLECTION_GENERATION, changes)
+        return COLLECTION_GENERATION
+
+
+# Distinguishes generations of successive writer processes that both count from 0
+WRITER_BOOT_ID = f"{os.getpid()}-{time.time_ns()}"
+
+
+def change_log_path(boot_id, generation):
+    return os.path.join(CHROMA_CHANGES_DIR, f"{boot_id}-{generation}.json")
+
+
+def entity_changes(ids, documents=None, metadatas=None, embeddings=None, removed=False):
+    """
+    The change record of a collection write for reader processes, or None
+    outside the writer (only the writer keeps a change log).
+    """
+    if CHROMA_SERVER_ROLE != 'writer':
+        return None
+    if removed:
+        return {'removed': list(ids)}
+    return {'ids': list(ids), 'documents': list(documents), 'metadatas': list(metadatas),
+            'embeddings': encode_vectors_b64(fit_embedding_matrix(embeddings))}
+
+
+CHANGE_ORDER_LOCK = threading.Lock()
+
+
+@contextmanager
+def change_order():
+    """
+    In the writer, run a collection write and its generation bump alone, so
+    change records are numbered in the order the writes reached Chroma.
+    """
+    if CHROMA_SERVER_ROLE == 'writer':
+        with CHANGE_ORDER_LOCK:
+            yield
+    else:
+        yield
+
+
+def reset_change_log():
+    """
+    Drop change records left by earlier writer processes; readers reopen
+    when the writer's boot id changes.
+    """
+    try:
+        for name in os.listdir(CHROMA_CHANGES_DIR):
+            if name.endswith('.json') and not name.startswith(f"{WRITER_BOOT_ID}-"):
+                os.remove(os.path.join(CHROMA_CHANGES_DIR, name))
+    except OSError:
+        pass
+
+
+def publish_generation(generation, changes=None):
+    """
+    Tell reader processes the persisted collection changed by replacing the
+    generation file atomically (readers never see a partial write). The
+    generation's change record, if any, is written first so a reader that
+    sees the generation can read it.
+    """
+    try:
+        if changes is not None:
+            os.makedirs(CHROMA_CHANGES_DIR, exist_ok=True)
+            change_path = change_log_path(WRITER_BOOT_ID, generation)
+            with open(f"{change_path}.tmp", 'w') as f:
+                json.dump(changes, f, separators=(',', ':'))
+            os.replace(f"{change_path}.tmp", change_path)
+            expired_path = change_log_path(WRITER_BOOT_ID, generation - CHANGE_LOG_KEEP)
+            if os.path.exists(expired_path):
+                os.remove(expired_path)
+        os.makedirs(os.path.dirname(os.path.abspath(CHROMA_GENERATION_FILE)), exist_ok=True)
+        temp_path = f"{CHROMA_GENERATION_FILE}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(f"{WRITER_BOOT_ID}:{generation}\n")
+        os.replace(temp_path, CHROMA_GENERATION_FILE)
+    except OSError as e:
+        logger.error(f"❌ Failed to publish collection generation: {e}")
+
+
+def read_published_generation():
+    try:
+        with open(CHROMA_GENERATION_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_collection_changes(applied, token):
+    """
+    The writer's change records after generation token `applied` up to
+    `token`, or None when they cannot be applied incrementally (a different
+    writer process, a generation bumped without a record such as a rebuild
+    switch, or records already pruned).
+    """
+    try:
+        applied_boot, applied_generation = applied.rsplit(':', 1)
+        boot, generation = token.rsplit(':', 1)
+        applied_generation, generation = int(applied_generation), int(generation)
+    except (AttributeError, ValueError):
+        return None
+    if boot != applied_boot or generation < applied_generation:
+        return None
+    changes = []
+    for number in range(applied_generation + 1, generation + 1):
+        try:
+            with open(change_log_path(boot, number)) as f:
+                changes.append(json.load(f))
+        except (OSError, ValueError):
+            return None
+    return changes
+
+
+def search_cache_key(spec, generation):
+    """
+    Canonical cache key for a search spec at a collection generation.
+    """
+    vector = spec['query_vector']
+    uses_text = vector is None or spec['mode'] == 'hybrid'
+    return json.dumps({
+        'generation': generation,
+        'mode': spec['mode'],
+        'fastPath': spec['fast_path'],
+        'query': normalize_embedding_text(spec['query']) if uses_text and spec['query'] else None,
+        'vector': hashlib.sha1(vector.tobytes()).hexdigest() if vector is not None else None,
+        'nResults': spec['n_results'],
+        'minSimilarity': spec['min_similarity'],
+        'whereFilter': spec['where_filter'],
+        'ef': spec['ef'],
+        'rerank': spec['rerank'],
+        'canonicalMap': CANONICAL_MAP.version if spec['collapse'] else None
+    }, sort_keys=True, separators=(',', ':'))
+
+
+def new_search_results():
+    return {
+        'entityIds': [],
+        'entityNames': [],
+        'similarities': [],
+        'metadata': []
+    }
+
+
+def append_search_result(valid_results, entity_id, similarity, metadata):
+    valid_results['entityIds'].append(entity_id)
+    valid_results['similarities'].append(float(similarity))
+    valid_results['metadata'].append(metadata)
+    valid_results['entityNames'].append(entity_name_from_metadata(entity_id, metadata))
+
+
+class CanonicalIdMap:
+    """
+    Alias -> canonical entity id map written by chroma_dedup.py. The file
+    is re-read when its modification time changes, checked at most every
+    check_interval seconds, so every process picks up a new map on its own.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.aliases = {}
+        self.names = {}
+        self.version = None
+        self._mtime = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self.aliases)
+
+    def refresh(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked < self.check_interval:
+                return
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            if mtime is None:
+                self.aliases, self.names, self.version, self._mtime = {}, {}, None, None
+                return
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Loading canonical-ID map {self.path} failed: {str(e)}")
+                return
+            self.names = {entity_id: cluster.get('name') for entity_id, cluster in data.get('canonical', {}).items()}
+            self.aliases = data.get('aliases', {})
+            self.version = data.get('version')
+            self._mtime = mtime
+            logger.info(f"✅ Canonical-ID map loaded: {len(self.aliases)} aliases of {len(self.names)} entities")
+
+    def collapse(self, results, n_results):
+        """
+        Keep the best-ranked result per canonical entity, reported under the
+        canonical id and name with the matched alias in metadata.matchedEntityId.
+        """
+        collapsed = new_search_results()
+        seen = set()
+        for entity_id, name, similarity, metadata in zip(
+            results['entityIds'], results['entityNames'], results['similarities'], results['metadata']
+        ):
+            canonical = self.aliases.get(entity_id, entity_id)
+            if canonical in seen:
+                METRICS.inc('chroma_server_search_results_collapsed_total')
+                continue
+            if len(seen) == n_results:
+                break
+            seen.add(canonical)
+            if canonical != entity_id:
+                name = self.names.get(canonical) or name
+                metadata = dict(metadata or {}, matchedEntityId=entity_id)
+            collapsed['entityIds'].append(canonical)
+            collapsed['entityNames'].append(name)
+            collapsed['similarities'].append(similarity)
+            collapsed['metadata'].append(metadata)
+        return collapsed
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'version': self.version,
+            'aliases': len(self.aliases),
+            'canonicalEntities': len(self.names),
+            'collapseEnabled': CANONICAL_COLLAPSE_ENABLED
+        }
+
+
+CANONICAL_MAP = CanonicalIdMap(CANONICAL_MAP_FILE, CANONICAL_MAP_CHECK_SECONDS)
+
+
+def result_limit(spec):
+    """
+    Results a search keeps before collapsing: collapsed searches keep
+    CANONICAL_CANDIDATE_FACTOR (times the widening) more, so nResults
+    usually remain afterwards.
+    """
+    return spec['n_results'] * CANONICAL_CANDIDATE_FACTOR * spec['widen'] if spec['collapse'] else spec['n_results']
+
+
+def collapse_search_results(results, spec):
+    return CANONICAL_MAP.collapse(results, spec['n_results']) if spec['collapse'] else results
+
+
+def collapse_is_short(results, spec):
+    return spec['collapse'] and len(results['entityIds']) < spec['n_results']
+
+
+def format_search_results(results, index, n_results, min_similarity):
+    """
+    Convert the index-th query of a collection.query() result into the
+    response shape returned by /search, keeping at most n_results entries
+    with similarity >= min_similarity.
+    """
+    valid_results = new_search_results()
+    if not results.get('ids') or not results['ids'][index]:
+        return valid_results
+
+    ids = results['ids'][index][:n_results]
+    distances = results['distances'][index][:n_results] if results.get('distances') else np.zeros(len(ids))
+    similarities = 1.0 - np.asarray(distances, dtype=np.float64)
+    keep = np.flatnonzero(similarities >= min_similarity)
+    if len(keep) < len(ids):
+        METRICS.inc('chroma_server_search_results_filtered_total', len(ids) - len(keep), mode='vector')
+    metadatas = results['metadatas'][index] if results.get('metadatas') else None
+    for i in keep:
+        append_search_result(valid_results, ids[i], similarities[i], metadatas[i] if metadatas else {})
+    return valid_results
+
+
+def metadata_boosts(metadatas, field, weight):
+    """
+    weight x log1p(metadata[field]) per candidate, scaled so the largest
+    value among the candidates gets the full weight. Missing, non-numeric
+    and non-positive values get no boost.
+    """
+    values = np.zeros(len(metadatas))
+    if not field or not weight:
+        return values
+    for i, metadata in enumerate(metadatas):
+        value = metadata.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+            values[i] = value
+    logs = np.log1p(values)
+    top = logs.max() if len(logs) else 0.0
+    return weight * logs / top if top > 0 else logs
+
+
+def maximal_marginal_relevance(relevance, vectors, k, mmr_lambda, space, groups=None):
+    """
+    Greedy MMR: repeatedly pick the candidate maximising
+    mmr_lambda * relevance - (1 - mmr_lambda) * (its highest similarity to
+    the candidates already picked). Similarity between candidates is
+    1 - distance in the collection's space, the same scale as relevance.
+    With groups (e.g. canonical ids), a pick rules out the rest of its
+    group. Returns row indices in pick order.
+    """
+    picked = []
+    available = np.ones(len(relevance), dtype=bool)
+    redundancy = np.zeros(len(relevance))
+    for _ in range(min(k, len(relevance))):
+        if not available.any():
+            break
+        scores = np.where(available, mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy, -np.inf)
+        row = int(np.argmax(scores))
+        similarity_to_row = 1.0 - vector_distances(vectors[row], vectors, space)
+        redundancy = similarity_to_row if not picked else np.maximum(redundancy, similarity_to_row)
+        picked.append(row)
+        available[row] = False
+        if groups is not None:
+            available &= groups != groups[row]
+    return picked
+
+
+def rerank_search_results(results, index, spec):
+    """
+    Re-rank the index-th query of a collection.query() result fetched with
+    embeddings: drop candidates below minSimilarity, add the metadata boost
+    to their similarity and pick nResults by maximal marginal relevance, so
+    near-duplicates of a better-ranked entity give way to different ones.
+    Similarities in the response stay vector similarities.
+    """
+    valid_results = new_search_results()
+    ids = results['ids'][index] if results.get('ids') else []
+    if not ids:
+        return valid_results
+
+    similarities = 1.0 - np.asarray(results['distances'][index], dtype=np.float64)
+    keep = np.flatnonzero(similarities >= spec['min_similarity'])
+    if len(keep) < len(ids):
+        METRICS.inc('chroma_server_search_results_filtered_total', len(ids) - len(keep), mode='rerank')
+    if not len(keep):
+        return valid_results
+
+    rerank = spec['rerank']
+    metadatas = [results['metadatas'][index][i] or {} for i in keep]
+    vectors = np.asarray(results['embeddings'][index], dtype=np.float32)[keep]
+    relevance = similarities[keep] + metadata_boosts(metadatas, rerank['boostField'], rerank['boostWeight'])
+    # Aliases of an entity already picked would be collapsed away, so let MMR pick other entities instead
+    groups = np.array([CANONICAL_MAP.aliases.get(ids[i], ids[i]) for i in keep], dtype=object) if spec['collapse'] else None
+    picked = maximal_marginal_relevance(relevance, vectors, result_limit(spec), rerank['mmrLambda'], collection_space(), groups)
+    for row in picked:
+        append_search_result(valid_results, ids[keep[row]], similarities[keep[row]], metadatas[row])
+    return valid_results
+
+
+def fuse_hybrid_results(results, index, lexical_hits, spec, query_vector):
+    """
+    Merge the vector ranking (index-th query of a collection.query() result)
+    with BM25 hits using reciprocal rank fusion.
+
+    Similarities are always vector similarities; entities found only
+    lexically have theirs computed from their stored embeddings. Lexical
+    matches are kept even below minSimilarity, since exact name hits are
+    what hybrid mode is for.
+    """
+    vector_ids = results['ids'][index] if results.get('ids') else []
+    distances = dict(zip(vector_ids, results['distances'][index])) if vector_ids else {}
+    metadatas = dict(zip(vector_ids, results['metadatas'][index])) if vector_ids else {}
+
+    fused = defaultdict(float)
+    for rank, entity_id in enumerate(vector_ids):
+        fused[entity_id] += 1.0 / (HYBRID_RRF_K + rank + 1)
+    lexical_ids = set()
+    for rank, (entity_id, _) in enumerate(lexical_hits):
+        fused[entity_id] += 1.0 / (HYBRID_RRF_K + rank + 1)
+        lexical_ids.add(entity_id)
+
+    ranked = sorted(fused, key=fused.get, reverse=True)
+    if not spec['collapse']:
+        # Collapsed searches keep every fused candidate, since aliases of one entity can fill any prefix
+        ranked = ranked[:result_limit(spec)]
+    missing = [entity_id for entity_id in ranked if entity_id not in distances]
+    if missing:
+        fetched = get_entities(missing, ['embeddings', 'metadatas'])
+        if fetched['ids']:
+            matrix = np.asarray(fetched['embeddings'], dtype=np.float32)
+            distances.update(zip(fetched['ids'], vector_distances(query_vector, matrix, collection_space())))
+            metadatas.update(zip(fetched['ids'], fetched['metadatas']))
+
+    valid_results = new_search_results()
+    for entity_id in ranked:
+        if entity_id not in distances:
+            continue
+        similarity = 1 - float(distances[entity_id])
+        if similarity >= spec['min_similarity'] or entity_id in lexical_ids:
+            append_search_result(valid_results, entity_id, similarity, metadatas.get(entity_id) or {})
+        else:
+            METRICS.inc('chroma_server_search_results_filtered_total', mode='hybrid')
+    return valid_results
+
+
+def search_candidate_count(spec):
+    """
+    Number of vector neighbours to fetch for a spec (hybrid mode over-fetches
+    for fusion, re-ranking for diversity and collapsing for the candidates
+    it merges; a per-request ef over-fetches for recall).
+    """
+    if spec['mode'] == 'hybrid':
+        count = spec['n_results'] * HYBRID_CANDIDATE_FACTOR
+    elif spec['rerank']:
+        count = spec['n_results'] * RERANK_CANDIDATE_FACTOR
+    else:
+        count = spec['n_results']
+    if spec['collapse']:
+        count *= CANONICAL_CANDIDATE_FACTOR * spec['widen']
+    # HNSW searches with a beam of max(search_ef, k), so asking for ef neighbours widens the search to ef
+    return max(count, spec['ef'] or 0)
+
+
+def parse_search_spec(data, query_vector=None):
+    """
+    Build a search spec from a /search body or /search/batch item.
+    Returns None when neither a query nor a query vector is present.
+    """
+    if query_vector is None:
+        query_vector = parse_query_vector(data)
+    if not data.get('query') and query_vector is None:
+        return None
+    mode = data.get('mode', 'vector')
+    if mode not in ('vector', 'hybrid'):
+        raise ValueError("mode must be 'vector' or 'hybrid'")
+    ef = data.get('ef')
+    if ef is not None:
+        ef = int(ef)
+        if ef < 1 or ef > MAX_SEARCH_EF:
+            raise ValueError(f"ef must be between 1 and {MAX_SEARCH_EF}")
+    rerank = None
+    if data.get('rerank'):
+        if mode == 'hybrid':
+            raise ValueError("rerank is only supported with mode 'vector'")
+        rerank = {
+            'mmrLambda': float(data.get('mmrLambda', RERANK_MMR_LAMBDA)),
+            'boostField': data.get('boostField', RERANK_BOOST_FIELD),
+            'boostWeight': float(data.get('boostWeight', RERANK_BOOST_WEIGHT))
+        }
+        if not 0.0 <= rerank['mmrLambda'] <= 1.0:
+            raise ValueError("mmrLambda must be between 0 and 1")
+    if CANONICAL_COLLAPSE_ENABLED:
+        CANONICAL_MAP.refresh()
+    return {
+        'query': data.get('query'),
+        'query_vector': query_vector,
+        'n_results': data.get('nResults', 10),
+        'min_similarity': data.get('minSimilarity', 0.5),
+        'where_filter': data.get('whereFilter'),
+        'mode': mode,
+        # Re-ranked searches need the vector candidates, so they skip the name fast path
+        'fast_path': bool(data.get('fastPath', True)) and NAME_INDEX is not None and rerank is None,
+        'ef': ef,
+        'rerank': rerank,
+        'collapse': CANONICAL_COLLAPSE_ENABLED and bool(data.get('collapseDuplicates', True)) and CANONICAL_MAP.active,
+        # Doubled while collapsing aliases leaves fewer than nResults (see widen_collapsed_search)
+        'widen': 1
+    }
+
+
+def lookup_cached_searches(specs):
+    """
+    Look search specs up in SEARCH_RESULT_CACHE at the current collection
+    generation. Returns (keys, results, pending) where results holds the
+    cached result or None per spec and pending lists the uncached indices.
+    """
+    generation = COLLECTION_GENERATION
+    keys = [search_cache_key(spec, generation) for spec in specs]
+    results = [SEARCH_RESULT_CACHE.get(key) for key in keys]
+    pending = [i for i, cached in enumerate(results) if cached is None]
+    return keys, results, pending
+
+
+def resolve_name_matches(specs, results, pending):
+    """
+    Answer pending text queries that exactly name (or prefix) an entity from
+    NAME_INDEX, without embedding. Returns the indices still pending.
+    """
+    if NAME_INDEX is None or not NAME_INDEX.ready:
+        return pending
+
+    remaining = []
+    for i in pending:
+        spec = specs[i]
+        if not (spec['fast_path'] and spec['query'] and spec['query_vector'] is None):
+            remaining.append(i)
+            continue
+        while True:
+            hits = NAME_INDEX.lookup(spec['query'], result_limit(spec), spec['where_filter'], spec['min_similarity'])
+            results[i] = new_search_results()
+            for entity_id, score, metadata in hits:
+                append_search_result(results[i], entity_id, score, metadata)
+            results[i] = collapse_search_results(results[i], spec)
+            # Names shared by many aliases can fill the window; look further until nResults entities remain
+            if not collapse_is_short(results[i], spec) or len(hits) < result_limit(spec):
+                break
+            spec = dict(spec, widen=spec['widen'] * 2)
+        if not hits:
+            results[i] = None
+            remaining.append(i)
+    return remaining
+
+
+def claim_pending_searches(keys, pending):
+    """
+    Register pending searches in SEARCH_FLIGHTS by cache key. Returns
+    (owned, joined): the indices this request computes, and a Future per
+    index already being computed by another request (or by an identical
+    spec earlier in the same batch).
+    """
+    if not SEARCH_COALESCING_ENABLED:
+        return pending, {}
+    owned, joined = SEARCH_FLIGHTS.claim([keys[i] for i in pending])
+    if joined:
+        METRICS.inc('chroma_server_search_coalesced_total', len(joined))
+    return [pending[position] for position in owned], {pending[position]: future for position, future in joined.items()}
+
+
+def release_searches(keys, owned, results, error=None):
+    """
+    Hand the results of owned searches (or the error that stopped them) to the requests waiting on them.
+    """
+    if not SEARCH_COALESCING_ENABLED:
+        return
+    for i in owned:
+        SEARCH_FLIGHTS.resolve(keys[i], results[i], error)
+
+
+def pending_search_texts(specs, pending):
+    """
+    Query texts of the pending specs that still need embedding, in pending order.
+    """
+    return [specs[i]['query'] for i in pending if specs[i]['query_vector'] is None]
+
+
+def score_search_results(query_results, position, spec, lexical_hits, query_vector):
+    """
+    Turn the position-th query of a collection.query() result into the
+    collapsed response shape: fused with lexical_hits (hybrid mode),
+    re-ranked or plainly formatted.
+    """
+    if lexical_hits is not None:
+        results = fuse_hybrid_results(query_results, position, lexical_hits, spec, query_vector)
+    elif spec['rerank']:
+        results = rerank_search_results(query_results, position, spec)
+    else:
+        results = format_search_results(query_results, position, result_limit(spec), spec['min_similarity'])
+    return collapse_search_results(results, spec)
+
+
+def candidates_exhausted(query_results, position, fetched, spec):
+    """
+    Whether a larger candidate window could not add results: the query
+    returned fewer than `fetched` neighbours, or (outside hybrid mode, which
+    keeps lexical matches regardless) the farthest one is already below
+    minSimilarity.
+    """
+    distances = query_results['distances'][position] if query_results.get('distances') else []
+    if len(distances) < fetched:
+        return True
+    return spec['mode'] != 'hybrid' and 1.0 - distances[-1] < spec['min_similarity']
+
+
+def widen_collapsed_search(spec, query_vector, results, exhausted):
+    """
+    Collapsing keeps one result per canonical entity, so a candidate window
+    full of aliases can leave fewer than nResults. Re-run the search with a
+    doubled window until nResults canonical entities remain or the
+    candidates run out.
+    """
+    while collapse_is_short(results, spec) and not exhausted:
+        spec = dict(spec, widen=spec['widen'] * 2)
+        fetched = search_candidate_count(spec)
+        query_results = query_vectors(
+            np.asarray([query_vector]), fetched, spec['where_filter'], include_embeddings=bool(spec['rerank'])
+        )
+        lexical_hits = None
+        if spec['mode'] == 'hybrid' and spec['query'] and LEXICAL_INDEX is not None and LEXICAL_INDEX.ready:
+            lexical_hits = LEXICAL_INDEX.search(spec['query'], fetched, spec['where_filter'])
+        results = score_search_results(query_results, 0, spec, lexical_hits, query_vector)
+        exhausted = candidates_exhausted(query_results, 0, fetched, spec)
+        METRICS.inc('chroma_server_search_collapse_widened_total')
+    return results
+
+
+def execute_searches(specs, results, pending, keys, text_embeddings):
+    """
+    Query the collection for the pending specs, filling results in place
+    and caching them. text_embeddings holds the vectors for
+    pending_search_texts(specs, pending). Returns the number of
+    collection.query calls issued.
+    """
+    query_embs = np.zeros((len(specs), EMBEDDING_TARGET_DIM), dtype=np.float32)
+    text_indices = [i for i in pending if specs[i]['query_vector'] is None]
+    if text_indices:
+        query_embs[text_indices] = text_embeddings
+    for i in pending:
+        if specs[i]['query_vector'] is not None:
+            query_embs[i] = specs[i]['query_vector']
+
+    # Hybrid specs run their BM25 lookup concurrently with the vector queries
+    lexical_futures = {}
+    if LEXICAL_INDEX is not None and LEXICAL_INDEX.ready:
+        for i in pending:
+            if specs[i]['mode'] == 'hybrid' and specs[i]['query']:
+                lexical_futures[i] = SEARCH_EXECUTOR.submit(
+                    LEXICAL_INDEX.search, specs[i]['query'], search_candidate_count(specs[i]), specs[i]['where_filter']
+                )
+
+    # Chroma accepts a single where clause per query call, so group by filter
+    groups = {}
+    for i in pending:
+        groups.setdefault(json.dumps(specs[i]['where_filter'], sort_keys=True), []).append(i)
+
+    for indices in groups.values():
+        query_results = query_vectors(
+            query_embs[indices],  # Use pre-computed embeddings instead of query_texts
+            max(search_candidate_count(specs[i]) for i in indices),
+            specs[indices[0]]['where_filter'],
+            include_embeddings=any(specs[i]['rerank'] for i in indices)
+        )
+        fetched = max(search_candidate_count(specs[i]) for i in indices)
+        for position, i in enumerate(indices):
+            lexical_hits = lexical_futures[i].result() if i in lexical_futures else None
+            results[i] = score_search_results(query_results, position, specs[i], lexical_hits, query_embs[i])
+            if collapse_is_short(results[i], specs[i]):
+                results[i] = widen_collapsed_search(
+                    specs[i], query_embs[i], results[i], candidates_exhausted(query_results, position, fetched, specs[i])
+                )
+            SEARCH_RESULT_CACHE.put(keys[i], results[i])
+
+    return len(groups)
+
+
+def run_searches(specs):
+    """
+    Resolve search specs, serving repeats from SEARCH_RESULT_CACHE and
+    literal entity names from NAME_INDEX.
+
+    Remaining queries are embedded together and each distinct whereFilter is
+    resolved with a single collection.query call; queries identical to one
+    already in flight wait for its result instead. Returns the results in
+    spec order and the number of collection queries issued.
+    """
+    keys, results, pending = lookup_cached_searches(specs)
+    pending = resolve_name_matches(specs, results, pending)
+    if not pending:
+        return results, 0
+
+    owned, joined = claim_pending_searches(keys, pending)
+    query_calls = 0
+    error = None
+    try:
+        if owned:
+            text_embeddings = get_embeddings(pending_search_texts(specs, owned))
+            query_calls = execute_searches(specs, results, owned, keys, text_embeddings)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        release_searches(keys, owned, results, error)
+    for i, future in joined.items():
+        results[i] = future.result()
+    return results, query_calls
+
+@app.route('/search', methods=['POST'])
+def search():
+    """
+    Vector search for similar entities. The query vector is either computed
+    from `query` or supplied precomputed as `queryEmbedding` (JSON list),
+    `queryEmbeddingB64` (base64 little-endian float32), or as a raw
+    application/octet-stream body with parameters in the query string.
+    `mode: hybrid` fuses the vector ranking with BM25 name/document matches.
+    Queries that exactly name (or prefix) known entities are answered from
+    the in-memory name index unless `fastPath` is false. `ef` widens the
+    HNSW search beyond the collection's search_ef for higher recall.
+    `rerank: true` over-fetches candidates and re-ranks them by maximal
+    marginal relevance with a metadata boost (`mmrLambda`, `boostField`,
+    `boostWeight`), so near-duplicate entities give way to distinct ones.
+    Aliases in the canonical-ID map are collapsed into their canonical
+    entity unless `collapseDuplicates` is false.
+    """
+    try:
+        try:
+            if request.mimetype == 'application/octet-stream':
+                data = search_params_from_args(request.args)
+                decoded = decode_vectors(request.get_data(), request.args.get('dim'))
+                if decoded.shape[0] != 1:
+                    return jsonify({'error': 'Expected exactly one query vector'}), 400
+                query_vector = decoded[0]
+            else:
+                data = request.get_json()
+                query_vector = None
+            spec = parse_search_spec(data, query_vector)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if spec is None:
+            return jsonify({'error': 'Query is required'}), 400
+
+        query = spec['query']
+        valid_results = run_searches([spec])[0][0]
+
+        logger.info(f"🔍 Found {len(valid_results['entityIds'])} similar entities for query: {query}")
+        return jsonify(valid_results), 200
+
+    except Exception as e:
+        logger.error(f"❌ Search failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Run several searches in one request. Queries are embedded together and
+    each distinct whereFilter is resolved with a single collection.query call.
+    Results are returned in request order, each in the /search response shape.
+    """
+    try:
+        data = request.get_json()
+        queries = data.get('queries') if data else None
+
+        if not queries or not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a non-empty list'}), 400
+
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries are allowed per batch'}), 400
+
+        specs = []
+        for i, item in enumerate(queries):
+            try:
+                spec = parse_search_spec(item) if isinstance(item, dict) else None
+            except ValueError as e:
+                return jsonify({'error': f'{str(e)} (queries[{i}])'}), 400
+            if spec is None:
+                return jsonify({'error': f'Query is required (queries[{i}])'}), 400
+            specs.append(spec)
+
+        batch_results, query_calls = run_searches(specs)
+
+        logger.info(f"🔍 Batch search resolved {len(specs)} queries with {query_calls} collection queries")
+        return jsonify({'results': batch_results, 'count': len(batch_results)}), 200
+
+    except Exception as e:
+        logger.error(f"❌ Batch search failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def parse_embed_request(data, prefers_binary=False):
+    """
+    Validate an /embed request body. Returns (texts, output_format);
+    raises ValueError with a client-facing message when it is invalid.
+    """
+    texts = data.get('texts') if data else None
+    if texts is None and data and data.get('text'):
+        texts = [data['text']]
+
+    if not texts or not isinstance(texts, list) or not all(isinstance(text, str) and text for text in texts):
+        raise ValueError('texts must be a non-empty list of strings')
+
+    if len(texts) > MAX_BATCH_QUERIES:
+        raise ValueError(f'At most {MAX_BATCH_QUERIES} texts are allowed per request')
+
+    output_format = data.get('format') or ('binary' if prefers_binary else 'json')
+    if output_format not in ('json', 'base64', 'binary'):
+        raise ValueError('format must be one of json, base64, binary')
+
+    return texts, output_format
+
+
+def vector_headers(matrix):
+    """
+    Response headers describing a raw float32 vector body.
+    """
+    return {
+        'X-Vector-Count': str(matrix.shape[0]),
+        'X-Vector-Dim': str(matrix.shape[1]),
+        'X-Vector-Dtype': 'float32-le'
+    }
+
+
+def embed_response_payload(matrix, output_format):
+    """
+    JSON payload for the json and base64 /embed formats.
+    """
+    payload = {
+        'count': matrix.shape[0],
+        'dim': matrix.shape[1],
+        'dtype': 'float32'
+    }
+    if output_format == 'base64':
+        payload['embeddingsB64'] = encode_vectors_b64(matrix)
+    else:
+        payload['embeddings'] = matrix.tolist()
+    return payload
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    """
+    Embed texts and return float32 vectors of EMBEDDING_TARGET_DIM dimensions.
+
+    `format` selects the encoding: `json` (nested lists, default), `base64`
+    (little-endian float32 bytes, row-major) or `binary` (the same bytes as an
+    application/octet-stream body). `Accept: application/octet-stream` also
+    selects `binary`.
+    """
+    try:
+        best = request.accept_mimetypes.best_match(['application/json', 'application/octet-stream'])
+        try:
+            texts, output_format = parse_embed_request(request.get_json(), best == 'application/octet-stream')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        matrix = get_embeddings(texts)
+
+        if output_format == 'binary':
+            return Response(
+                np.ascontiguousarray(matrix, dtype=VECTOR_DTYPE).tobytes(),
+                mimetype='application/octet-stream',
+                headers=vector_headers(matrix)
+            )
+        return jsonify(embed_response_payload(matrix, output_format)), 200
+
+    except Exception as e:
+        logger.error(f"❌ Embed failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def upsert_changed_entities(ids, texts, metadatas):
+    """
+    Upsert entities, embedding only those that are new or whose text changed
+    (by content hash). Entities with the same text but different metadata
+    keep their stored embedding; identical entities are skipped. Returns
+    counts of inserted, updated, metadataUpdated and skipped entities.
+    """
+    latest = {entity_id: position for position, entity_id in enumerate(ids)}
+    positions = sorted(latest.values())
+    metadatas = with_content_hashes(texts, metadatas)
+    existing = collection.get(ids=[ids[i] for i in positions], include=['metadatas'])
+    stored = dict(zip(existing['ids'], existing['metadatas']))
+
+    counts = {'inserted': 0, 'updated': 0, 'metadataUpdated': 0, 'skipped': len(ids) - len(positions)}
+    changed_text, changed_metadata = [], []
+    for i in positions:
+        current = stored.get(ids[i])
+        if current is None:
+            counts['inserted'] += 1
+            changed_text.append(i)
+        elif current.get(CONTENT_HASH_KEY) != metadatas[i][CONTENT_HASH_KEY]:
+            counts['updated'] += 1
+            changed_text.append(i)
+        elif current != metadatas[i]:
+            counts['metadataUpdated'] += 1
+            changed_metadata.append(i)
+        else:
+            counts['skipped'] += 1
+
+    if changed_text:
+        write_entities(
+            ids=[ids[i] for i in changed_text],
+            embeddings=embed_documents([texts[i] for i in changed_text]),
+            documents=[texts[i] for i in changed_text],
+            metadatas=[metadatas[i] for i in changed_text]
+        )
+    if changed_metadata:
+        fetched = collection.get(ids=[ids[i] for i in changed_metadata], include=['embeddings'])
+        embeddings = dict(zip(fetched['ids'], fetched['embeddings']))
+        write_entities(
+            ids=[ids[i] for i in changed_metadata],
+            embeddings=fit_embedding_matrix([embeddings[ids[i]] for i in changed_metadata]),
+            documents=[texts[i] for i in changed_metadata],
+            metadatas=[metadatas[i] for i in changed_metadata]
+        )
+    return counts
+
+@app.route('/add', methods=['POST'])
+def add_entities():
+    """
+    Add entities. With "mode": "upsert", entities that already exist are
+    updated instead of rejected, and only new or changed texts are embedded
+    (with the server's embedding backend); the response reports inserted,
+    updated, metadataUpdated and skipped counts.
+    """
+    try:
+        data = request.get_json()
+        entity_ids = data.get('entityIds', [])
+        entity_texts = data.get('entityTexts', [])
+        metadata = data.get('metadata', [])
+
+        if not entity_ids or not entity_texts:
+            return jsonify({'error': 'Entity IDs and texts are required'}), 400
+
+        if len(entity_ids) != len(entity_texts) or len(entity_ids) != len(metadata):
+            return jsonify({'error': 'All arrays must have the same length'}), 400
+
+        mode = data.get('mode', 'add')
+        if mode not in ('add', 'upsert'):
+            return jsonify({'error': "mode must be 'add' or 'upsert'"}), 400
+
+        if mode == 'upsert':
+            counts = upsert_changed_entities(entity_ids, entity_texts, metadata)
+            logger.info(f"✅ Upserted {len(entity_ids)} entities: {counts['inserted']} inserted, "
+                        f"{counts['updated']} re-embedded, {counts['skipped']} unchanged")
+            return jsonify({'success': True, 'count': len(entity_ids), **counts}), 200
+
+        # Add entities to collection, through the same embedding and write path as upsert mode
+        write_entities(
+            ids=entity_ids,
+            embeddings=embed_documents(entity_texts),
+            documents=entity_texts,
+            metadatas=metadata,
+            operation='add'
+        )
+
+        logger.info(f"✅ Added {len(entity_ids)} entities to ChromaDB collection")
+        return jsonify({'success': True, 'count': len(entity_ids)}), 200
+
+    except Exception as e:
+        logger.error(f"❌ Add entities failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/add/stream', methods=['POST'])
+def add_entities_stream():
+    """
+    Bulk ingest entities from an NDJSON request body (one
+    {"entityId", "entityText", "metadata"} object per line).
+
+    Entities are embedded and upserted in chunks while the body is read, so
+    memory stays bounded by the chunk size. The response is NDJSON: one
+    progress event per chunk followed by a summary. Pass ?skip=<resumeFrom>
+    with the same body to resume an interrupted upload.
+    """
+    try:
+        chunk_size = int(request.args.get('chunkSize', INGEST_CHUNK_SIZE))
+        skip = int(request.args.get('skip', 0))
+    except ValueError:
+        return jsonify({'error': 'chunkSize and skip must be integers'}), 400
+
+    if chunk_size <= 0 or skip < 0:
+        return jsonify({'error': 'chunkSize must be positive and skip must not be negative'}), 400
+
+    def generate():
+        try:
+            for event in ingest_ndjson(request.stream, chunk_size, skip):
+                yield json.dumps(event) + '\n'
+        except Exception as e:
+            logger.error(f"❌ Streamed ingest failed: {str(e)}")
+            METRICS.inc('chroma_server_request_errors_total', route='/add/stream', status='stream')
+            yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 503 until the startup warm-up has finished.
+    """
+    return jsonify({
+        'status': 'ready' if WARMUP_STATE['ready'] else 'warming_up',
+        **WARMUP_STATE
+    }), 200 if WARMUP_STATE['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus text exposition of request, embedding and query metrics.
+    """
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/sync', methods=['POST'])
+def sync_from_arango():
+    """
+    Incrementally sync ArangoDB Entity documents into the collection.
+    Pass {"full": true} to ignore the high-water mark and rescan everything.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        totals = run_entity_sync(full=bool(data.get('full', False)))
+        if totals is None:
+            return jsonify({'error': 'A sync is already running'}), 409
+        return jsonify(totals), 200
+    except Exception as e:
+        logger.error(f"❌ Entity sync failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sync/status', methods=['GET'])
+def sync_status():
+    try:
+        state = EntitySyncState(SYNC_STATE_PATH)
+        try:
+            return jsonify({
+                'running': ENTITY_SYNC_LOCK.locked(),
+                'source': SYNC_SOURCE,
+                'updatedField': SYNC_UPDATED_FIELD or None,
+                'intervalSeconds': SYNC_INTERVAL_SECONDS,
+                'watermark': state.get_meta('watermark'),
+                'lastRun': state.get_meta('lastRun')
+            }), 200
+        finally:
+            state.close()
+    except Exception as e:
+        logger.error(f"❌ Sync status failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    try:
+        count = collection.count()
+        return jsonify({
+            'count': count,
+            'name': COLLECTION_NAME,
+            'collection': collection.name,
+            'embeddingCache': EMBEDDING_CACHE.stats() if EMBEDDING_CACHE is not None else None,
+            'embeddingBackend': EMBEDDING_BACKEND.stats(),
+            'searchCache': dict(SEARCH_RESULT_CACHE.stats(), generation=COLLECTION_GENERATION),
+            'searchCoalescing': dict(SEARCH_FLIGHTS.stats(), enabled=SEARCH_COALESCING_ENABLED),
+            'lexicalIndex': LEXICAL_INDEX.stats() if LEXICAL_INDEX is not None else None,
+            'nameIndex': NAME_INDEX.stats() if NAME_INDEX is not None else None,
+            'quantizedIndex': QUANTIZED_INDEX.stats() if QUANTIZED_INDEX is not None else None,
+            'partitioning': collection.stats() if isinstance(collection, PartitionedCollection) else None,
+            'hnsw': {key: value for key, value in (collection.metadata or {}).items() if key.startswith('hnsw:')},
+            'canonicalMap': CANONICAL_MAP.stats(),
+            'process': {'role': CHROMA_SERVER_ROLE or 'standalone', 'pid': os.getpid(),
+                        'overlayEntities': len(COLLECTION_DELTAS), **REOPEN_STATS}
+        }), 200
+    except Exception as e:
+        logger.error(f"❌ Get stats failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/embedding-info', methods=['GET'])
+def get_embedding_info():
+    """
+    Get information about the current embedding function configuration.
+    This endpoint helps debug embedding function issues.
+    """
+    try:
+        return jsonify({
+            'EMBEDDING_FUNCTION': EMBEDDING_FUNCTION,
+            'embedding_function_configured': EMBEDDING_FUNCTION is not None,
+            'collection_name': COLLECTION_NAME,
+            'embedding_backend': EMBEDDING_BACKEND.name,
+            'embedding_model': EMBEDDING_BACKEND.model,
+            'ollama_url': OLLAMA_URL if EMBEDDING_FUNCTION == 'ollama' else None,
+            'ollama_model': OLLAMA_MODEL if EMBEDDING_FUNCTION == 'ollama' else None,
+            'data_path': CHROMA_DATA_PATH,
+            'note': 'Existing collections use their original embedding function. To change embedding function, create a new collection or delete existing one.'
+        }), 200
+    except Exception as e:
+        logger.error(f"❌ Get embedding info failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/collection/details', methods=['GET'])
+def get_collection_details():
+    """
+    Get details of the current collection, including embedding function and document count.
+    """
+    try:
+        collection_info = {
+            'name': collection.name,
+            'document_count': collection.count(),
+            'embedding_function': str(collection.embedding_function) if collection.embedding_function else 'None (using default)',
+            'note': 'Existing collections use their original embedding function. To change embedding function, create a new collection or delete existing one.'
+        }
+        return jsonify(collection_info), 200
+    except Exception as e:
+        logger.error(f"❌ Get collection details failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/collection/recreate', methods=['POST'])
+def recreate_collection():
+    """
+    Recreate the collection with the correct embedding function and dimensions.
+    This endpoint deletes the existing collection and creates a new one.
+    """
+    try:
+        global collection
+
+        if REBUILD_LOCK.locked():
+            return jsonify({'error': 'A collection rebuild is running'}), 409
+
+        if isinstance(collection, PartitionedCollection):
+            collection.drop()
+            logger.info(f"✅ Deleted partitions of collection: {COLLECTION_NAME}")
+
+        # Delete the existing collection if it exists (and the un-aliased one a rebuild switched away from)
+        for name in dict.fromkeys([serving_collection_name(), COLLECTION_NAME]):
+            try:
+                existing_collection = client.get_collection(name=name)
+                client.delete_collection(name=name)
+                logger.info(f"✅ Deleted existing collection: {name}")
+            except Exception:
+                logger.info(f"📝 Collection {name} doesn't exist, creating new one")
+        if os.path.exists(COLLECTION_ALIAS_FILE):
+            os.remove(COLLECTION_ALIAS_FILE)
+        
+        # Create a new collection with the correct embedding function
+        collection = client.create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=EMBEDDING_FUNCTION,
+            metadata=hnsw_collection_metadata()
+        )
+        logger.info(f"✅ Created new collection: {COLLECTION_NAME} with embedding function: {EMBEDDING_FUNCTION}")
+        collection = open_serving_collection(collection)
+        reset_entity_indexes()
+        bump_collection_generation()
+        
+        return jsonify({'success': True, 'message': 'Collection recreated successfully'}), 200
+    except Exception as e:
+        logger.error(f"❌ Recreate collection failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/collection/rebuild', methods=['POST'])
+def rebuild_collection_route():
+    """
+    Rebuild the collection blue/green in the background and switch to it
+    once validated; searches keep using the current collection meanwhile.
+    {"source": "collection"} (default) copies the stored vectors, "arango"
+    or a JSONL dump path re-embeds entities from that source.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        source = data.get('source', 'collection')
+        if not start_collection_rebuild(source):
+            return jsonify({'error': 'A collection rebuild is already running'}), 409
+        return jsonify({'started': True, 'source': source}), 202
+    except Exception as e:
+        logger.error(f"❌ Collection rebuild failed to start: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/collection/rebuild/status', methods=['GET'])
+def rebuild_collection_status():
+    try:
+        return jsonify(dict(REBUILD_STATE, alias=read_collection_alias() or None)), 200
+    except Exception as e:
+        logger.error(f"❌ Rebuild status failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/test-embedding', methods=['POST'])
+def test_embedding():
+    """
+    Test the embedding function with a sample text to check dimensions.
+    """
+    try:
+        data = request.get_json()
+        test_text = data.get('text', 'This is a test sentence')
+        
+        # Get embedding using our function
+        embedding = get_embedding(test_text)
+        
+        return jsonify({
+            'text': test_text,
+            'embedding_dimension': len(embedding),
+            'embedding_sample': embedding[:5].tolist(),  # First 5 values
+            'model_used': EMBEDDING_BACKEND.model,
+            'backend': EMBEDDING_BACKEND.name
+        }), 200
+    except Exception as e:
+        logger.error(f"❌ Test embedding failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+SERVER_LOCK = None
+
+
+def acquire_server_lock(exclusive=False):
+    """
+    Lock CHROMA_SERVER_LOCK_FILE, shared for a serving process (a writer and
+    its readers hold it together) or exclusive for an offline writer.
+    Returns the open lock file, or None when a conflicting holder has it.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(CHROMA_SERVER_LOCK_FILE)), exist_ok=True)
+    lock_file = open(CHROMA_SERVER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_server_tasks():
+    """
+    Start the background work of a serving process: the server lock,
+    warm-up, the writer's generation file, retiring a switched-out
+    collection and the sync schedule. Only server entry points call this, so
+    the offline tools that import this module never scan the collection or
+    run threads.
+    """
+    global SERVER_LOCK
+    SERVER_LOCK = acquire_server_lock()
+    if SERVER_LOCK is None:
+        logger.warning(f"⚠️ An offline tool holds {CHROMA_SERVER_LOCK_FILE}; its writes bypass this server's indexes")
+    start_warm_up()
+    if CHROMA_SERVER_ROLE == 'writer':
+        reset_change_log()
+        publish_generation(COLLECTION_GENERATION)
+    if CHROMA_SERVER_ROLE != 'reader' and read_collection_alias().get('previous'):
+        # A rebuild switched collections before the last shutdown; finish retiring the old one
+        schedule_collection_retirement(read_collection_alias()['previous'], read_collection_alias().get('retireAt', 0) - time.time())
+    if SYNC_INTERVAL_SECONDS > 0 and CHROMA_SERVER_ROLE != 'reader':
+        start_entity_sync_schedule()
 
 if __name__ == '__main__':
+    start_server_tasks()
     port = int(os.getenv('CHROMA_SERVER_PORT', 5002))
     host = os.getenv('CHROMA_SERVER_HOST', '0.0.0.0')
     app.run(host=host, port=port)
@@ -0,0 +1,444 @@
+"""
+Asyncio serving mode for chroma_server.py (aiohttp).
+
+Serves the same routes from a single event loop. Query embeddings are
+fetched from Ollama with a non-blocking client, Chroma calls run on a
+bounded thread pool, and ASYNC_MAX_IN_FLIGHT caps how many requests are
+processed at once. Routes without a native async handler are dispatched
+to the Flask app in chroma_server.py on a worker thread, so behaviour
+stays identical between the two modes.
+
+Run with: python chroma_server_async.py
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+import chroma_server as core
+
+logger = logging.getLogger(__name__)
+
+# Requests processed concurrently; further requests wait for a free slot
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 256))
+# Threads running blocking Chroma calls
+ASYNC_CHROMA_WORKERS = int(os.getenv('ASYNC_CHROMA_WORKERS', 8))
+
+CHROMA_EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_CHROMA_WORKERS, thread_name_prefix='chroma')
+
+
+class AsyncOllamaTransport:
+    """
+    Non-blocking transport for the core OllamaEmbeddingClient, sharing one
+    keep-alive connection pool. Endpoint rotation, the hedge policy, the
+    /api/embed fallback, response parsing and the request counters all
+    belong to the core client, so both serving modes behave and report
+    alike; only the HTTP calls and the hedging wait are asyncio here.
+    """
+
+    def __init__(self, client, pool_size):
+        self.client = client
+        self.pool_size = pool_size
+        self.session = None
+
+    async def start(self):
+        self.session = ClientSession(
+            connector=TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+            timeout=ClientTimeout(sock_connect=self.client.timeout[0], sock_read=self.client.timeout[1])
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def embed(self, texts):
+        """
+        Return raw model embeddings for texts, hedging slow requests. The
+        slower of two hedged requests is left to finish so its latency
+        still counts towards the hedge delay.
+        """
+        hedge = self.client.hedge
+        primary_url, backup_url = self.client.endpoint_pair()
+        delay = hedge.delay()
+        if delay is None:
+            hedge.count()
+            return await self._post_timed(texts, primary_url)
+
+        primary = asyncio.ensure_future(self._post_timed(texts, primary_url))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done and (primary.exception() is None or len(self.client.base_urls) == 1):
+            hedge.count()
+            return primary.result()
+
+        backup = asyncio.ensure_future(self._post_timed(texts, backup_url))
+        pending, error = {primary, backup}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    hedge.count(hedged=True, hedge_won=task is backup)
+                    for other in pending:
+                        other.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    return task.result()
+                error = task.exception()
+        hedge.count(hedged=True)
+        raise error
+
+    async def _post_timed(self, texts, base_url):
+        started = time.perf_counter()
+        self.client.endpoint_requests[base_url] += 1
+        try:
+            embeddings = await self._post_embed(texts, base_url)
+        except Exception:
+            self.client.endpoint_errors[base_url] += 1
+            raise
+        self.client.hedge.record(time.perf_counter() - started)
+        return embeddings
+
+    async def _post_embed(self, texts, base_url):
+        client = self.client
+        if client.supports_batch(base_url):
+            async with self.session.post(
+                f"{base_url}/api/embed", json=core.ollama_request_body(client.model, input=list(texts))
+            ) as res:
+                client.requests_sent += 1
+                body = await res.text()
+                if not client.batch_endpoint_missing(base_url, res.status, body):
+                    res.raise_for_status()
+                    return client.batch_embeddings(json.loads(body), texts)
+
+        return await asyncio.gather(*(self._embed_one(text, base_url) for text in texts))
+
+    async def _embed_one(self, text, base_url):
+        async with self.session.post(
+            f"{base_url}/api/embeddings", json=core.ollama_request_body(self.client.model, prompt=text)
+        ) as res:
+            self.client.requests_sent += 1
+            res.raise_for_status()
+            result = await res.json()
+        return self.client.single_embedding(result)
+
+    def stats(self):
+        return {
+            'poolSize': self.pool_size,
+            'open': self.session is not None and not self.session.closed
+        }
+
+
+EMBEDDING_CLIENT = AsyncOllamaTransport(core.EMBEDDING_BACKEND, pool_size=core.OLLAMA_POOL_SIZE)
+
+IN_FLIGHT = {'current': 0, 'peak': 0, 'waiting': 0}
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(CHROMA_EXECUTOR, func, *args)
+
+
+async def fetch_embeddings(texts):
+    with core.METRICS.timer('chroma_server_embedding_seconds', backend='ollama', kind='query'):
+        return core.fit_embedding_matrix(await EMBEDDING_CLIENT.embed(texts))
+
+
+async def get_embeddings(texts):
+    """
+    Async counterpart of core.get_embeddings sharing its EMBEDDING_CACHE.
+    In-process backends are called directly on CHROMA_EXECUTOR.
+    """
+    if core.EMBEDDING_BACKEND.name != 'ollama':
+        return await run_blocking(core.get_embeddings, texts)
+    if not texts:
+        return core.fit_embedding_matrix([])
+    if core.EMBEDDING_CACHE is None:
+        return await fetch_embeddings(texts)
+
+    cached = await run_blocking(core.EMBEDDING_CACHE.get_many, texts)
+    missing = list(dict.fromkeys(text for text in texts if text not in cached))
+    if missing:
+        matrix = await fetch_embeddings(missing)
+        fetched = dict(zip(missing, (row.copy() for row in matrix)))
+        await run_blocking(core.EMBEDDING_CACHE.put_many, fetched)
+        cached.update(fetched)
+
+    return np.vstack([cached[text] for text in texts])
+
+
+async def run_searches(specs):
+    """
+    Async counterpart of core.run_searches: embeds without blocking the loop
+    and runs the collection queries on CHROMA_EXECUTOR.
+    """
+    keys, results, pending = core.lookup_cached_searches(specs)
+    pending = core.resolve_name_matches(specs, results, pending)
+    if not pending:
+        return results, 0
+
+    owned, joined = core.claim_pending_searches(keys, pending)
+    query_calls = 0
+    if owned:
+        # Shielded: other requests may be waiting on these searches even if this client disconnects
+        query_calls = await asyncio.shield(execute_owned_searches(specs, results, owned, keys))
+    for i, future in joined.items():
+        results[i] = await asyncio.wrap_future(future)
+    return results, query_calls
+
+
+async def execute_owned_searches(specs, results, owned, keys):
+    error = None
+    try:
+        text_embeddings = await get_embeddings(core.pending_search_texts(specs, owned))
+        return await run_blocking(core.execute_searches, specs, results, owned, keys, text_embeddings)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        core.release_searches(keys, owned, results, error)
+
+
+@web.middleware
+async def limit_in_flight(request, handler):
+    IN_FLIGHT['waiting'] += 1
+    async with request.app['in_flight']:
+        IN_FLIGHT['waiting'] -= 1
+        IN_FLIGHT['current'] += 1
+        IN_FLIGHT['peak'] = max(IN_FLIGHT['peak'], IN_FLIGHT['current'])
+        try:
+            return await handler(request)
+        finally:
+            IN_FLIGHT['current'] -= 1
+
+
+@web.middleware
+async def record_request_metrics(request, handler):
+    """
+    Record latency and error statuses for native handlers into core.METRICS;
+    routes served by flask_fallback are recorded by the Flask app itself.
+    """
+    route = request.match_info.route
+    if route.handler is flask_fallback:
+        return await handler(request)
+
+    route_name = route.resource.canonical if route.resource is not None else 'unmatched'
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        core.METRICS.observe('chroma_server_request_seconds', time.perf_counter() - start, route=route_name)
+        if status >= 400:
+            core.METRICS.inc('chroma_server_request_errors_total', route=route_name, status=str(status))
+
+
+async def search(request):
+    try:
+        try:
+            if request.content_type == 'application/octet-stream':
+                data = core.search_params_from_args(request.query)
+                decoded = core.decode_vectors(await request.read(), request.query.get('dim'))
+                if decoded.shape[0] != 1:
+                    return web.json_response({'error': 'Expected exactly one query vector'}, status=400)
+                query_vector = decoded[0]
+            else:
+                data = await request.json()
+                query_vector = None
+            spec = core.parse_search_spec(data, query_vector)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+
+        if spec is None:
+            return web.json_response({'error': 'Query is required'}, status=400)
+
+        valid_results = (await run_searches([spec]))[0][0]
+
+        logger.info(f"🔍 Found {len(valid_results['entityIds'])} similar entities for query: {spec['query']}")
+        return web.json_response(valid_results)
+
+    except Exception as e:
+        logger.error(f"❌ Search failed: {str(e)}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def search_batch(request):
+    try:
+        data = await request.json()
+        queries = data.get('queries') if data else None
+
+        if not queries or not isinstance(queries, list):
+            return web.json_response({'error': 'queries must be a non-empty list'}, status=400)
+
+        if len(queries) > core.MAX_BATCH_QUERIES:
+            return web.json_response({'error': f'At most {core.MAX_BATCH_QUERIES} queries are allowed per batch'}, status=400)
+
+        specs = []
+        for i, item in enumerate(queries):
+            try:
+                spec = core.parse_search_spec(item) if isinstance(item, dict) else None
+            except ValueError as e:
+                return web.json_response({'error': f'{str(e)} (queries[{i}])'}, status=400)
+            if spec is None:
+                return web.json_response({'error': f'Query is required (queries[{i}])'}, status=400)
+            specs.append(spec)
+
+        batch_results, query_calls = await run_searches(specs)
+
+        logger.info(f"🔍 Batch search resolved {len(specs)} queries with {query_calls} collection queries")
+        return web.json_response({'results': batch_results, 'count': len(batch_results)})
+
+    except Exception as e:
+        logger.error(f"❌ Batch search failed: {str(e)}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def embed(request):
+    try:
+        prefers_binary = 'application/octet-stream' in request.headers.get('Accept', '')
+        try:
+            texts, output_format = core.parse_embed_request(await request.json(), prefers_binary)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+
+        matrix = await get_embeddings(texts)
+
+        if output_format == 'binary':
+            return web.Response(
+                body=np.ascontiguousarray(matrix, dtype=core.VECTOR_DTYPE).tobytes(),
+                content_type='application/octet-stream',
+                headers=core.vector_headers(matrix)
+            )
+        return web.json_response(core.embed_response_payload(matrix, output_format))
+
+    except Exception as e:
+        logger.error(f"❌ Embed failed: {str(e)}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def add_entities_stream(request):
+    """
+    Streaming NDJSON ingest. core.ingest_ndjson runs on a worker thread and
+    pulls request lines from the event loop, so the upload is only read as
+    fast as chunks are written.
+    """
+    try:
+        chunk_size = int(request.query.get('chunkSize', core.INGEST_CHUNK_SIZE))
+        skip = int(request.query.get('skip', 0))
+    except ValueError:
+        return web.json_response({'error': 'chunkSize and skip must be integers'}, status=400)
+
+    if chunk_size <= 0 or skip < 0:
+        return web.json_response({'error': 'chunkSize must be positive and skip must not be negative'}, status=400)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def request_lines():
+        while True:
+            line = asyncio.run_coroutine_threadsafe(request.content.readline(), loop).result()
+            if not line:
+                return
+            yield line
+
+    def produce():
+        try:
+            for event in core.ingest_ndjson(request_lines(), chunk_size, skip):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            logger.error(f"❌ Streamed ingest failed: {str(e)}")
+            core.METRICS.inc('chroma_server_request_errors_total', route='/add/stream', status='stream')
+            loop.call_soon_threadsafe(events.put_nowait, {'event': 'error', 'error': str(e)})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    producer = loop.run_in_executor(None, produce)
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        await response.write((json.dumps(event) + '\n').encode('utf-8'))
+    await producer
+    await response.write_eof()
+    return response
+
+
+def dispatch_to_flask(method, path, query_string, headers, body):
+    with core.app.test_request_context(path, method=method, query_string=query_string, headers=headers, data=body):
+        response = core.app.full_dispatch_request()
+        return response.status_code, response.headers.get('Content-Type'), response.get_data()
+
+
+async def flask_fallback(request):
+    """
+    Serve routes without a native async handler through the Flask app.
+    """
+    status, content_type, body = await run_blocking(
+        dispatch_to_flask,
+        request.method,
+        request.path,
+        request.query_string,
+        {'Content-Type': request.headers.get('Content-Type', ''), 'Accept': request.headers.get('Accept', '*/*')},
+        await request.read()
+    )
+    response = web.Response(status=status, body=body)
+    if content_type:
+        response.headers['Content-Type'] = content_type
+    return response
+
+
+async def get_stats(request):
+    try:
+        status, _, body = await run_blocking(dispatch_to_flask, 'GET', '/stats', b'', {}, b'')
+        stats = json.loads(body)
+        if status == 200:
+            stats['asyncServer'] = {
+                'maxInFlight': ASYNC_MAX_IN_FLIGHT,
+                'inFlight': IN_FLIGHT['current'],
+                'peakInFlight': IN_FLIGHT['peak'],
+                'waiting': IN_FLIGHT['waiting'],
+                'chromaWorkers': ASYNC_CHROMA_WORKERS,
+                'embeddingClient': EMBEDDING_CLIENT.stats()
+            }
+        return web.json_response(stats, status=status)
+    except Exception as e:
+        logger.error(f"❌ Get stats failed: {str(e)}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def on_startup(app):
+    app['in_flight'] = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+    if core.EMBEDDING_BACKEND.name == 'ollama':
+        await EMBEDDING_CLIENT.start()
+
+
+async def on_cleanup(app):
+    await EMBEDDING_CLIENT.close()
+
+
+def create_app():
+    app = web.Application(middlewares=[limit_in_flight, record_request_metrics], client_max_size=64 * 1024 * 1024)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post('/search', search)
+    app.router.add_post('/search/batch', search_batch)
+    app.router.add_post('/embed', embed)
+    app.router.add_post('/add/stream', add_entities_stream)
+    app.router.add_get('/stats', get_stats)
+    app.router.add_route('*', '/{tail:.*}', flask_fallback)
+    return app
+
+
+if __name__ == '__main__':
+    port = int(os.getenv('CHROMA_SERVER_PORT', 5002))
+    host = os.getenv('CHROMA_SERVER_HOST', '0.0.0.0')
+    core.start_server_tasks()
+    logger.info(f"🚀 Starting async chroma server on {host}:{port} (max in-flight: {ASYNC_MAX_IN_FLIGHT})")
+    web.run_app(create_app(), host=host, port=port, access_log=None)
@@ -0,0 +1,289 @@
+"""
+Multi-process serving mode for chroma_server.py.
+
+Runs one writer process and MULTI_WORKERS reader processes. The writer
+owns every route that changes the collection (/add, /add/stream,
+/collection/recreate, /collection/rebuild, /sync) and listens on an
+internal port. The readers
+share the public listening socket, serve searches from their own in-memory
+indexes and forward write routes to the writer. After each write the
+writer records the written and deleted entities in CHROMA_CHANGES_DIR and
+replaces CHROMA_GENERATION_FILE; readers poll it and apply the changes to
+their indexes, so searches see new entities within
+MULTI_GENERATION_POLL_SECONDS. Readers reopen the persisted collection only
+after a rebuild switch, a writer restart or REOPEN_DELTA_MAX_ENTITIES
+changed entities. Crashed workers are restarted.
+
+All processes open the same Chroma directory. Its SQLite database is safe
+to share between processes; the HNSW index files are only ever written by
+the writer, since readers open them with ReadOnlyHnswSegment.
+
+Run with: MULTI_WORKERS=4 python chroma_server_multi.py
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import hnswlib
+import requests
+from chromadb.segment import SegmentType
+from chromadb.segment.impl.manager import local as local_segments
+from chromadb.segment.impl.vector.brute_force_index import BruteForceIndex
+from chromadb.segment.impl.vector.local_hnsw import DEFAULT_CAPACITY
+from chromadb.segment.impl.vector.local_persistent_hnsw import PersistentLocalHnswSegment
+from overrides import override
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Reader processes sharing the public port
+MULTI_WORKERS = int(os.getenv('MULTI_WORKERS', os.cpu_count() or 2))
+# Internal port of the writer process (bound to localhost)
+MULTI_WRITER_PORT = int(os.getenv('MULTI_WRITER_PORT', 5102))
+# How often readers check the generation file, and the minimum time between two reopens
+MULTI_GENERATION_POLL_SECONDS = float(os.getenv('MULTI_GENERATION_POLL_SECONDS', 0.5))
+MULTI_REOPEN_MIN_INTERVAL = float(os.getenv('MULTI_REOPEN_MIN_INTERVAL', 2.0))
+# Seconds to wait for the writer's /ready before starting readers
+MULTI_STARTUP_TIMEOUT = float(os.getenv('MULTI_STARTUP_TIMEOUT', 600))
+# Same default as chroma_server.py (CHROMA_DATA_PATH/generation); fixed here so every process agrees
+CHROMA_GENERATION_FILE = os.getenv('CHROMA_GENERATION_FILE', os.path.join('./cdbComments', 'generation'))
+
+# Routes served only by the writer; readers forward them
+WRITE_ROUTES = {
+    '/add', '/add/stream', '/collection/recreate', '/collection/rebuild', '/collection/rebuild/status',
+    '/sync', '/sync/status'
+}
+
+
+class ReadOnlyHnswSegment(PersistentLocalHnswSegment):
+    """
+    Persistent HNSW segment that never writes its index files.
+
+    Chroma 0.4.22 has no read-only mode. When a persistent HNSW segment is
+    opened it replays the embeddings queue past the sequence id it last
+    persisted, and it persists the index once sync_threshold entities have
+    been added; an index that was never persisted is created on disk as
+    soon as it is initialized. A reader opening the collection while the
+    writer is persisting would then write the writer's files. This segment
+    never persists and creates a missing index in memory only, so replayed
+    entities stay in the reader's memory.
+    """
+
+    @override
+    def _init_index(self, dimensionality):
+        index = hnswlib.Index(space=self._params.space, dim=dimensionality)
+        self._brute_force_index = BruteForceIndex(
+            size=self._batch_size, dimensionality=dimensionality, space=self._params.space
+        )
+        if self._index_exists():
+            # Persisted indexes only load as persistent ones, which write nothing until persisted
+            index.load_index(
+                self._get_storage_folder(), is_persistent_index=True,
+                max_elements=int(max(self.count() * self._params.resize_factor, DEFAULT_CAPACITY))
+            )
+        else:
+            index.init_index(max_elements=DEFAULT_CAPACITY, ef_construction=self._params.construction_ef,
+                             M=self._params.M)
+        index.set_ef(self._params.search_ef)
+        index.set_num_threads(self._params.num_threads)
+        self._index = index
+        self._dimensionality = dimensionality
+        self._index_initialized = True
+
+    @override
+    def _persist(self):
+        pass
+
+
+def use_read_only_hnsw_segments():
+    """
+    Open persistent HNSW segments in this process with ReadOnlyHnswSegment.
+    Must run before the process opens the Chroma directory.
+    """
+    local_segments.SEGMENT_TYPE_IMPLS[SegmentType.HNSW_LOCAL_PERSISTED] = \
+        f'{ReadOnlyHnswSegment.__module__}.{ReadOnlyHnswSegment.__name__}'
+
+
+def read_generation():
+    try:
+        with open(CHROMA_GENERATION_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def install_write_forwarding(core, writer_url):
+    """
+    Forward write routes from a reader to the writer, streaming both bodies
+    for /add/stream so large ingests are not buffered in the reader.
+    """
+    from flask import Response, jsonify, request, stream_with_context
+
+    @core.app.before_request
+    def forward_write_routes():
+        if request.path not in WRITE_ROUTES:
+            return None
+        if request.path == '/add/stream':
+            body = iter(lambda: request.stream.read(64 * 1024), b'')
+        else:
+            body = request.get_data()
+        headers = {'Content-Type': request.content_type} if request.content_type else {}
+        try:
+            upstream = requests.request(request.method, writer_url + request.full_path, data=body,
+                                        headers=headers, stream=True, timeout=(5, None))
+        except requests.RequestException as e:
+            core.logger.error(f"❌ Forwarding {request.path} to the writer failed: {str(e)}")
+            return jsonify({'error': f'Writer unavailable: {str(e)}'}), 503
+        return Response(stream_with_context(upstream.iter_content(chunk_size=None)),
+                        status=upstream.status_code, content_type=upstream.headers.get('Content-Type'))
+
+
+def follow_generation(core, applied):
+    """
+    Reader loop: apply each generation the writer publishes from its change
+    records, and reopen the collection only when they are unavailable (a
+    rebuild switch, a writer restart) or the overlay of changed entities has
+    grown past REOPEN_DELTA_MAX_ENTITIES. Reopens are coalesced into one per
+    MULTI_REOPEN_MIN_INTERVAL; the newest generation is always applied.
+    """
+    last_reopen = 0.0
+    while True:
+        time.sleep(MULTI_GENERATION_POLL_SECONDS)
+        token = read_generation()
+        if token is None or not core.WARMUP_STATE['ready']:
+            continue
+        if token != applied:
+            changes = core.read_collection_changes(applied, token)
+            if changes is not None:
+                try:
+                    core.apply_collection_changes(changes, token)
+                    applied = token
+                except Exception as e:
+                    core.logger.error(f"❌ Applying changes for generation {token} failed: {str(e)}")
+        if token == applied and not core.delta_overlay_full():
+            continue
+        if time.monotonic() - last_reopen < MULTI_REOPEN_MIN_INTERVAL:
+            continue
+        try:
+            core.reopen_collection(token)
+            applied = token
+        except Exception as e:
+            core.logger.error(f"❌ Reopening collection for generation {token} failed: {str(e)}")
+        last_reopen = time.monotonic()
+
+
+def run_writer(host, port):
+    import chroma_server as core
+    from werkzeug.serving import make_server
+
+    core.start_server_tasks()
+    logger.info(f"✍️ Writer {os.getpid()} serving writes on {host}:{port}")
+    make_server(host, port, core.app, threaded=True).serve_forever()
+
+
+def run_reader(host, port, fd, writer_url):
+    # Read before opening the collection, so a write landing during startup still triggers a reopen
+    applied = read_generation()
+    use_read_only_hnsw_segments()
+    import chroma_server as core
+    from werkzeug.serving import make_server
+
+    install_write_forwarding(core, writer_url)
+    core.start_server_tasks()
+    threading.Thread(target=follow_generation, args=(core, applied), name='generation-follower', daemon=True).start()
+    logger.info(f"📖 Reader {os.getpid()} serving on {host}:{port}")
+    make_server(host, port, core.app, threaded=True, fd=fd).serve_forever()
+
+
+def wait_ready(url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Writer exited with status {process.returncode} during startup")
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Writer not ready after {timeout}s")
+
+
+def supervise(host, port, workers):
+    """
+    Start the writer, wait until it is warm, then start the readers on a
+    shared listening socket and restart any worker that exits.
+    """
+    script = os.path.abspath(__file__)
+    env = dict(os.environ, CHROMA_GENERATION_FILE=CHROMA_GENERATION_FILE)
+    writer_url = f"http://127.0.0.1:{MULTI_WRITER_PORT}"
+
+    def spawn_writer():
+        return subprocess.Popen([sys.executable, script, '--role', 'writer'],
+                                env=dict(env, CHROMA_SERVER_ROLE='writer'))
+
+    def spawn_reader():
+        return subprocess.Popen(
+            [sys.executable, script, '--role', 'reader', '--fd', str(listener.fileno()), '--host', host, '--port', str(port)],
+            env=dict(env, CHROMA_SERVER_ROLE='reader', MULTI_WRITER_URL=writer_url),
+            pass_fds=[listener.fileno()]
+        )
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    writer = spawn_writer()
+    readers = []
+    listener = None
+    try:
+        wait_ready(f"{writer_url}/ready", writer, MULTI_STARTUP_TIMEOUT)
+        listener = socket.create_server((host, port), backlog=1024)
+        readers = [spawn_reader() for _ in range(workers)]
+        logger.info(f"🚀 Serving on {host}:{port} with {workers} readers and writer {writer.pid}")
+
+        while not stopping.wait(1.0):
+            if writer.poll() is not None:
+                logger.warning(f"⚠️ Writer exited with status {writer.returncode}, restarting")
+                writer = spawn_writer()
+            for i, reader in enumerate(readers):
+                if reader.poll() is not None:
+                    logger.warning(f"⚠️ Reader {reader.pid} exited with status {reader.returncode}, restarting")
+                    readers[i] = spawn_reader()
+    finally:
+        for process in [*readers, writer]:
+            process.terminate()
+        for process in [*readers, writer]:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if listener is not None:
+            listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve chroma_server.py from one writer and several reader processes')
+    parser.add_argument('--role', choices=['supervisor', 'writer', 'reader'], default='supervisor')
+    parser.add_argument('--host', default=os.getenv('CHROMA_SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('CHROMA_SERVER_PORT', 5002)))
+    parser.add_argument('--workers', type=int, default=MULTI_WORKERS)
+    parser.add_argument('--fd', type=int, help='inherited listening socket (readers)')
+    args = parser.parse_args()
+
+    if args.role == 'writer':
+        run_writer('127.0.0.1', MULTI_WRITER_PORT)
+    elif args.role == 'reader':
+        run_reader(args.host, args.port, args.fd, os.environ['MULTI_WRITER_URL'])
+    else:
+        supervise(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
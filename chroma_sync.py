@@ -0,0 +1,28 @@
+"""
+One-shot ArangoDB Entity -> Chroma sync for chroma_server.py.
+
+Use this when the server is not running (e.g. from a nightly job before
+it starts). While the server is up, call POST /sync instead so its
+in-memory indexes and caches follow the changes.
+
+Run with: python chroma_sync.py [--source entities.jsonl] [--full]
+"""
+import argparse
+import json
+
+import chroma_server as core
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync ArangoDB Entity documents into the Chroma collection')
+    parser.add_argument('--source', default=core.SYNC_SOURCE,
+                        help="'arango' or a JSONL file of Entity documents (default: SYNC_SOURCE)")
+    parser.add_argument('--full', action='store_true', help='ignore the high-water mark and rescan everything')
+    args = parser.parse_args()
+
+    totals = core.run_entity_sync(full=args.full, source=args.source)
+    print(json.dumps(totals, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Shared setup for the chroma_server test suite.
+
+chroma_server opens its Chroma collection (under ./cdbComments) and its
+SQLite files on import, relative to the working directory, so the suite runs
+it from a fresh temporary directory with the offline hashing embedding
+backend. Run with: python -m pytest -q
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='chroma-server-tests-')
+
+TEST_ENV = {
+    'EMBEDDING_BACKEND': 'hashing',
+    'WARMUP_ENABLED': 'false',
+    'EMBEDDING_CACHE_ENABLED': 'false',
+    'SYNC_INTERVAL_SECONDS': '0',
+    'ANONYMIZED_TELEMETRY': 'False',
+}
+os.environ.update(TEST_ENV)
+os.chdir(DATA_DIR)
+sys.path.insert(0, ROOT)
+
+import chroma_server as core  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    """
+    chroma_server with an empty collection and empty, ready entity indexes.
+    """
+    response = core.app.test_client().post('/collection/recreate')
+    assert response.status_code == 200, response.get_json()
+    core.load_entity_indexes()
+    return core
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def embedding_calls(server, monkeypatch):
+    """
+    Texts passed to each embedding backend call, in call order.
+    """
+    calls = []
+    embed = server.EMBEDDING_BACKEND.embed
+
+    def record(texts):
+        calls.append(list(texts))
+        return embed(texts)
+
+    monkeypatch.setattr(server.EMBEDDING_BACKEND, 'embed', record)
+    return calls
+
+
+@pytest.fixture
+def add_entities(client):
+    """
+    POST /add in default mode; `names` double as entity texts and metadata names.
+    """
+    def add(ids, names, **metadata):
+        response = client.post('/add', json={
+            'entityIds': ids,
+            'entityTexts': names,
+            'metadata': [dict(metadata, name=name) for name in names]
+        })
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return add
+
+
+@pytest.fixture
+def write_jsonl(tmp_path):
+    """
+    Write documents to a JSONL file under tmp_path and return its path.
+    """
+    def write(name, documents):
+        path = tmp_path / name
+        path.write_text(''.join(json.dumps(doc) + '\n' for doc in documents), encoding='utf-8')
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def canonical_map(server, tmp_path, monkeypatch):
+    """
+    Install a canonical-ID map mapping each alias to its canonical id.
+    """
+    def install(aliases, names=None):
+        path = tmp_path / 'canonical_ids.json'
+        canonical = {entity_id: {'name': (names or {}).get(entity_id)} for entity_id in set(aliases.values())}
+        path.write_text(json.dumps({'version': 'test', 'canonical': canonical, 'aliases': aliases}))
+        monkeypatch.setattr(server, 'CANONICAL_MAP', server.CanonicalIdMap(str(path), 0))
+        server.CANONICAL_MAP.refresh()
+        return server.CANONICAL_MAP
+    return install
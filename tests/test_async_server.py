@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import chroma_server_async as async_core
+
+
+@pytest.fixture
+def async_request(server):
+    """
+    Send one request to a fresh chroma_server_async app; returns (status, JSON body).
+    """
+    def send(method, path, **kwargs):
+        async def run():
+            async with TestClient(TestServer(async_core.create_app())) as http:
+                response = await http.request(method, path, **kwargs)
+                return response.status, await response.json()
+        return asyncio.run(run())
+
+    return send
+
+
+def test_async_search_matches_flask_search(async_request, client, add_entities):
+    add_entities(['Entity/modi', 'Entity/gandhi'], ['Narendra Modi', 'Rahul Gandhi'])
+    query = {'query': 'Rahul Gandhi', 'nResults': 2, 'minSimilarity': -1}
+
+    status, body = async_request('POST', '/search', json=query)
+
+    assert status == 200
+    assert body['entityIds'][0] == 'Entity/gandhi'
+    assert body == client.post('/search', json=query).get_json()
+
+
+def test_async_batch_search_validates_like_flask(async_request):
+    assert async_request('POST', '/search/batch', json={'queries': []})[0] == 400
+    assert async_request('POST', '/search/batch', json={'queries': [{'nResults': 1}]})[0] == 400
+    assert async_request('POST', '/search/batch', json={'queries': [{'query': 'a', 'mode': 'fuzzy'}]})[0] == 400
+    assert async_request('POST', '/search', json={'query': 'a', 'ef': 0})[0] == 400
+
+
+def test_routes_without_async_handler_fall_back_to_flask(async_request):
+    status, body = async_request('GET', '/health')
+
+    assert status == 200
+    assert body['status'] == 'healthy'
+
+
+def test_async_stats_report_the_async_server(async_request):
+    status, body = async_request('GET', '/stats')
+
+    assert status == 200
+    assert body['asyncServer']['maxInFlight'] == async_core.ASYNC_MAX_IN_FLIGHT
+
+
+def test_async_transport_shares_the_core_client_state(server):
+    """
+    A plain 404 from /api/embed switches the shared core client to
+    /api/embeddings for that endpoint, in either serving mode.
+    """
+    from aiohttp import web
+
+    async def embed(request):
+        return web.Response(status=404, text='404 page not found')
+
+    async def embeddings(request):
+        body = await request.json()
+        return web.json_response({'embedding': [float(len(body['prompt']))]})
+
+    async def run():
+        fake = web.Application()
+        fake.router.add_post('/api/embed', embed)
+        fake.router.add_post('/api/embeddings', embeddings)
+        async with TestServer(fake) as ollama:
+            base_url = str(ollama.make_url('')).rstrip('/')
+            client = server.OllamaEmbeddingClient(
+                [base_url], 'model', connect_timeout=1, read_timeout=1, pool_size=2,
+                batch_wait_ms=0, max_batch_size=8
+            )
+            transport = async_core.AsyncOllamaTransport(client, pool_size=2)
+            await transport.start()
+            try:
+                return client, await transport.embed(['a', 'bb'])
+            finally:
+                await transport.close()
+
+    client, embeddings = asyncio.run(run())
+
+    assert embeddings == [[1.0], [2.0]]
+    assert client.stats()['batchUnsupported'] == [client.base_url]
+    assert client.stats()['endpoints'][client.base_url]['requests'] == 1
+    assert client.stats()['requestsSent'] == 3
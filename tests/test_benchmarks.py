@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import generate_corpus  # noqa: E402
+import run_benchmark  # noqa: E402
+
+
+def test_corpus_is_deterministic_and_ingestable(client):
+    records = list(generate_corpus.generate(50, seed=3))
+
+    assert records == list(generate_corpus.generate(50, seed=3))
+    assert len({record['entityId'] for record in records}) == 50
+    assert {record['metadata']['type'] for record in records} <= set(generate_corpus.TYPES)
+
+    body = ''.join(json.dumps(record) + '\n' for record in records)
+    response = client.post('/add/stream', data=body, content_type='application/x-ndjson')
+    assert json.loads(response.get_data(as_text=True).splitlines()[-1])['processed'] == 50
+
+
+def test_summary_reports_latency_percentiles():
+    summary = run_benchmark.summarize([0.001 * n for n in range(1, 101)], errors=2, elapsed=2.0, items_per_request=4)
+
+    assert summary['requests'] == 100 and summary['errors'] == 2
+    assert summary['requestsPerSecond'] == 50.0 and summary['itemsPerSecond'] == 200.0
+    assert summary['latencyMs']['p50'] == pytest.approx(50.5)
+    assert summary['latencyMs']['max'] == pytest.approx(100.0)
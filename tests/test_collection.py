@@ -0,0 +1,246 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def scratch_collection(server):
+    """
+    A separate collection for validation tests, dropped afterwards.
+    """
+    created = []
+
+    def create(name):
+        created.append(name)
+        return server.client.create_collection(name=name, metadata=server.hnsw_collection_metadata())
+
+    yield create
+    for name in created:
+        server.drop_collection_by_name(name)
+
+
+def test_write_gate_exclusive_waits_for_writes_in_progress(server):
+    gate = server.WriteGate()
+    events = []
+    writing, finish_write = threading.Event(), threading.Event()
+
+    def write():
+        with gate.write():
+            writing.set()
+            finish_write.wait(5)
+            events.append('write done')
+
+    def switch():
+        with gate.exclusive():
+            events.append('switched')
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    assert writing.wait(5)
+    switcher = threading.Thread(target=switch)
+    switcher.start()
+    time.sleep(0.1)
+    assert events == []
+    finish_write.set()
+    writer.join(5)
+    switcher.join(5)
+    assert events == ['write done', 'switched']
+
+
+def test_write_gate_holds_new_writes_during_exclusive_section(server):
+    gate = server.WriteGate()
+    events = []
+    entered, leave = threading.Event(), threading.Event()
+
+    def switch():
+        with gate.exclusive():
+            entered.set()
+            leave.wait(5)
+            events.append('switched')
+
+    def write():
+        with gate.write():
+            events.append('write')
+
+    switcher = threading.Thread(target=switch)
+    switcher.start()
+    assert entered.wait(5)
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.1)
+    assert events == []
+    leave.set()
+    switcher.join(5)
+    writer.join(5)
+    assert events == ['switched', 'write']
+
+
+def test_validate_rebuild_accepts_many_identical_vectors(server, scratch_collection):
+    target = scratch_collection('validation_duplicates')
+    duplicates = np.tile(server.embed_documents(['Ram Kumar']), (30, 1))
+    unique = server.embed_documents([f'Entity number {i}' for i in range(10)])
+    target.add(ids=[f'dup{i}' for i in range(30)] + [f'unique{i}' for i in range(10)],
+               embeddings=np.vstack([duplicates, unique]).tolist())
+
+    report = server.validate_rebuild(target, expected=40)
+
+    assert report['selfRecall'] == 1.0
+    assert report['ok'], report['problems']
+
+
+def test_validate_rebuild_reports_missing_entities(server, scratch_collection):
+    target = scratch_collection('validation_short')
+    target.add(ids=['a'], embeddings=server.embed_documents(['Only entity']).tolist())
+
+    report = server.validate_rebuild(target, expected=5)
+
+    assert not report['ok']
+    assert 'below the 5 entities written' in report['problems'][0]
+
+
+def test_rebuild_switches_to_a_new_collection(server, client, add_entities):
+    add_entities(['Entity/a', 'Entity/b'], ['Akhilesh Yadav', 'Mayawati'])
+    previous = server.collection.name
+
+    summary = server.rebuild_collection()
+
+    assert summary['ok'] and summary['previous'] == previous
+    assert server.collection.name == summary['collection'] != previous
+    assert server.read_collection_alias()['collection'] == summary['collection']
+    assert server.collection.count() == 2
+    response = client.post('/search', json={'query': 'Mayawati', 'nResults': 1, 'fastPath': False})
+    assert response.get_json()['entityIds'] == ['Entity/b']
+    server.drop_collection_by_name(previous)
+
+
+@pytest.fixture
+def writer_role(server, tmp_path, monkeypatch):
+    """
+    Make this process the multi-process writer, with its change log under tmp_path.
+    """
+    monkeypatch.setattr(server, 'CHROMA_SERVER_ROLE', 'writer')
+    monkeypatch.setattr(server, 'CHROMA_CHANGES_DIR', str(tmp_path / 'changes'))
+    monkeypatch.setattr(server, 'CHROMA_GENERATION_FILE', str(tmp_path / 'generation'))
+    monkeypatch.setattr(server, 'COLLECTION_DELTAS', server.CollectionDeltaOverlay())
+    server.publish_generation(server.COLLECTION_GENERATION)
+    return server
+
+
+def test_writer_records_changes_for_readers(writer_role, add_entities, monkeypatch):
+    server = writer_role
+    before = server.read_published_generation()
+    add_entities(['Entity/a', 'Entity/b'], ['Nitish Kumar', 'Lalu Prasad'])
+    server.delete_entities(['Entity/a'])
+    after = server.read_published_generation()
+
+    changes = server.read_collection_changes(before, after)
+
+    assert changes[0]['ids'] == ['Entity/a', 'Entity/b']
+    assert server.decode_vectors(changes[0]['embeddings']).shape == (2, server.EMBEDDING_TARGET_DIM)
+    assert changes[1] == {'removed': ['Entity/a']}
+    # Another writer process, or a generation without a record, means a full reopen
+    assert server.read_collection_changes(f"other-boot:{before.rsplit(':', 1)[1]}", after) is None
+    server.bump_collection_generation()
+    assert server.read_collection_changes(before, server.read_published_generation()) is None
+
+    # A reader applies the records to its indexes and overlay
+    monkeypatch.setattr(server, 'CHROMA_SERVER_ROLE', 'reader')
+    server.reset_entity_indexes()
+    assert server.apply_collection_changes(changes, after) == 3
+    assert server.NAME_INDEX.lookup('Lalu Prasad', 1)[0][0] == 'Entity/b'
+    assert server.NAME_INDEX.lookup('Nitish Kumar', 1) == []
+    assert len(server.COLLECTION_DELTAS) == 2
+
+
+def test_delta_overlay_merges_changes_over_a_stale_collection(server, add_entities):
+    add_entities(['Entity/a', 'Entity/b', 'Entity/c'], ['Sharad Pawar', 'Uddhav Thackeray', 'Devendra Fadnavis'])
+    overlay = server.CollectionDeltaOverlay()
+    vectors = server.embed_documents(['Ajit Pawar'])
+    overlay.upsert(['Entity/d'], ['Ajit Pawar'], [{'name': 'Ajit Pawar', 'type': 'PERSON'}], vectors)
+    overlay.remove(['Entity/a'])
+
+    query = server.embed_documents(['Ajit Pawar'])
+    results = overlay.query(server.collection, query, 3)
+    assert results['ids'][0][0] == 'Entity/d'
+    assert 'Entity/a' not in results['ids'][0]
+    assert len(results['ids'][0]) == 3
+
+    filtered = overlay.query(server.collection, query, 3, where={'type': 'PERSON'})
+    assert filtered['ids'][0] == ['Entity/d']
+
+
+def test_reader_gets_changed_entities_from_the_overlay(server, add_entities, monkeypatch):
+    add_entities(['Entity/a', 'Entity/b'], ['Sharad Pawar', 'Uddhav Thackeray'])
+    overlay = server.CollectionDeltaOverlay()
+    vectors = server.embed_documents(['Supriya Sule', 'Uddhav B Thackeray'])
+    overlay.upsert(['Entity/c', 'Entity/b'], ['Supriya Sule', 'Uddhav B Thackeray'],
+                   [{'name': 'Supriya Sule'}, {'name': 'Uddhav B Thackeray'}], vectors)
+    overlay.remove(['Entity/a'])
+    monkeypatch.setattr(server, 'COLLECTION_DELTAS', overlay)
+
+    fetched = server.get_entities(['Entity/a', 'Entity/b', 'Entity/c'], ['embeddings', 'metadatas'])
+
+    by_id = dict(zip(fetched['ids'], zip(fetched['embeddings'], fetched['metadatas'])))
+    assert set(by_id) == {'Entity/b', 'Entity/c'}
+    assert by_id['Entity/b'][1] == {'name': 'Uddhav B Thackeray'}
+    np.testing.assert_array_equal(by_id['Entity/c'][0], vectors[0])
+
+
+def test_reader_hybrid_search_scores_entities_only_in_the_overlay(server, add_entities, monkeypatch):
+    add_entities(['Entity/a'], ['Sharad Pawar'])
+    overlay = server.CollectionDeltaOverlay()
+    vectors = server.embed_documents(['Supriya Sule'])
+    overlay.upsert(['Entity/c'], ['Supriya Sule'], [{'name': 'Supriya Sule'}], vectors)
+    monkeypatch.setattr(server, 'COLLECTION_DELTAS', overlay)
+    spec = server.parse_search_spec({'query': 'Sule', 'mode': 'hybrid', 'nResults': 2, 'minSimilarity': -3})
+    vector_results = {'ids': [['Entity/a']], 'distances': [[1.5]], 'metadatas': [[{'name': 'Sharad Pawar'}]]}
+
+    fused = server.fuse_hybrid_results(vector_results, 0, [('Entity/c', 2.0)], spec, vectors[0])
+
+    similarities = dict(zip(fused['entityIds'], fused['similarities']))
+    assert set(similarities) == {'Entity/a', 'Entity/c'}
+    assert similarities['Entity/c'] == pytest.approx(1.0, abs=1e-5)
+
+
+READER_SCRIPT = """
+import hashlib, os, shutil
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+import chroma_server_multi
+
+writer = chromadb.PersistentClient(path='shared')
+entities = writer.create_collection('entities', metadata={'hnsw:sync_threshold': 100, 'hnsw:batch_size': 10})
+vectors = np.random.default_rng(3).standard_normal((1400, 8)).tolist()
+entities.add(ids=[f'e{i}' for i in range(200)], embeddings=vectors[:200])
+segment = next(os.path.join('shared', name) for name in os.listdir('shared') if os.path.isdir(os.path.join('shared', name)))
+shutil.copytree(segment, 'early')
+entities.add(ids=[f'e{i}' for i in range(200, 1400)], embeddings=vectors[200:])
+# A reader that loaded the index before the writer persisted the rest replays 1200 entities
+shutil.rmtree(segment)
+shutil.copytree('early', segment)
+digest = lambda: {name: hashlib.md5(open(os.path.join(segment, name), 'rb').read()).hexdigest() for name in os.listdir(segment)}
+before = digest()
+
+chroma_server_multi.use_read_only_hnsw_segments()
+SharedSystemClient.clear_system_cache()
+reader = chromadb.PersistentClient(path='shared').get_collection('entities')
+print([reader.query(query_embeddings=[vectors[i]], n_results=1)['ids'][0][0] for i in (5, 1312)])
+print(digest() == before)
+"""
+
+
+def test_readers_never_write_the_hnsw_index_files(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, ANONYMIZED_TELEMETRY='False')
+    completed = subprocess.run([sys.executable, '-c', READER_SCRIPT], cwd=tmp_path, env=env,
+                               capture_output=True, text=True, timeout=120)
+
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.split('\n')[-3:-1] == ["['e5', 'e1312']", 'True']
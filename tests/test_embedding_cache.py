@@ -0,0 +1,74 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import chroma_server
+
+# The server fixture replaces the module-level function with a fake
+get_embeddings = chroma_server.get_embeddings
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'embedding_cache.sqlite3')
+
+
+def vectors(*texts):
+    return {text: np.full(4, float(i), dtype=np.float32) for i, text in enumerate(texts)}
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+
+def test_re_caching_existing_texts_does_not_grow_the_disk_count(cache_path):
+    cache = chroma_server.EmbeddingCache('model-a', cache_path, memory_size=10, disk_size=100)
+    cache.put_many(vectors('a', 'b', 'c', 'd'))
+    cache.put_many(vectors('a', 'b', 'c', 'd'))
+    # Texts that normalize to the same key are one entry
+    cache.put_many(vectors('  a ', 'e'))
+
+    assert cache.stats()['disk']['size'] == 5
+    assert disk_rows(cache_path) == 5
+
+
+def test_disk_tier_evicts_least_recently_used_entries(cache_path):
+    cache = chroma_server.EmbeddingCache('model-a', cache_path, memory_size=1, disk_size=10)
+    for i in range(12):
+        cache.put_many(vectors(f'text {i}'))
+
+    assert cache.stats()['disk']['size'] <= 10
+    assert cache.stats()['disk']['size'] == disk_rows(cache_path)
+    assert 'text 11' in cache.get_many(['text 11'])
+
+
+def test_disk_tier_survives_reopening_and_drops_other_models(cache_path):
+    cache = chroma_server.EmbeddingCache('model-a', cache_path, memory_size=10, disk_size=100)
+    cache.put_many(vectors('a', 'b'))
+
+    reopened = chroma_server.EmbeddingCache('model-a', cache_path, memory_size=10, disk_size=100)
+    np.testing.assert_array_equal(reopened.get_many(['b'])['b'], np.full(4, 1.0))
+    assert reopened.stats()['disk']['hits'] == 1
+
+    other_model = chroma_server.EmbeddingCache('model-b', cache_path, memory_size=10, disk_size=100)
+    assert other_model.get_many(['a', 'b']) == {}
+    assert other_model.stats()['disk']['size'] == 0
+
+
+def test_only_cache_misses_are_sent_to_the_backend(monkeypatch, cache_path):
+    fetched = []
+
+    def fetch_embeddings(texts):
+        fetched.append(list(texts))
+        return np.array([[float(len(text))] * 4 for text in texts], dtype=np.float32)
+
+    monkeypatch.setattr(chroma_server, 'fetch_embeddings', fetch_embeddings)
+    monkeypatch.setattr(chroma_server, 'EMBEDDING_CACHE',
+                        chroma_server.EmbeddingCache('model-a', cache_path, memory_size=10, disk_size=100))
+
+    np.testing.assert_array_equal(get_embeddings(['Modi', 'Shah'])[:, 0], [4.0, 4.0])
+    # Normalized repeats are hits; only the new text is fetched
+    np.testing.assert_array_equal(get_embeddings([' Modi ', 'Gandhi', 'Shah'])[:, 0], [4.0, 6.0, 4.0])
+    assert fetched == [['Modi', 'Shah'], ['Gandhi']]
@@ -0,0 +1,43 @@
+import json
+
+
+def ndjson(items):
+    return ''.join((item if isinstance(item, str) else json.dumps(item)) + '\n' for item in items)
+
+
+def entity(n):
+    return {'entityId': f'Entity/{n}', 'entityText': f'Person number {n}', 'metadata': {'name': f'Person {n}'}}
+
+
+def events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_ingest_writes_chunks_and_reports_invalid_lines(client, server):
+    body = ndjson([entity(1), 'not json', entity(2),
+                   {'entityId': 'Entity/x', 'entityText': 'x', 'metadata': {}}, entity(3)])
+
+    response = client.post('/add/stream?chunkSize=2', data=body, content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    progress = events(response)
+    assert [event['event'] for event in progress] == ['chunk', 'chunk', 'done']
+    assert progress[0]['lines'] == [1, 3] and progress[0]['count'] == 2
+    assert [item['line'] for item in progress[0]['invalid']] == [2]
+    assert progress[-1]['processed'] == 3 and progress[-1]['invalid'] == 2
+    assert progress[-1]['resumeFrom'] == 5
+    assert sorted(server.collection.get()['ids']) == ['Entity/1', 'Entity/2', 'Entity/3']
+
+
+def test_stream_ingest_resumes_after_skipped_lines(client, server):
+    body = ndjson(entity(n) for n in range(1, 6))
+
+    response = client.post('/add/stream?chunkSize=2&skip=3', data=body, content_type='application/x-ndjson')
+
+    assert events(response)[-1]['processed'] == 2
+    assert sorted(server.collection.get()['ids']) == ['Entity/4', 'Entity/5']
+
+
+def test_stream_ingest_rejects_bad_parameters(client):
+    assert client.post('/add/stream?chunkSize=0', data='').status_code == 400
+    assert client.post('/add/stream?skip=abc', data='').status_code == 400
@@ -0,0 +1,46 @@
+import threading
+
+
+def metric_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_registry_sums_updates_from_every_shard(server):
+    registry = server.MetricsRegistry(shards=4, buckets=(0.1, 1.0))
+    registry.counter('requests_total', 'Requests.')
+    registry.histogram('latency_seconds', 'Latency.')
+
+    def work():
+        for _ in range(100):
+            registry.inc('requests_total', route='/search')
+            registry.observe('latency_seconds', 0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rendered = registry.render()
+    assert 'requests_total{route="/search"} 800' in rendered
+    assert metric_lines(rendered, 'latency_seconds_bucket') == [
+        'latency_seconds_bucket{le="0.1"} 0',
+        'latency_seconds_bucket{le="1.0"} 800',
+        'latency_seconds_bucket{le="+Inf"} 800',
+    ]
+    assert 'latency_seconds_count 800' in rendered
+
+
+def test_metrics_endpoint_reports_requests_errors_and_entities(client, add_entities):
+    add_entities(['Entity/modi'], ['Narendra Modi'])
+    client.post('/search', json={'query': 'Modi'})
+    client.post('/search', json={})
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert metric_lines(text, 'chroma_server_request_seconds_count{route="/search"}')
+    assert 'chroma_server_request_errors_total{route="/search",status="400"}' in text
+    assert 'chroma_server_collection_entities 1' in text
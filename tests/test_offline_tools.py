@@ -0,0 +1,125 @@
+import fcntl
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import chroma_backfill
+import chroma_dedup
+from conftest import ROOT, TEST_ENV
+
+
+def test_cluster_roots_joins_chained_pairs():
+    pair_blocks = [(np.array([0, 2]), np.array([1, 3])), (np.array([1]), np.array([2]))]
+
+    roots, pairs = chroma_dedup.cluster_roots(6, pair_blocks)
+
+    assert roots.tolist() == [0, 0, 0, 0, 4, 5]
+    assert pairs == 3
+
+
+def test_canonical_rows_pick_the_most_mentioned_member():
+    roots = np.array([0, 0, 0, 3, 3, 5])
+    mentions = np.array([1.0, 5.0, 5.0, 2.0, 0.0, 0.0])
+
+    # Ties go to the earliest row
+    assert chroma_dedup.canonical_rows(roots, mentions).tolist() == [1, 1, 1, 3, 3, 5]
+
+
+def test_similar_pairs_compares_across_blocks_and_respects_types():
+    vectors = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    type_codes = np.array([0, 0, 0, 1, 0])
+
+    pairs = {
+        (int(i), int(j))
+        for rows, cols in chroma_dedup.similar_pairs(vectors, 0.95, 2, type_codes)
+        for i, j in zip(rows, cols)
+    }
+
+    assert pairs == {(0, 1), (2, 4)}
+
+
+def test_canonical_map_lists_aliases_under_their_canonical_entity(server):
+    ids = ['Entity/a', 'Entity/b', 'Entity/c']
+    canonical = np.array([1, 1, 2])
+    mentions = np.array([2.0, 3.0, 1.0])
+
+    canonical_map = chroma_dedup.build_canonical_map(ids, ['A', 'B', 'C'], canonical, mentions, 0.9)
+
+    assert canonical_map['aliases'] == {'Entity/a': 'Entity/b'}
+    assert canonical_map['canonical'] == {'Entity/b': {'name': 'B', 'aliases': ['Entity/a'], 'mentions': 5}}
+
+
+def run_backfill(workdir, *args, check=True):
+    env = dict(os.environ, PYTHONPATH=ROOT, **TEST_ENV)
+    completed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'chroma_backfill.py'), *args],
+        cwd=workdir, env=env, capture_output=True, text=True, timeout=300
+    )
+    if not check:
+        return completed
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout[completed.stdout.index('{'):])
+
+
+def test_backfill_resumes_after_the_checkpoint(tmp_path, write_jsonl):
+    documents = [{'_key': f'k{i}', 'name': f'Entity {i}'} for i in range(7)]
+    documents.insert(3, {'name': 'no key'})
+    path = write_jsonl('dump.jsonl', documents)
+    args = [path, '--workers', '1', '--chunk-size', '2', '--write-batch', '2']
+
+    first = run_backfill(tmp_path, *args)
+    assert (first['records'], first['written'], first['invalid'], first['count']) == (8, 7, 1, 7)
+
+    # Pretend the run stopped after the first two written batches
+    checkpoint_path = f"{path}.checkpoint.json"
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    checkpoint.update(records=4, written=3, invalid=1)
+    with open(checkpoint_path, 'w') as f:
+        json.dump(checkpoint, f)
+
+    resumed = run_backfill(tmp_path, *args)
+    assert resumed['resumedFrom'] == 4
+    assert (resumed['writtenThisRun'], resumed['records'], resumed['written']) == (4, 8, 7)
+    assert resumed['count'] == 7
+
+
+def test_backfill_refuses_to_run_while_a_server_holds_the_collection(tmp_path, write_jsonl):
+    path = write_jsonl('dump.jsonl', [{'_key': 'k0', 'name': 'Entity 0'}])
+    os.makedirs(tmp_path / 'cdbComments')
+    with open(tmp_path / 'cdbComments' / 'server.lock', 'a') as server_lock:
+        fcntl.flock(server_lock, fcntl.LOCK_SH)
+        completed = run_backfill(tmp_path, path, '--workers', '1', check=False)
+
+    assert completed.returncode != 0
+    assert 'stop it before running the backfill' in completed.stderr
+    assert not os.path.exists(f"{path}.checkpoint.json")
+
+
+def test_backfill_workers_do_not_load_the_server():
+    # Spawned workers re-import chroma_backfill before running init_worker
+    completed = subprocess.run(
+        [sys.executable, '-c', 'import os, sys, chroma_backfill; chroma_backfill.init_worker(os.getppid()); '
+                               'print(sorted({"chroma_server", "chromadb"} & set(sys.modules)))'],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT, **TEST_ENV), capture_output=True, text=True, timeout=60
+    )
+
+    assert completed.stdout.strip() == '[]', completed.stderr
+
+
+def test_backfill_writes_go_through_the_server_write_path(server, tmp_path):
+    checkpoint = {'records': 0, 'written': 0, 'invalid': 0}
+    writer = chroma_backfill.BackfillWriter(server.write_entities, checkpoint, str(tmp_path / 'checkpoint.json'), 2)
+    generation = server.COLLECTION_GENERATION
+    records = [('Entity/k1', 'Backfilled Person', {'name': 'Backfilled Person'}), ('Entity/k2', 'Other', {'name': 'Other'})]
+
+    writer.add(records, 2, server.embed_documents([text for _, text, _ in records]))
+
+    assert server.COLLECTION_GENERATION > generation
+    assert server.NAME_INDEX.lookup('Backfilled Person', 1)
+    stored = server.collection.get(ids=['Entity/k1'], include=['metadatas'])
+    assert server.CONTENT_HASH_KEY in stored['metadatas'][0]
+    assert checkpoint['written'] == 2
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+
+import pytest
+
+import chroma_server
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    @property
+    def text(self):
+        return self._body if isinstance(self._body, str) else json.dumps(self._body)
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeOllama:
+    """
+    Stands in for the client's requests.Session; embeds a text as [len(text)].
+    Endpoints listed in `slow` answer after `slow_seconds`; /api/embed
+    answers batch_status with batch_body when that is not 200.
+    """
+
+    def __init__(self, batch_status=200, batch_body='404 page not found', slow=(), slow_seconds=0.0):
+        self.batch_status = batch_status
+        self.batch_body = batch_body
+        self.slow = set(slow)
+        self.slow_seconds = slow_seconds
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json, timeout):
+        base_url, endpoint = url.rsplit('/api/', 1)
+        with self._lock:
+            self.calls.append((endpoint, json))
+        if base_url in self.slow:
+            time.sleep(self.slow_seconds)
+        if url.endswith('/api/embed'):
+            if self.batch_status != 200:
+                return FakeResponse(self.batch_status, self.batch_body)
+            return FakeResponse(200, {'embeddings': [[float(len(text))] for text in json['input']]})
+        return FakeResponse(200, {'embedding': [float(len(json['prompt']))]})
+
+
+def make_client(ollama, batch_wait_ms=0, max_batch_size=64, base_urls=('http://ollama.test/',), hedge=None,
+                batch_retry_seconds=300.0):
+    client = chroma_server.OllamaEmbeddingClient(
+        list(base_urls), 'model', connect_timeout=1, read_timeout=1,
+        pool_size=4, batch_wait_ms=batch_wait_ms, max_batch_size=max_batch_size, hedge=hedge,
+        batch_retry_seconds=batch_retry_seconds
+    )
+    client.session = ollama
+    return client
+
+
+def test_concurrent_callers_share_one_request():
+    ollama = FakeOllama()
+    client = make_client(ollama, batch_wait_ms=200)
+    results = {}
+
+    def embed(text):
+        results[text] = client.embed([text, 'shared'])
+
+    threads = [threading.Thread(target=embed, args=('x' * n,)) for n in range(1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {'x' * n: [[float(n)], [6.0]] for n in range(1, 5)}
+    assert len(ollama.calls) == 1
+    # Texts shared between callers are embedded once
+    assert sorted(ollama.calls[0][1]['input']) == ['shared', 'x', 'xx', 'xxx', 'xxxx']
+    assert client.stats()['callersBatched'] == 4
+
+
+def test_large_requests_are_split_by_max_batch_size():
+    ollama = FakeOllama()
+    client = make_client(ollama, max_batch_size=2)
+
+    assert client.embed(['a', 'bb', 'ccc']) == [[1.0], [2.0], [3.0]]
+    assert [len(call[1]['input']) for call in ollama.calls] == [2, 1]
+
+
+def test_missing_batch_endpoint_falls_back_to_single_requests():
+    ollama = FakeOllama(batch_status=404)
+    client = make_client(ollama)
+
+    assert client.embed(['a', 'bb']) == [[1.0], [2.0]]
+    assert [endpoint for endpoint, _ in ollama.calls] == ['embed', 'embeddings', 'embeddings']
+    assert client.stats()['batchUnsupported'] == ['http://ollama.test']
+
+
+def test_missing_model_fails_instead_of_falling_back():
+    ollama = FakeOllama(batch_status=404, batch_body={'error': 'model "model" not found, try pulling it first'})
+    client = make_client(ollama)
+
+    with pytest.raises(RuntimeError):
+        client.embed(['a'])
+    assert [endpoint for endpoint, _ in ollama.calls] == ['embed']
+    assert client.stats()['batchUnsupported'] == []
+
+
+def test_batch_endpoint_is_retried_after_the_fallback_expires():
+    ollama = FakeOllama(batch_status=404)
+    client = make_client(ollama, batch_retry_seconds=0.05)
+    client.embed(['a'])
+
+    ollama.batch_status = 200
+    client.embed(['a'])
+    time.sleep(0.06)
+    client.embed(['a'])
+
+    assert [endpoint for endpoint, _ in ollama.calls] == ['embed', 'embeddings', 'embeddings', 'embed']
+
+
+def test_hedge_delay_follows_recent_latencies():
+    policy = chroma_server.HedgePolicy(percentile=50, min_delay_ms=5, min_samples=3, window=10)
+    policy.record(0.1)
+    assert policy.delay() is None
+
+    policy.record(0.2)
+    policy.record(0.3)
+    assert policy.delay() == 0.2
+
+
+def test_slow_query_requests_are_hedged_to_the_next_endpoint():
+    ollama = FakeOllama(slow={'http://slow.test'}, slow_seconds=0.5)
+    policy = chroma_server.HedgePolicy(percentile=50, min_delay_ms=10, min_samples=1, window=10)
+    policy.record(0.01)
+    client = make_client(ollama, base_urls=('http://slow.test', 'http://fast.test'), hedge=policy)
+
+    started = time.perf_counter()
+    assert client.embed(['abc']) == [[3.0]]
+
+    assert time.perf_counter() - started < 0.4
+    assert client.stats()['hedging']['hedged'] == 1
+    assert client.stats()['hedging']['hedgeWins'] == 1
+
+
+def test_document_batches_are_not_hedged():
+    ollama = FakeOllama(slow={'http://slow.test'}, slow_seconds=0.05)
+    policy = chroma_server.HedgePolicy(percentile=50, min_delay_ms=1, min_samples=1, window=10)
+    policy.record(0.001)
+    client = make_client(ollama, base_urls=('http://slow.test', 'http://fast.test'), hedge=policy)
+
+    assert client.embed_batch(['a', 'bb']) == [[1.0], [2.0]]
+    assert len(ollama.calls) == 1
+    assert policy.hedged == 0
@@ -0,0 +1,341 @@
+import threading
+
+import numpy as np
+import pytest
+
+
+def stored_vectors(server, ids):
+    fetched = server.collection.get(ids=ids, include=['embeddings'])
+    by_id = dict(zip(fetched['ids'], fetched['embeddings']))
+    return np.asarray([by_id[entity_id] for entity_id in ids], dtype=np.float32)
+
+
+@pytest.fixture
+def politicians(add_entities):
+    add_entities(['Entity/modi', 'Entity/shah'], ['Narendra Modi', 'Amit Shah'], type='PERSON')
+    add_entities(['Entity/bjp'], ['Bharatiya Janata Party'], type='ORG')
+    add_entities(['Entity/gandhi'], ['Rahul Gandhi'], type='PERSON')
+
+
+def test_add_embeds_with_the_server_backend(server, add_entities):
+    names = ['Narendra Modi', 'Rahul Gandhi', 'Arvind Kejriwal']
+    ids = ['Entity/modi', 'Entity/gandhi', 'Entity/kejriwal']
+    assert add_entities(ids, names)['count'] == 3
+
+    vectors = stored_vectors(server, ids)
+    assert vectors.shape == (3, server.EMBEDDING_TARGET_DIM)
+    np.testing.assert_allclose(vectors, server.embed_documents(names), atol=1e-6)
+
+
+def upsert(client, ids, texts, metadatas):
+    response = client.post('/add', json={'mode': 'upsert', 'entityIds': ids, 'entityTexts': texts, 'metadata': metadatas})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_add_and_upsert_modes_write_vectors_from_the_same_space(server, client, add_entities):
+    add_entities(['Entity/a'], ['Mamata Banerjee'])
+    upsert(client, ['Entity/b'], ['Mamata Banerjee'], [{'name': 'Mamata Banerjee'}])
+
+    vectors = stored_vectors(server, ['Entity/a', 'Entity/b'])
+    np.testing.assert_allclose(vectors[0], vectors[1], atol=1e-6)
+    stored = server.collection.get(ids=['Entity/a', 'Entity/b'], include=['metadatas'])['metadatas']
+    assert stored[0]['content_hash'] == stored[1]['content_hash']
+
+
+def test_upsert_mode_only_embeds_new_and_changed_texts(server, client, add_entities, embedding_calls):
+    add_entities(['Entity/a', 'Entity/b'], ['Lalu Prasad', 'Nitish Kumar'])
+    embedding_calls.clear()
+
+    counts = upsert(
+        client,
+        ['Entity/a', 'Entity/b', 'Entity/c', 'Entity/c'],
+        ['Lalu Prasad', 'Nitish Kumar (CM)', 'Tejashwi Yadav', 'Tejashwi Yadav'],
+        [{'name': 'Lalu Prasad', 'party': 'RJD'}, {'name': 'Nitish Kumar'}, {'name': 'Tejashwi Yadav'},
+         {'name': 'Tejashwi Yadav'}]
+    )
+
+    assert {key: counts[key] for key in ('inserted', 'updated', 'metadataUpdated', 'skipped')} == {
+        'inserted': 1, 'updated': 1, 'metadataUpdated': 1, 'skipped': 1
+    }
+    assert sorted(text for call in embedding_calls for text in call) == ['Nitish Kumar (CM)', 'Tejashwi Yadav']
+    assert server.collection.get(ids=['Entity/a'])['metadatas'][0]['party'] == 'RJD'
+
+    again = upsert(client, ['Entity/a'], ['Lalu Prasad'], [{'name': 'Lalu Prasad', 'party': 'RJD'}])
+    assert again['skipped'] == 1
+
+
+def test_hashing_backend_embeds_similar_spellings_close_together(server):
+    vectors = server.embed_documents(['Narendra Modi', 'Narendra Damodardas Modi', 'Mamata Banerjee'])
+
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    assert vectors[0] @ vectors[1] > 0.5 > vectors[0] @ vectors[2]
+    np.testing.assert_array_equal(server.embed_documents(['Narendra Modi'])[0], vectors[0])
+
+
+def test_vector_search_finds_added_entity(client, politicians):
+    response = client.post('/search', json={'query': 'Narendra Modi', 'nResults': 1})
+    assert response.status_code == 200
+    assert response.get_json()['entityIds'] == ['Entity/modi']
+    assert response.get_json()['entityNames'] == ['Narendra Modi']
+
+
+def test_name_fast_path_answers_exact_and_prefix_names(server, add_entities):
+    add_entities(['Entity/modi', 'Entity/modern'], ['Narendra Modi', 'Narendra Modern Art'])
+
+    exact = server.NAME_INDEX.lookup('narendra  MODI', 5)
+    assert exact[0][:2] == ('Entity/modi', 1.0)
+    prefix = server.NAME_INDEX.lookup('Narendra Mod', 5)
+    assert {hit[0] for hit in prefix} == {'Entity/modi', 'Entity/modern'}
+    assert all(0 < hit[1] < 1 for hit in prefix)
+
+
+def test_readding_an_entity_keeps_one_prefix_entry(server):
+    index = server.EntityNameIndex()
+    metadatas = [{'name': 'Narendra Modi'}, {'name': 'Narendra Singh'}, {'name': 'Amit Shah'}]
+    index.add(['e1', 'e2', 'e3'], [None] * 3, metadatas)
+
+    index.add(['e1'], [None], [{'name': 'Narendra Modi'}])
+
+    assert sorted(hit[0] for hit in index.lookup('Narendra', 10)) == ['e1', 'e2']
+
+
+def test_exact_name_search_skips_embedding(client, politicians, embedding_calls):
+    response = client.post('/search', json={'query': 'amit SHAH', 'nResults': 1})
+
+    assert response.get_json()['entityIds'] == ['Entity/shah']
+    assert embedding_calls == []
+
+
+def test_bm25_ranks_the_rarer_term_first(server):
+    index = server.LexicalIndex()
+    index.add(
+        ['a', 'b', 'c'],
+        ['delhi chief minister kejriwal', 'delhi metro', 'delhi airport'],
+        [{'name': 'Arvind Kejriwal'}, {'name': 'Delhi Metro'}, {'name': 'Delhi Airport'}]
+    )
+    hits = index.search('delhi kejriwal', 3)
+    assert hits[0][0] == 'a'
+    assert len(hits) == 3
+
+    index.remove(['a'])
+    assert [entity_id for entity_id, _ in index.search('kejriwal', 3)] == []
+
+
+def test_hybrid_fusion_keeps_lexical_only_matches(server, add_entities):
+    add_entities(['Entity/a', 'Entity/b'], ['Shashi Tharoor', 'Thiruvananthapuram'])
+    spec = server.parse_search_spec({'query': 'Tharoor', 'mode': 'hybrid', 'nResults': 2, 'minSimilarity': 0.99})
+    query_vector = server.embed_documents(['Tharoor'])[0]
+    vector_results = {'ids': [['Entity/a']], 'distances': [[0.1]], 'metadatas': [[{'name': 'Shashi Tharoor'}]]}
+    lexical_hits = [('Entity/b', 2.0), ('Entity/a', 1.0)]
+
+    fused = server.fuse_hybrid_results(vector_results, 0, lexical_hits, spec, query_vector)
+
+    # Entity/a is ranked by both lists, Entity/b only lexically (and kept despite minSimilarity)
+    assert fused['entityIds'] == ['Entity/a', 'Entity/b']
+    assert fused['similarities'][0] == pytest.approx(0.9)
+
+
+def test_hybrid_search_finds_entities_by_a_rare_name_token(client, politicians):
+    query = {'query': 'Janata', 'nResults': 1, 'minSimilarity': 0.99}
+
+    assert client.post('/search', json=query).get_json()['entityIds'] == []
+    hybrid = client.post('/search', json=dict(query, mode='hybrid'))
+    assert hybrid.get_json()['entityIds'] == ['Entity/bjp']
+
+
+def test_recreated_collection_uses_the_configured_hnsw_settings(server):
+    assert {key: value for key, value in server.collection.metadata.items() if key.startswith('hnsw:')} == \
+        server.hnsw_collection_metadata()
+
+
+def test_ef_widens_the_candidate_search_but_not_the_results(server, client, politicians):
+    spec = server.parse_search_spec({'query': 'Modi', 'nResults': 2, 'ef': 50})
+    assert server.search_candidate_count(spec) == 50
+
+    response = client.post('/search', json={'query': 'Modi', 'nResults': 2, 'minSimilarity': -1, 'ef': 50,
+                                            'fastPath': False})
+    assert response.status_code == 200
+    assert len(response.get_json()['entityIds']) == 2
+
+    with pytest.raises(ValueError):
+        server.parse_search_spec({'query': 'Modi', 'ef': server.MAX_SEARCH_EF + 1})
+
+
+def test_mmr_gives_near_duplicates_way_to_distinct_candidates(server):
+    vectors = np.asarray([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    relevance = np.asarray([1.0, 0.99, 0.9])
+    assert server.maximal_marginal_relevance(relevance, vectors, 2, 0.5, 'l2') == [0, 2]
+    assert server.maximal_marginal_relevance(relevance, vectors, 2, 1.0, 'l2') == [0, 1]
+
+
+def test_mmr_groups_rule_out_the_rest_of_a_group(server):
+    vectors = np.eye(3, dtype=np.float32)
+    relevance = np.asarray([1.0, 0.99, 0.5])
+    groups = np.asarray(['x', 'x', 'y'], dtype=object)
+    assert server.maximal_marginal_relevance(relevance, vectors, 3, 1.0, 'l2', groups) == [0, 2]
+
+
+def test_rerank_spreads_results_over_distinct_entities(client, add_entities):
+    add_entities(['Entity/a', 'Entity/b', 'Entity/c'], ['Sachin Tendulkar', 'Sachin Tendulkar Jr', 'Sourav Ganguly'])
+    # Unrelated names are more than 1 apart in squared l2, so allow any similarity
+    query = {'query': 'Sachin Tendulkar', 'nResults': 2, 'minSimilarity': -3, 'fastPath': False}
+
+    plain = client.post('/search', json=query).get_json()
+    reranked = client.post('/search', json=dict(query, rerank=True, mmrLambda=0.3)).get_json()
+
+    assert plain['entityIds'] == ['Entity/a', 'Entity/b']
+    assert reranked['entityIds'] == ['Entity/a', 'Entity/c']
+
+
+def test_search_rejects_invalid_parameters_with_400(client, server):
+    for body in ({'query': 'Modi', 'mode': 'fuzzy'}, {'query': 'Modi', 'ef': server.MAX_SEARCH_EF + 1},
+                 {'queryEmbeddingB64': 'not base64!'}):
+        response = client.post('/search', json=body)
+        assert response.status_code == 400, body
+        assert response.get_json()['error']
+
+    partial = client.post('/search', data=b'\0' * 6, content_type='application/octet-stream')
+    assert partial.status_code == 400
+
+
+def test_batch_search_matches_single_searches(client, politicians, embedding_calls):
+    queries = [
+        {'query': 'Narendra Modi', 'nResults': 2, 'minSimilarity': -1},
+        {'query': 'Rahul Gandhi', 'nResults': 3, 'minSimilarity': -1, 'whereFilter': {'type': 'PERSON'}},
+        {'query': 'Janata Party', 'nResults': 1, 'minSimilarity': -1, 'whereFilter': {'type': 'ORG'}},
+    ]
+
+    response = client.post('/search/batch', json={'queries': queries})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['count'] == 3
+    # All queries are embedded with one call
+    assert len(embedding_calls) == 1
+    for query, result in zip(queries, body['results']):
+        assert result == client.post('/search', json=query).get_json()
+    assert body['results'][1]['entityIds'][0] == 'Entity/gandhi'
+    assert all(metadata['type'] == 'PERSON' for metadata in body['results'][1]['metadata'])
+
+
+def test_batch_search_rejects_invalid_requests(client, server, monkeypatch):
+    assert client.post('/search/batch', json={'queries': []}).status_code == 400
+    assert client.post('/search/batch', json={'query': 'Modi'}).status_code == 400
+
+    missing = client.post('/search/batch', json={'queries': [{'query': 'Modi'}, {'nResults': 2}]})
+    assert missing.status_code == 400
+    assert 'queries[1]' in missing.get_json()['error']
+
+    invalid = client.post('/search/batch', json={'queries': [{'query': 'Modi'}, {'query': 'Modi', 'mode': 'fuzzy'}]})
+    assert invalid.status_code == 400
+    assert 'queries[1]' in invalid.get_json()['error']
+
+    monkeypatch.setattr(server, 'MAX_BATCH_QUERIES', 2)
+    too_many = client.post('/search/batch', json={'queries': [{'query': 'a'}, {'query': 'b'}, {'query': 'c'}]})
+    assert too_many.status_code == 400
+
+
+def test_repeated_searches_are_served_from_the_result_cache(client, politicians, embedding_calls):
+    query = {'query': 'Narendra Modi', 'nResults': 2, 'fastPath': False}
+
+    first = client.post('/search', json=query).get_json()
+    second = client.post('/search', json=dict(query, query='  Narendra   Modi'))
+
+    assert second.get_json() == first
+    assert len(embedding_calls) == 1
+
+
+def test_writes_invalidate_cached_search_results(client, server, politicians):
+    query = {'query': 'Yogi Adityanath', 'nResults': 1, 'minSimilarity': 0.9}
+    assert client.post('/search', json=query).get_json()['entityIds'] == []
+
+    response = client.post('/add/stream', data='{"entityId": "Entity/yogi", "entityText": "Yogi Adityanath", '
+                                                '"metadata": {"name": "Yogi Adityanath"}}\n')
+    assert response.status_code == 200
+
+    assert client.post('/search', json=query).get_json()['entityIds'] == ['Entity/yogi']
+
+
+def test_single_flight_coalesces_identical_keys(server):
+    flights = server.SingleFlight()
+    owned, joined = flights.claim(['a', 'b', 'a'])
+    assert owned == [0, 1]
+    assert list(joined) == [2]
+
+    _, waiting = flights.claim(['b'])
+    flights.resolve('a', result='A')
+    flights.resolve('b', error=ValueError('failed'))
+    assert joined[2].result(timeout=1) == 'A'
+    with pytest.raises(ValueError):
+        waiting[0].result(timeout=1)
+    assert flights.stats() == {'inFlight': 0, 'leaders': 2, 'coalesced': 2}
+
+
+def test_concurrent_identical_searches_share_one_query(server, add_entities, monkeypatch):
+    add_entities(['Entity/a'], ['Yogi Adityanath'])
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    original = server.query_vectors
+
+    def slow_query_vectors(*args, **kwargs):
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(server, 'query_vectors', slow_query_vectors)
+    spec = {'query': 'Yogi', 'nResults': 1, 'fastPath': False, 'minSimilarity': -1}
+    results = []
+    leader = threading.Thread(target=lambda: results.append(server.run_searches([server.parse_search_spec(spec)])))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(server.run_searches([server.parse_search_spec(spec)])))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(calls) == 1
+    assert [result[0][0]['entityIds'] for result in results] == [['Entity/a'], ['Entity/a']]
+
+
+def test_collapse_reports_aliases_under_their_canonical_entity(client, add_entities, canonical_map):
+    add_entities(['Entity/a', 'Entity/b'], ['Sonia Gandhi', 'Smt Sonia Gandhi'])
+    canonical_map({'Entity/b': 'Entity/a'}, names={'Entity/a': 'Sonia Gandhi'})
+
+    query = {'query': 'Smt Sonia Gandhi', 'nResults': 2, 'minSimilarity': -1, 'fastPath': False}
+    collapsed = client.post('/search', json=query).get_json()
+    assert collapsed['entityIds'] == ['Entity/a']
+    assert collapsed['metadata'][0]['matchedEntityId'] == 'Entity/b'
+
+    raw = client.post('/search', json=dict(query, collapseDuplicates=False)).get_json()
+    assert raw['entityIds'] == ['Entity/b', 'Entity/a']
+
+
+def test_collapse_widens_until_enough_canonical_entities(client, add_entities, canonical_map):
+    aliases = [f'Entity/js{i}' for i in range(20)]
+    others = [f'Entity/other{i}' for i in range(10)]
+    add_entities(aliases + others, ['John Smith'] * 20 + [f'John Smithers {i}' for i in range(10)])
+    canonical_map({alias: 'Entity/js0' for alias in aliases[1:]})
+
+    for extra in ({}, {'rerank': True}, {'mode': 'hybrid'}):
+        response = client.post('/search', json=dict(
+            {'query': 'John Smith', 'nResults': 5, 'minSimilarity': -1, 'fastPath': False}, **extra
+        ))
+        ids = response.get_json()['entityIds']
+        assert len(ids) == 5, extra
+        assert ids[0] == 'Entity/js0'
+        assert len(set(ids)) == 5
+
+    raw = client.post('/search', json={'query': 'John Smith', 'nResults': 5, 'minSimilarity': -1, 'fastPath': False,
+                                       'collapseDuplicates': False}).get_json()
+    assert all(entity_id.startswith('Entity/js') for entity_id in raw['entityIds'])
+
+
+def test_collapse_returns_fewer_when_the_collection_runs_out(client, add_entities, canonical_map):
+    add_entities(['Entity/a', 'Entity/b', 'Entity/c'], ['Sonia Gandhi', 'Sonia Gandhi', 'Priyanka Gandhi'])
+    canonical_map({'Entity/b': 'Entity/a'})
+
+    response = client.post('/search', json={'query': 'Sonia Gandhi', 'nResults': 3, 'minSimilarity': -1, 'fastPath': False})
+    assert response.get_json()['entityIds'] == ['Entity/a', 'Entity/c']
@@ -0,0 +1,84 @@
+import pytest
+
+
+@pytest.fixture
+def sync_state(server, tmp_path):
+    state = server.EntitySyncState(str(tmp_path / 'sync_state.sqlite3'), model='test-model')
+    yield state
+    state.close()
+
+
+def entity(key, name, **fields):
+    return dict({'_key': key, 'name': name, 'ne_count': 1}, **fields)
+
+
+def test_sync_tolerates_missing_and_mixed_type_updated_values(server, sync_state, write_jsonl):
+    path = write_jsonl('entities.jsonl', [
+        entity('a', 'Hemant Soren', updated=3),
+        entity('b', 'Champai Soren'),
+        entity('c', 'Babulal Marandi', updated='2024-01-01'),
+        entity('d', 'Arjun Munda', updated=1),
+    ])
+
+    totals = server.sync_entities(server.JsonlEntitySource(path), sync_state, updated_field='updated')
+
+    assert totals['upserted'] == 4
+    assert server.collection.count() == 4
+    # Strings order after numbers, as in ArangoDB
+    assert totals['watermark'] == '2024-01-01'
+
+
+def test_update_order_key_follows_arangodb_type_order(server):
+    values = ['b', 2, None, True, 'a', 1.5, {'x': 1}]
+    assert sorted(values, key=server.update_order_key) == [None, True, 1.5, 2, 'a', 'b', {'x': 1}]
+
+
+def test_sync_only_writes_changed_entities_and_deletes_removed_ones(server, sync_state, write_jsonl):
+    documents = [entity('a', 'Pinarayi Vijayan'), entity('b', 'Oommen Chandy'), entity('c', 'V S Achuthanandan')]
+    source = server.JsonlEntitySource(write_jsonl('entities.jsonl', documents))
+    assert server.sync_entities(source, sync_state, updated_field='')['upserted'] == 3
+
+    unchanged = server.sync_entities(source, sync_state, updated_field='')
+    assert (unchanged['upserted'], unchanged['unchanged'], unchanged['deleted']) == (0, 3, 0)
+
+    documents[0]['ne_count'] = 7
+    documents[1]['name'] = 'Oommen Chandy (former CM)'
+    source = server.JsonlEntitySource(write_jsonl('entities.jsonl', documents[:2]))
+    changed = server.sync_entities(source, sync_state, updated_field='')
+    assert (changed['upserted'], changed['deleted']) == (2, 1)
+
+    stored = server.collection.get(ids=['Entity/a', 'Entity/b', 'Entity/c'], include=['metadatas', 'documents'])
+    by_id = dict(zip(stored['ids'], zip(stored['documents'], stored['metadatas'])))
+    assert set(by_id) == {'Entity/a', 'Entity/b'}
+    assert by_id['Entity/a'][1]['mentions'] == 7
+    assert by_id['Entity/b'][0] == 'Oommen Chandy (former CM)'
+
+
+def test_incremental_sync_reads_past_the_watermark(server, sync_state, write_jsonl):
+    documents = [entity('a', 'Siddaramaiah', updated=1), entity('b', 'D K Shivakumar', updated=2)]
+    path = write_jsonl('entities.jsonl', documents)
+    server.sync_entities(server.JsonlEntitySource(path), sync_state, updated_field='updated')
+
+    documents.append(entity('c', 'B S Yediyurappa', updated=3))
+    path = write_jsonl('entities.jsonl', documents)
+    totals = server.sync_entities(server.JsonlEntitySource(path), sync_state, updated_field='updated')
+
+    assert totals['mode'] == 'incremental'
+    # The document at the watermark is read again but skipped by its content hash
+    assert (totals['scanned'], totals['unchanged'], totals['upserted'], totals['deleted']) == (2, 1, 1, 0)
+    assert totals['watermark'] == 3
+    assert server.collection.count() == 3
+
+
+def test_incremental_sync_picks_up_documents_sharing_the_watermark(server, sync_state, write_jsonl):
+    documents = [entity('a', 'Siddaramaiah', updated=1), entity('b', 'D K Shivakumar', updated=2)]
+    path = write_jsonl('entities.jsonl', documents)
+    server.sync_entities(server.JsonlEntitySource(path), sync_state, updated_field='updated')
+
+    # Written in the same tick as 'b', but committed after the last sync read
+    documents.append(entity('c', 'B S Yediyurappa', updated=2))
+    path = write_jsonl('entities.jsonl', documents)
+    totals = server.sync_entities(server.JsonlEntitySource(path), sync_state, updated_field='updated')
+
+    assert totals['upserted'] == 1
+    assert server.collection.count() == 3
@@ -0,0 +1,146 @@
+import threading
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def corpus(server):
+    rng = np.random.default_rng(7)
+    matrix = rng.standard_normal((400, server.EMBEDDING_TARGET_DIM)).astype(np.float32)
+    ids = [f'e{i}' for i in range(len(matrix))]
+    metadatas = [{'name': entity_id, 'type': 'PERSON' if i % 2 else 'PLACE'} for i, entity_id in enumerate(ids)]
+    return ids, matrix, metadatas
+
+
+@pytest.fixture
+def quantized(server, corpus):
+    """
+    An int8 index over the corpus; the corpus is also stored in the collection for re-ranking.
+    """
+    ids, matrix, metadatas = corpus
+    server.collection.upsert(ids=ids, embeddings=matrix.tolist(), metadatas=metadatas)
+    index = server.QuantizedVectorIndex(server.get_entities)
+    index.add(ids, [None] * len(ids), metadatas, matrix)
+    yield index
+    index.clear()
+
+
+def exact_top(server, matrix, query, k):
+    return set(np.argsort(server.vector_distances(query, matrix, 'l2'))[:k].tolist())
+
+
+def test_int8_engine_recall_matches_exact_search(server, corpus, quantized):
+    _, matrix, _ = corpus
+    queries = np.random.default_rng(8).standard_normal((10, server.EMBEDDING_TARGET_DIM)).astype(np.float32)
+
+    results = quantized.query(queries, 10)
+
+    recall = np.mean([
+        len({int(entity_id[1:]) for entity_id in found} & exact_top(server, matrix, query, 10)) / 10
+        for query, found in zip(queries, results['ids'])
+    ])
+    assert recall >= 0.95
+    for distances in results['distances']:
+        assert distances == sorted(distances)
+
+
+def test_int8_engine_applies_where_filters(server, corpus, quantized):
+    _, matrix, _ = corpus
+    query = matrix[3]
+
+    results = quantized.query([query], 5, where={'type': 'PERSON'})
+
+    assert results['ids'][0][0] == 'e3'
+    assert all(metadata['type'] == 'PERSON' for metadata in results['metadatas'][0])
+
+
+def test_int8_rerank_fetches_only_vectors(server, corpus, quantized, monkeypatch):
+    _, matrix, _ = corpus
+    fetches = []
+
+    class RecordingCollection:
+        def __getattr__(self, name):
+            return getattr(collection, name)
+
+        def get(self, **kwargs):
+            fetches.append(kwargs['include'])
+            return collection.get(**kwargs)
+
+    collection = server.collection
+    monkeypatch.setattr(server, 'collection', RecordingCollection())
+
+    results = quantized.query([matrix[5]], 3)
+
+    assert fetches == [['embeddings']]
+    assert results['ids'][0][0] == 'e5'
+    assert results['metadatas'][0][0] == {'name': 'e5', 'type': 'PERSON'}
+
+
+def test_int8_results_stay_consistent_under_concurrent_removes(server, corpus, quantized):
+    ids, matrix, _ = corpus
+    errors = []
+    stop = threading.Event()
+
+    def remove():
+        for entity_id in ids[::3]:
+            quantized.remove([entity_id])
+        stop.set()
+
+    def search():
+        while not stop.is_set():
+            results = quantized.query(matrix[:4], 10)
+            for found, metadatas in zip(results['ids'], results['metadatas']):
+                errors.extend((entity_id, metadata['name']) for entity_id, metadata in zip(found, metadatas)
+                              if metadata['name'] != entity_id)
+
+    searchers = [threading.Thread(target=search) for _ in range(3)]
+    for searcher in searchers:
+        searcher.start()
+    remove()
+    for searcher in searchers:
+        searcher.join(10)
+
+    assert errors == []
+    assert quantized.stats()['vectors'] == len(ids) - len(ids[::3])
+    assert 'e0' not in quantized.query([matrix[0]], 5)['ids'][0]
+
+
+@pytest.mark.parametrize('mode', ['type', 'hash'])
+def test_partitioned_collection_merges_partition_results(server, corpus, mode):
+    ids, matrix, metadatas = corpus
+    partitioned = server.PartitionedCollection(server.client, f'partition_test_{mode}', mode, field='type', count=3)
+    try:
+        partitioned.upsert(ids=ids, embeddings=matrix, documents=ids, metadatas=metadatas)
+        assert partitioned.count() == len(ids)
+
+        query = (matrix[10] + 0.01).tolist()
+        results = partitioned.query([query], n_results=8)
+        assert results['ids'][0][0] == 'e10'
+        # The merge is the best 8 of every partition's own top 8
+        candidates = []
+        for partition in partitioned.partitions_for():
+            found = partition.query(query_embeddings=[query], n_results=8, include=['distances'])
+            candidates.extend(zip(found['distances'][0], found['ids'][0]))
+        assert results['ids'][0] == [entity_id for _, entity_id in sorted(candidates)[:8]]
+
+        filtered = partitioned.query([query], n_results=5, where={'type': 'PLACE'})
+        assert len(filtered['ids'][0]) == 5
+        assert all(metadata['type'] == 'PLACE' for metadata in filtered['metadatas'][0])
+
+        page = partitioned.get(limit=50, offset=100)
+        assert len(page['ids']) == 50
+    finally:
+        partitioned.drop()
+
+
+def test_type_partitioning_routes_pinned_filters_to_one_partition(server, corpus):
+    ids, matrix, metadatas = corpus
+    partitioned = server.PartitionedCollection(server.client, 'partition_test_routing', 'type', field='type')
+    try:
+        partitioned.upsert(ids=ids, embeddings=matrix, documents=ids, metadatas=metadatas)
+
+        assert len(partitioned.partitions_for()) == 2
+        assert len(partitioned.partitions_for({'type': 'PERSON'})) == 1
+    finally:
+        partitioned.drop()
@@ -0,0 +1,41 @@
+import base64
+
+import numpy as np
+import pytest
+
+
+def test_vectors_round_trip_through_base64(server):
+    matrix = np.random.default_rng(0).random((3, server.EMBEDDING_TARGET_DIM), dtype=np.float32)
+
+    decoded = server.decode_vectors(server.encode_vectors_b64(matrix))
+
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, matrix)
+
+
+def test_decoded_vectors_are_fitted_to_the_collection_dimension(server):
+    short = np.ones((2, 4), dtype='<f4')
+
+    decoded = server.decode_vectors(short.tobytes(), dim=4)
+
+    assert decoded.shape == (2, server.EMBEDDING_TARGET_DIM)
+    assert decoded[:, :4].sum() == 8 and not decoded[:, 4:].any()
+
+
+def test_decode_rejects_partial_vectors(server):
+    with pytest.raises(ValueError):
+        server.decode_vectors(base64.b64encode(b'\0' * 6).decode('ascii'), dim=1)
+
+
+def test_search_accepts_precomputed_query_vectors(server, client, add_entities):
+    add_entities(['Entity/modi', 'Entity/gandhi'], ['Narendra Modi', 'Rahul Gandhi'])
+    vector = server.embed_documents(['Rahul Gandhi'])[0]
+    raw = vector.astype('<f4').tobytes()
+
+    as_list = client.post('/search', json={'queryEmbedding': vector.tolist(), 'nResults': 1})
+    as_b64 = client.post('/search', json={'queryEmbeddingB64': base64.b64encode(raw).decode('ascii'), 'nResults': 1})
+    as_bytes = client.post('/search?nResults=1', data=raw, content_type='application/octet-stream')
+
+    for response in (as_list, as_b64, as_bytes):
+        assert response.status_code == 200
+        assert response.get_json()['entityIds'] == ['Entity/gandhi']
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def warmup_state(server, monkeypatch):
+    state = {'ready': False, 'readyAt': None, 'startupSeconds': None, 'steps': {}}
+    monkeypatch.setattr(server, 'WARMUP_STATE', state)
+    return state
+
+
+def test_ready_reports_503_until_warm_up_finishes(server, client, warmup_state, add_entities, monkeypatch):
+    add_entities(['Entity/modi'], ['Narendra Modi'])
+    monkeypatch.setattr(server, 'WARMUP_ENABLED', True)
+    monkeypatch.setattr(server, 'WARMUP_QUERIES', ['India'])
+
+    assert client.get('/ready').status_code == 503
+
+    server.warm_up()
+
+    response = client.get('/ready')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'ready'
+    assert set(body['steps']) == {'entityIndexes', 'embeddingModel', 'vectorIndex'}
+    assert all(step['ok'] for step in body['steps'].values())
+
+
+def test_failed_warm_up_steps_do_not_keep_the_server_unready(server, client, warmup_state, monkeypatch):
+    def fail():
+        raise RuntimeError('model not loaded')
+
+    monkeypatch.setattr(server, 'WARMUP_ENABLED', True)
+    monkeypatch.setattr(server, 'warm_vector_index', fail)
+
+    server.warm_up()
+
+    body = client.get('/ready').get_json()
+    assert body['ready']
+    assert not body['steps']['vectorIndex']['ok']
+    assert body['steps']['vectorIndex']['error'] == 'model not loaded'
+
+
+def test_importing_the_module_starts_no_background_work(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != 'WARMUP_ENABLED'}
+    env['PYTHONPATH'] = ROOT
+    script = (
+        "import threading, chroma_server\n"
+        "print(sorted(thread.name for thread in threading.enumerate()"
+        " if thread.name in ('warm-up', 'entity-index-loader', 'entity-sync')))\n"
+        "print(chroma_server.WARMUP_STATE['ready'])\n"
+    )
+    completed = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env,
+                               capture_output=True, text=True, timeout=120)
+
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.split('\n')[-3:-1] == ['[]', 'False']